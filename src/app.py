@@ -1,26 +1,34 @@
+import argparse
 import json
 import asyncio
+import datetime
 import logging
-import sys
+import random
+import tempfile
+import time
+import uuid
 
-from prompts import News, Tasks, Picture
+from prompts import News, Tasks, Picture, n_questions
 from openai_api import OpenaiAPI
 from gemini_api import GeminiAPI
-from config import Config, Model
+from config import Config, Model, Parameter
 from tg_api import TelegramBot
-from crud import get_random_words
+from crud import get_random_words, get_words_by_ids, get_daily_news, claim_daily_news, renew_daily_news, \
+    store_daily_news, release_daily_news, get_planned_chats
+from validation import validate_questions
+from dedup import DuplicateIndex, question_text
+from log_config import setup_logging, LazyJson
+from http_client import aclose_async_http_client
+from word_index import get_word_index
+from verification import verify
+import token_budget
+import profiling
+from cassette import REPLAY, open_cassette
 
 
 LANGUAGES = ['english', 'spanish']
-
-# Configure logging to use StreamHandler to direct logs to stdout
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s %(levelname)s %(message)s',
-    handlers=[
-        logging.StreamHandler(sys.stdout)
-    ]
-)
+# Word picks; not the global generator, see cassette.Cassette
+_word_rng = random.Random()
 
 
 def _preview_text(text: str, head: int = 500, tail: int = 500) -> str:
@@ -38,188 +46,468 @@ def _truncate_for_tg(text: str, limit: int = 3500) -> str:
         return text
     return f"{text[:limit]}\n...<truncated {len(text) - limit} chars>..."
 
-def get_news(main_model, second_model) -> list:
-    news = News()
+async def generate_news(model, bot: TelegramBot, date: datetime.date = None) -> list:
+    news = News(date=date)
     news_prompt = news.get_prompt()
     logging.info(
         "News generation: prompt sizes=%s",
         [len(m.get('content', '') or '') for m in news_prompt]
     )
     try:
-        news_str = second_model.generate_response(messages=news_prompt[0]['content'] + news_prompt[1]['content'])
+        news_str = await model.agenerate_response(messages=news_prompt[0]['content'] + news_prompt[1]['content'],
+                                                  call_type=token_budget.NEWS)
     except Exception:
-        logging.exception("News generation failed during model.generate_response")
+        logging.exception("News generation failed during model.agenerate_response")
         raise
 
     logging.info("News generation: response length=%s", len(news_str or ""))
-    logging.info("News generation: response preview=%s", _preview_text(news_str or ""))
+    logging.debug("News generation: response=%s", news_str)
     try:
         news_lst = json.loads(news_str)
-        logging.info(f"Generated News: {news_lst}")
+        logging.info("Generated News: %s item(s)", len(news_lst))
+        logging.debug("Generated News: %s", LazyJson(news_lst))
     except json.decoder.JSONDecodeError as e:
-        logging.error(f"Most likely the News are not in json: {e}")
-        logging.info(f"The prompt: {news_prompt[0]['content']}. The output: {news_str}")
-        asyncio.run(
-            bot.send_message(
-                chat_id=Config.LOG_CHANNEL_ID['log'],
-                message=_truncate_for_tg(news_str or "")
-            )
+        logging.error("Most likely the News are not in json: %s", e)
+        logging.info("News JSON parse failed: raw_output_preview=%s", _preview_text(news_str or ""))
+        logging.debug("The prompt: %s. The output: %s", news_prompt[0]['content'], news_str)
+        await bot.send_message(
+            chat_id=Config.LOG_CHANNEL_ID['log'],
+            message=_truncate_for_tg(news_str or "")
         )
         raise ValueError("Failed to get news in JSON format")
     return news_lst
 
 
-def get_quizzes(model, news: list) -> dict:
-    questions = {}
-    for language in LANGUAGES:
-        daily_word = get_random_words(language, 1)[0].word
-        tasks = Tasks(news=news, language=language, word=daily_word)
-        questions_prompts = tasks.get_prompt()
+async def generate_unique_news(model, bot: TelegramBot, news_index: DuplicateIndex = None,
+                               date: datetime.date = None) -> list:
+    """Generates `n_questions` news items none of which repeats already published news.
 
-        logging.info(
-            "Quiz generation start: language=%s daily_word=%s prompt_messages=%s prompt_sizes=%s",
-            language,
-            daily_word,
-            len(questions_prompts),
-            [len(m.get('content', '') or '') for m in questions_prompts]
-        )
+    Near-duplicate items are dropped and the news regenerated; fresh items of every attempt
+    are kept, so a later attempt only has to make up the missing ones. Raises ValueError when
+    `Parameter.DEDUP_ATTEMPTS` regenerations still leave too few fresh items.
+    """
+    unique = []
+    for attempt in range(Parameter.DEDUP_ATTEMPTS + 1):
+        news_lst = await generate_news(model, bot, date=date)
+        if news_index is None:
+            return news_lst
+        seen = {n['text'] for n in unique}
+        duplicates = []
+        for n in news_lst:
+            text = n.get('text', '')
+            if news_index.is_duplicate(text):
+                duplicates.append(text)
+            elif text and text not in seen:
+                unique.append(n)
+                seen.add(text)
+        if len(unique) >= n_questions:
+            break
+        logging.warning("News near-duplicates of published news (attempt %s): %s", attempt + 1, duplicates)
+    if len(unique) < n_questions:
+        raise ValueError(f"Only {len(unique)} of {n_questions} news items are not near-duplicates "
+                         f"of published news after {Parameter.DEDUP_ATTEMPTS + 1} attempts")
+    return [{**n, 'id': i + 1} for i, n in enumerate(unique[:n_questions])]
+
+
+async def _keep_news_claim(date: datetime.date, owner: str):
+    """Renews `owner`'s claim every third of the lease until cancelled or the claim is lost.
+
+    Generation with all its retries can outlast one lease; a live worker must not lose the
+    date to a waiting one.
+    """
+    while True:
+        await asyncio.sleep(Parameter.NEWS_LEASE_SECONDS / 3)
         try:
-            questions_str = model.generate_response(messages=questions_prompts)
-        except Exception:
-            logging.exception(
-                "Quiz generation failed during model.generate_response (language=%s)",
-                language
-            )
-            raise
-
-        questions_str = questions_str or ""
+            renewed = await asyncio.to_thread(renew_daily_news, date, owner)
+        except Exception as e:
+            logging.warning("News of %s: could not renew claim %s: %s", date, owner, e)
+            continue
+        if not renewed:
+            logging.warning("News of %s: claim %s was taken over, no longer renewing it", date, owner)
+            return
+
+
+async def get_news(main_model, second_model, bot: TelegramBot, news_index: DuplicateIndex = None,
+                   date: datetime.date = None, shared: bool = None) -> list:
+    """The news of `date` (default today), generated once and shared through the DailyNews store.
+
+    The first caller of a date claims it and generates the news; concurrent callers, in this
+    or another process, poll the store and reuse the stored list. The generating worker renews
+    its claim while it works; if it fails, or generates no news, the claim is released, and if
+    it dies the claim expires after `Parameter.NEWS_LEASE_SECONDS`. Either way a waiting caller
+    claims the date next.
+    With `shared=False` (default: `not Parameter.NEWS_STORE`) the store is bypassed.
+    """
+    date = date or datetime.date.today()
+    shared = Parameter.NEWS_STORE if shared is None else shared
+    if not shared:
+        return await generate_unique_news(second_model, bot, news_index=news_index, date=date)
+    owner = uuid.uuid4().hex
+    waiting = False
+    while True:
+        stored = await asyncio.to_thread(get_daily_news, date)
+        if stored is not None and stored.status == 'ready':
+            news_lst = json.loads(stored.news)
+            logging.info("News of %s reused from the news store: %s item(s)", date, len(news_lst))
+            return news_lst
+        if await asyncio.to_thread(claim_daily_news, date, owner, Parameter.NEWS_LEASE_SECONDS):
+            logging.info("News of %s claimed for generation (claim %s)", date, owner)
+            keeper = asyncio.ensure_future(_keep_news_claim(date, owner))
+            try:
+                news_lst = await generate_unique_news(second_model, bot, news_index=news_index, date=date)
+                if not news_lst:
+                    raise ValueError(f"No news generated for {date}")
+                published = await asyncio.to_thread(store_daily_news, date, owner, news_lst)
+            except BaseException:
+                await asyncio.to_thread(release_daily_news, date, owner)
+                raise
+            finally:
+                keeper.cancel()
+            if published:
+                return news_lst
+            # The claim expired and another worker took over: use its news for consistency
+            logging.warning("News of %s: claim %s expired during generation, reusing the stored news", date, owner)
+            continue
+        if not waiting:
+            logging.info("News of %s is being generated by another worker, waiting for it", date)
+            waiting = True
+        await asyncio.sleep(Parameter.NEWS_POLL_SECONDS)
+
+
+def pick_daily_words(language: str, news: list, count: int) -> list:
+    """Picks `count` words related to the day's news from the language's embedding index.
+
+    Words are drawn at random among the `Parameter.DAILY_WORD_CANDIDATES` most similar ones
+    for some variety; falls back to purely random words when the index is empty.
+    """
+    index = get_word_index(language)
+    index.sync()
+    hits = index.search(" ".join(n.get('text', '') for n in news), k=max(count, Parameter.DAILY_WORD_CANDIDATES))
+    if hits:
+        ids = _word_rng.sample([word_id for word_id, _ in hits], k=min(count, len(hits)))
+        words = get_words_by_ids(ids)
+        if words:
+            logging.info("Daily words for %s picked from the news index: %s", language, [w.word for w in words])
+            return [w.word for w in words]
+    return [w.word for w in get_random_words(language, count)]
+
+
+def _parse_single_question(answer_str):
+    """The question dict of a per-question response (a one-item list or a bare object), or None."""
+    try:
+        answer = json.loads(answer_str)
+    except (TypeError, json.decoder.JSONDecodeError):
+        return None
+    if isinstance(answer, list) and len(answer) == 1:
+        answer = answer[0]
+    return answer if isinstance(answer, dict) else None
+
+
+async def _generate_per_question(model, tasks: Tasks, language: str, bot: TelegramBot) -> list:
+    """Generates every question of `tasks` in its own concurrent call.
+
+    Ids come from the mapping entry each prompt was built from, whatever the model wrote, and a
+    malformed answer only costs its own question.
+    """
+    started = time.perf_counter()
+    prompts = tasks.get_question_prompts()
+    answers = await asyncio.gather(*(model.agenerate_response(messages=prompt, call_type=token_budget.QUIZ_QUESTION)
+                                     for prompt in prompts))
+    questions_lst = []
+    for d, answer_str in zip(tasks.question_grammar_news_mapping, answers):
+        question = _parse_single_question(answer_str)
+        if question is None:
+            logging.error("Quiz generation: language=%s question_id=%s is not a JSON question: %s",
+                          language, d['question_id'], _preview_text(answer_str or ""))
+            continue
+        question['question_id'] = d['question_id']
+        questions_lst.append(question)
+    logging.info("Generated Quizzes: language=%s count=%s of %s, per-question mode, %.1fs",
+                 language, len(questions_lst), len(prompts), time.perf_counter() - started)
+    logging.debug("Generated Quizzes: language=%s quizzes=%s", language, LazyJson(questions_lst))
+    if not questions_lst:
+        error_msg = f"None of the {len(prompts)} {language} questions came back in json format"
+        logging.error(error_msg)
+        await bot.send_message(chat_id=Config.LOG_CHANNEL_ID['log'], message=_truncate_for_tg(error_msg))
+        raise ValueError(error_msg)
+    return questions_lst
+
+
+async def _generate_language(model, tasks: Tasks, daily_words: list, bot: TelegramBot, language: str,
+                             quiz_mix: str, mode: str) -> list:
+    """The questions of one language, in one batch call or in per-question calls."""
+    if mode == 'per_question':
+        return await _generate_per_question(model, tasks, language, bot)
+    questions_prompts = tasks.get_prompt()
+
+    logging.info(
+        "Quiz generation start: language=%s quiz_mix=%s daily_words=%s prompt_messages=%s prompt_sizes=%s",
+        language,
+        quiz_mix,
+        daily_words,
+        len(questions_prompts),
+        [len(m.get('content', '') or '') for m in questions_prompts]
+    )
+    try:
+        questions_str = await model.agenerate_response(messages=questions_prompts, call_type=token_budget.QUIZ)
+    except Exception:
+        logging.exception(
+            "Quiz generation failed during model.agenerate_response (language=%s)",
+            language
+        )
+        raise
+
+    questions_str = questions_str or ""
+    logging.info(
+        "Quiz generation: language=%s response length=%s",
+        language,
+        len(questions_str)
+    )
+    logging.debug("Quiz generation: language=%s response=%s", language, questions_str)
+    if not questions_str.strip():
+        logging.error(
+            "Quiz generation: language=%s got empty/whitespace response; cannot parse JSON",
+            language
+        )
+    try:
+        questions_lst = json.loads(questions_str)
+        logging.info("Generated Quizzes: language=%s count=%s", language, len(questions_lst))
+        logging.debug("Generated Quizzes: language=%s quizzes=%s", language, LazyJson(questions_lst))
+    except json.decoder.JSONDecodeError as e:
+        error_msg = f"Most likely the Quizzes are not in json format: {e}"
+        logging.error(error_msg)
         logging.info(
-            "Quiz generation: language=%s response length=%s",
+            "Quiz JSON parse failed: language=%s prompt_preview=%s",
             language,
-            len(questions_str)
+            _preview_text((questions_prompts[1].get('content') or "") if len(questions_prompts) > 1 else "")
         )
         logging.info(
-            "Quiz generation: language=%s response preview=%s",
+            "Quiz JSON parse failed: language=%s raw_output_preview=%s",
             language,
             _preview_text(questions_str)
         )
-        if not questions_str.strip():
-            logging.error(
-                "Quiz generation: language=%s got empty/whitespace response; cannot parse JSON",
-                language
-            )
-        try:
-            questions[language] = json.loads(questions_str)
-            logging.info(f"Generated Quizzes: {questions[language]}")
-        except json.decoder.JSONDecodeError as e:
-            error_msg = f"Most likely the Quizzes are not in json format: {e}"
-            logging.error(error_msg)
-            logging.info(
-                "Quiz JSON parse failed: language=%s prompt_preview=%s",
-                language,
-                _preview_text((questions_prompts[1].get('content') or "") if len(questions_prompts) > 1 else "")
-            )
-            logging.info(
-                "Quiz JSON parse failed: language=%s raw_output_preview=%s",
-                language,
-                _preview_text(questions_str)
-            )
-            asyncio.run(bot.send_message(chat_id=Config.LOG_CHANNEL_ID['log'],
-                                         message=_truncate_for_tg(
-                                             ((questions_prompts[1].get('content') or "") if len(questions_prompts) > 1 else "")
-                                             + "\n\nOUTPUT:\n"
-                                             + questions_str
-                                         )))
-            raise ValueError(error_msg)
-    return questions
-
-
-def verify(gemini_model: GeminiAPI, openai_model: OpenaiAPI, questions: dict) -> dict:
-    good_questions = {language: [] for language in LANGUAGES}
-    bad_questions = {language: [] for language in LANGUAGES}
-    initial_opinion = {language: [] for language in LANGUAGES}
-    second_opinion = {language: [] for language in LANGUAGES}
-    third_opinion = {language: [] for language in LANGUAGES}
-
-    for language in LANGUAGES:
-        for q in questions[language]:
-            d = {'question_id': q['question_id'], 'correct_options': []}
-            d['correct_options'].append(q['options'][q['correct_option_id']])
-            initial_opinion[language].append(d)
-        # second and third opinions for verification
-        tasks = Tasks(news=news_lst, language=language)
-        verification_prompt = tasks.verify(questions[language])
-        gemini_verif_str = gemini_model.generate_response(
-            messages=verification_prompt[0]['content'] + " " + verification_prompt[1]['content'])
-        try:
-            second_opinion[language] = json.loads(gemini_verif_str)
-            logging.info(f"Generated Verification: {second_opinion[language]}")
-        except Exception as e:
-            logging.error(f"Most likely Gemini Verification is not in json format: {e}")
-            logging.info(f"The prompt: {verification_prompt[1]['content']}")
-            logging.info(f"The output: {json.dumps(gemini_verif_str)}")
-            second_opinion[language] = initial_opinion[language]
+        await bot.send_message(chat_id=Config.LOG_CHANNEL_ID['log'],
+                               message=_truncate_for_tg(
+                                   ((questions_prompts[1].get('content') or "") if len(questions_prompts) > 1 else "")
+                                   + "\n\nOUTPUT:\n"
+                                   + questions_str
+                               ))
+        raise ValueError(error_msg)
+    return questions_lst
 
-        openai_verif_str = openai_model.generate_response(messages=verification_prompt)
-        try:
-            third_opinion[language] = json.loads(openai_verif_str)
-            logging.info(f"Generated Verification: {third_opinion[language]}")
-        except Exception as e:
-            logging.error(f"Most likely OpenAi Verification is not in json format: {e}")
-            logging.info(f"The prompt: {verification_prompt[1]['content']}")
-            logging.info(f"The output: {json.dumps(openai_verif_str)}")
-            third_opinion[language] = initial_opinion[language]
-
-        for q, op2, op3 in zip(questions[language], second_opinion[language], third_opinion[language]):
-            if len(q['options']) != len(set(q['options'])):
-                bad_questions[language].append(q)
-                continue
-            if len(op2['correct_options']) != 1 or len(op3['correct_options']) != 1:
-                bad_questions[language].append(q)
+
+async def get_quizzes(model, news: list, bot: TelegramBot, languages: list = None, quiz_mix: str = 'grammar',
+                      mode: str = None, pick_words=None) -> dict:
+    """Generates one quiz set per language, all languages concurrently; `quiz_mix` (see
+    `Parameter.QUIZ_MIX`) sets how many of the questions are word definitions rather than
+    grammar questions.
+
+    `mode` (default `Parameter.QUIZ_GENERATION_MODE`) is 'batch', one call writing all questions
+    of a language, or 'per_question', one concurrent call per question. `pick_words` (default
+    `pick_daily_words`) chooses the words of the definition questions.
+    """
+    languages = languages or LANGUAGES
+    mode = mode or Parameter.QUIZ_GENERATION_MODE
+    pick_words = pick_words or pick_daily_words
+    n_words = Parameter.QUIZ_MIX[quiz_mix]
+    # Index sync and DB reads block: keep them off the event loop
+    daily_words = await asyncio.gather(*(asyncio.to_thread(pick_words, language, news, n_words)
+                                         for language in languages))
+    # Tasks draw their topics from the global generator: in language order, so that a seeded
+    # run draws the same ones whichever word pick finished first
+    tasks = [Tasks(news=news, language=language, word=words, n_words=n_words)
+             for language, words in zip(languages, daily_words)]
+    results = await asyncio.gather(*(_generate_language(model, language_tasks, words, bot, language, quiz_mix, mode)
+                                     for language, language_tasks, words in zip(languages, tasks, daily_words)))
+    return dict(zip(languages, results))
+
+
+async def validate_quizzes(model, questions: dict, news: list, question_index: DuplicateIndex = None) -> dict:
+    """Enforces the quiz schema and Telegram poll limits before any verification call.
+
+    Questions that nearly repeat published ones (per `question_index`) count as invalid too.
+    Locally invalid questions are sent back to the generator with the reasons; whatever is
+    still invalid after `Parameter.REGENERATION_ATTEMPTS` rounds is dropped.
+    """
+    valid, invalid = validate_questions(questions, question_index)
+    for attempt in range(Parameter.REGENERATION_ATTEMPTS):
+        if not any(invalid.values()):
+            break
+        for language, items in invalid.items():
+            if not items:
                 continue
-            if op2['correct_options'][0] != q['options'][q['correct_option_id']]:
-                bad_questions[language].append(q)
+            logging.warning("Regenerating %s invalid %s question(s) (attempt %s): %s",
+                            len(items), language, attempt + 1, LazyJson([item['errors'] for item in items]))
+            pending_ids = {str(item['question'].get('question_id')) for item in items
+                           if isinstance(item['question'], dict)}
+            regenerated_str = await model.agenerate_response(messages=Tasks(news=news, language=language).regenerate(items),
+                                                             call_type=token_budget.QUIZ_REGENERATE)
+            try:
+                regenerated = json.loads(regenerated_str)
+            except (TypeError, json.decoder.JSONDecodeError) as e:
+                logging.error("Most likely the regenerated Quizzes are not in json format: %s", e)
                 continue
-            if op3['correct_options'][0] != q['options'][q['correct_option_id']]:
-                bad_questions[language].append(q)
+            if isinstance(regenerated, dict):
+                regenerated = [regenerated]
+            if not isinstance(regenerated, list):
                 continue
-            good_questions[language].append(q)
+            fixed, still_invalid = validate_questions(
+                {language: [q for q in regenerated if isinstance(q, dict) and str(q.get('question_id')) in pending_ids]},
+                question_index)
+            retried_ids = {str(q['question_id']) for q in fixed[language]}
+            retried_ids.update(str(item['question'].get('question_id')) for item in still_invalid[language])
+            valid[language].extend(fixed[language])
+            # Rewrites that are still invalid carry their new errors; questions the model skipped keep the old ones
+            invalid[language] = still_invalid[language] + [
+                item for item in items
+                if not isinstance(item['question'], dict) or str(item['question'].get('question_id')) not in retried_ids]
+        for language in valid:
+            valid[language].sort(key=lambda q: q['question_id'])
 
-    logging.info(f"Questions: {json.dumps(questions)}")
-    logging.info(f"The second opinion: {json.dumps(second_opinion)}")
-    logging.info(f"The third opinion: {json.dumps(third_opinion)}")
-    logging.info(f"Bad questions: {json.dumps(bad_questions)}")
-    return {'good': good_questions, 'bad': bad_questions}
+    for language, items in invalid.items():
+        if items:
+            logging.error("Dropping %s %s question(s) that failed validation: %s",
+                          len(items), language, LazyJson([item['errors'] for item in items]))
+            logging.debug("Dropped %s questions: %s", language, LazyJson(items))
+    return valid
 
 
-def generate_image(image_model, topic: dict) -> dict:
+async def generate_image(image_model, topic: dict) -> dict:
     images = {}
     picture = Picture()
-    for language in LANGUAGES:
-        picture_prompt = picture.get_picture_prompt(text=json.dumps(topic[language][0]))
-        image = image_model.generate_image(prompt=picture_prompt)
+    for language, questions_lst in topic.items():
+        if not questions_lst:
+            continue
+        picture_prompt = picture.get_picture_prompt(text=json.dumps(questions_lst[0]))
+        image = await image_model.agenerate_image(prompt=picture_prompt)
         images[language] = image
     return images
 
 
-if __name__ == "__main__":
-    openai = OpenaiAPI(api_key=Config.OPENAI_API_KEY, model=Model.model_1)
-    gemini = GeminiAPI(api_key=Config.GEMINI_API_KEY, model=Model.model_2)
-    bot = TelegramBot(token=Config.TG_TOKEN)
+async def run_pipeline(openai: OpenaiAPI, gemini: GeminiAPI, bot: TelegramBot, languages: list = None,
+                       quiz_mix: str = None, news_index: DuplicateIndex = None,
+                       question_index: DuplicateIndex = None, news_date: datetime.date = None,
+                       shared_news: bool = None, resume_plans: bool = True, pick_words=None) -> dict:
+    """One full run: news, quizzes, validation, verification, pictures and delivery.
+
+    `quiz_mix` defaults to the `Parameter.SCHEDULE` entry for today. The news of `news_date`
+    (default today) come from the per-date news store unless `shared_news` is False (see
+    `get_news`). `pick_words` is passed on to `get_quizzes`. Unless `resume_plans` is False,
+    languages whose chat already has sends planned in the outbox for that date are not
+    generated again: a rerun only finishes their delivery.
+    With profiling enabled every stage leaves its artifacts in a per-run directory (see
+    profiling.py).
+    """
+    languages = languages or LANGUAGES
+    plan_date = news_date or datetime.date.today()
+    if resume_plans:
+        planned = await asyncio.to_thread(get_planned_chats, plan_date)
+        done = [language for language in languages if str(Config.CHANNEL_ID[language]) in planned]
+        if done:
+            logging.info("Sends of %s for %s already planned: delivering those, not generating them again",
+                         done, plan_date)
+            languages = [language for language in languages if language not in done]
+        if not languages:
+            await bot.drain_outbox()
+            return {'good': {}, 'bad': {}, 'stats': {}}
+    quiz_mix = quiz_mix or Parameter.SCHEDULE[datetime.date.today().strftime('%A')]
+    news_index = news_index if news_index is not None else DuplicateIndex('news')
+    question_index = question_index if question_index is not None else DuplicateIndex('questions')
+
+    profiling.start_run()
+    try:
+        #### NEWS GENERATION
+        with profiling.stage('news'):
+            news_lst = await get_news(main_model=openai, second_model=gemini, bot=bot, news_index=news_index,
+                                      date=news_date, shared=shared_news)
 
-    #### NEWS GENERATION
-    news_lst = get_news(main_model=openai, second_model=gemini)
+        #### QUIZZES GENERATION
+        with profiling.stage('quizzes'):
+            questions = await get_quizzes(model=openai, news=news_lst, bot=bot, languages=languages,
+                                          quiz_mix=quiz_mix, pick_words=pick_words)
 
-    #### QUIZZES GENERATION
-    questions = get_quizzes(model=openai, news=news_lst)
+        #### LOCAL VALIDATION
+        with profiling.stage('validate'):
+            questions = await validate_quizzes(model=openai, questions=questions, news=news_lst,
+                                               question_index=question_index)
 
-    #### VERIFICATION
-    verified_questions = verify(gemini_model=gemini, openai_model=openai, questions=questions)
+        #### VERIFICATION
+        with profiling.stage('verify'):
+            verified_questions = await verify(gemini_model=gemini, openai_model=openai, questions=questions,
+                                              news=news_lst)
 
-    #### PICTURE GENERATION
-    images = generate_image(image_model=openai, topic=verified_questions['good'])  # news_lst[0]["text"])
+        #### PICTURE GENERATION
+        with profiling.stage('images'):
+            images = await generate_image(image_model=openai, topic=verified_questions['good'])  # news_lst[0]["text"])
 
-    #### TG
-    asyncio.run(bot.send_image_quizzes(chats=Config.CHANNEL_ID,
-                                       questions=verified_questions['good'],
-                                       images=images))
+        #### TG
+        with profiling.stage('delivery'):
+            await bot.send_image_quizzes(chats=Config.CHANNEL_ID,
+                                         questions=verified_questions['good'],
+                                         images=images, plan_date=plan_date)
+
+        #### ARCHIVE (history for near-duplicate detection)
+        with profiling.stage('archive'):
+            # Another run of the same date may have archived the shared news already
+            news_index.add([n.get('text', '') for n in news_lst if not news_index.is_duplicate(n.get('text', ''))])
+            for language, questions_lst in verified_questions['good'].items():
+                question_index.add([question_text(q) for q in questions_lst], meta={'language': language})
+    finally:
+        profiling.finish_run()
+    return verified_questions
+
+
+async def main(record: str = None, replay: str = None, replay_lenient: bool = None):
+    cassette = open_cassette(record=record, replay=replay, lenient=replay_lenient)
+    replaying = cassette is not None and cassette.mode == REPLAY
+    # A replay never reaches the providers, so missing credentials get a placeholder
+    placeholder = 'offline:replay' if replaying else None
+    openai = OpenaiAPI(api_key=Config.OPENAI_API_KEY or placeholder, model=Model.model_1)
+    gemini = GeminiAPI(api_key=Config.GEMINI_API_KEY or placeholder, model=Model.model_2)
+    bot = TelegramBot(token=Config.TG_TOKEN or placeholder)
+    pipeline_kwargs = {}
+    if cassette is not None:
+        # News from the store would leave the recorded news call out of the cassette, and
+        # plans in the outbox its generation calls
+        pipeline_kwargs.update({'shared_news': False, 'resume_plans': False})
+        # The day's words come from the cassette too: replay reads neither the DB nor the word index
+        pipeline_kwargs['pick_words'] = cassette.wrap_function('words', pick_daily_words)
+        # So do the dedup decisions, made against the archive of the recording run; a replay
+        # gets empty throwaway archives it never writes to
+        archive_dir = tempfile.mkdtemp(prefix='replay-archive-') if replaying else None
+        pipeline_kwargs.update({'news_index': cassette.wrap(DuplicateIndex('news', directory=archive_dir), 'dedup'),
+                                'question_index': cassette.wrap(DuplicateIndex('questions', directory=archive_dir),
+                                                                'dedup')})
+        cassette.wrap(openai, 'openai')
+        cassette.wrap(gemini, 'gemini')
+        cassette.wrap(bot, 'telegram')
+    if replaying:
+        # The recorded day's quiz mix
+        pipeline_kwargs.update({'quiz_mix': Parameter.SCHEDULE[cassette.date.strftime('%A')],
+                                'news_date': cassette.date})
+    try:
+        # Messages left over from an interrupted delivery go out before today's
+        await bot.drain_outbox()
+        await run_pipeline(openai, gemini, bot, **pipeline_kwargs)
+    finally:
+        if cassette is not None:
+            cassette.close()
+        await aclose_async_http_client()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate and post today's news quizzes.")
+    parser.add_argument('--profile', action='store_true',
+                        help="write per-stage cProfile and tracemalloc artifacts to Parameter.PROFILE_DIR")
+    cassette_group = parser.add_mutually_exclusive_group()
+    cassette_group.add_argument('--record', metavar='CASSETTE', help="record all provider and Telegram calls")
+    cassette_group.add_argument('--replay', metavar='CASSETTE', help="serve all provider and Telegram calls "
+                                                                     "from a recorded cassette, offline")
+    parser.add_argument('--replay-lenient', action='store_true', default=None,
+                        help="answer replayed calls without an exact match in recorded order instead of failing")
+    args = parser.parse_args()
+    if args.profile:
+        profiling.enable()
+    # Queue-based JSON logging: capped records to stdout, full payloads to the debug file
+    setup_logging()
+    asyncio.run(main(record=args.record, replay=args.replay, replay_lenient=args.replay_lenient))
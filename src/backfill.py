@@ -0,0 +1,211 @@
+import argparse
+import asyncio
+import collections
+import json
+import logging
+import os
+import time
+
+from config import Config, Model, Parameter
+from crud import get_languages, get_words_by_ids, get_words_missing_fields, update_words
+from gemini_api import GeminiAPI
+from http_client import aclose_async_http_client
+from log_config import setup_logging
+from openai_api import OpenaiAPI
+from prompts import QuizDefinitions
+import token_budget
+
+FIELDS = ('meaning', 'word_type', 'example')
+
+
+def load_checkpoint(path: str) -> dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_checkpoint(path: str, checkpoint: dict):
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, mode='w', encoding='utf-8') as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+
+
+def _parse_definitions(definitions_str) -> dict:
+    """Returns `{lowercased word: {field: value}}` from a QuizDefinitions response."""
+    try:
+        definitions = json.loads(definitions_str)
+    except (TypeError, json.decoder.JSONDecodeError) as e:
+        logging.error("Most likely the Definitions are not in json format: %s", e)
+        return {}
+    if not isinstance(definitions, dict):
+        return {}
+    parsed = {}
+    for word, value in definitions.items():
+        if isinstance(value, str):
+            value = {'meaning': value}
+        if isinstance(value, dict):
+            parsed[str(word).strip().lower()] = {k: str(v).strip() for k, v in value.items() if k in FIELDS and v}
+    return parsed
+
+
+def _updates(rows: list, definitions: dict) -> list:
+    """Builds update mappings that only fill the fields that are still NULL."""
+    mappings = []
+    for row in rows:
+        definition = definitions.get(row.word.strip().lower())
+        if not definition:
+            continue
+        mapping = {'id': row.id}
+        for field in FIELDS:
+            if getattr(row, field) is None and definition.get(field):
+                mapping[field] = definition[field][:255] if field == 'word_type' else definition[field]
+        if len(mapping) > 1:
+            mappings.append(mapping)
+    return mappings
+
+
+async def _define(model, language: str, rows: list, limiter: asyncio.Semaphore) -> tuple:
+    """Returns `(mappings, missing)`: updates for `rows` and the ids of rows the answer did not define."""
+    words = list(dict.fromkeys(row.word for row in rows))
+    async with limiter:
+        definitions_str = await model.agenerate_response(messages=QuizDefinitions(language, words).get_prompt(),
+                                                         call_type=token_budget.DEFINITIONS)
+    definitions = _parse_definitions(definitions_str)
+    missing = [row.id for row in rows if row.word.strip().lower() not in definitions]
+    return _updates(rows, definitions), missing
+
+
+async def _backfill_rows(model, language: str, rows: list, words_per_prompt: int,
+                         limiter: asyncio.Semaphore) -> tuple:
+    """Defines `rows` with concurrent multi-word prompts and writes them back in one transaction.
+
+    Returns `(updated, missing)`: the number of updated rows and the ids left undefined.
+    """
+    groups = [rows[i:i + words_per_prompt] for i in range(0, len(rows), words_per_prompt)]
+    results = await asyncio.gather(*(_define(model, language, group, limiter) for group in groups))
+    mappings = [mapping for result, _ in results for mapping in result]
+    await asyncio.to_thread(update_words, mappings)
+    return len(mappings), [row_id for _, missing in results for row_id in missing]
+
+
+def _save_progress(checkpoint: dict, checkpoint_path: str, language: str, after_id: int, failed: set):
+    checkpoint[language] = after_id
+    checkpoint.setdefault('failed', {})[language] = sorted(failed)
+    save_checkpoint(checkpoint_path, checkpoint)
+
+
+async def backfill_language(model, language: str, checkpoint: dict, checkpoint_path: str,
+                            chunk_size: int, words_per_prompt: int, limiter: asyncio.Semaphore,
+                            concurrency: int) -> int:
+    """Fills missing fields of one language page by page; returns the number of updated rows.
+
+    Pages overlap: the next page is read and its prompts queued while earlier ones are still
+    in flight, so about `concurrency` prompts stay queued however slow a single page is.
+    Every page is written back in one transaction. The checkpoint only moves past pages
+    whose predecessors are all written, so an interrupted backfill resumes at the first
+    unfinished page. Rows left undefined (failed prompts, words missing from an answer) are
+    recorded in the checkpoint's 'failed' list and retried in a final pass, and again on the
+    next run.
+    """
+    after_id = checkpoint.get(language, 0)
+    failed = set(checkpoint.get('failed', {}).get(language, []))
+    updated = 0
+    # (last id, prompts, started, task) per page in id order
+    pages = collections.deque()
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and sum(n for _, n, _, task in pages if not task.done()) < concurrency:
+                rows = await asyncio.to_thread(get_words_missing_fields, language, after_id, chunk_size)
+                if not rows:
+                    exhausted = True
+                    break
+                after_id = rows[-1].id
+                task = asyncio.ensure_future(_backfill_rows(model, language, rows, words_per_prompt, limiter))
+                pages.append((after_id, -(-len(rows) // words_per_prompt), time.perf_counter(), task))
+            if not pages:
+                break
+            running = {task for _, _, _, task in pages if not task.done()}
+            if running:
+                await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            while pages and pages[0][3].done():
+                last_id, _, started, task = pages.popleft()
+                page_updated, missing = task.result()
+                updated += page_updated
+                failed.update(missing)
+                _save_progress(checkpoint, checkpoint_path, language, last_id, failed)
+                logging.info("Backfill %s: page up to id=%s, updated=%s, undefined=%s, %.1fs",
+                             language, last_id, page_updated, len(missing), time.perf_counter() - started)
+    finally:
+        for _, _, _, task in pages:
+            task.cancel()
+
+    if failed:
+        retried, failed = await _retry_failed(model, language, sorted(failed), chunk_size, words_per_prompt, limiter)
+        updated += retried
+        _save_progress(checkpoint, checkpoint_path, language, checkpoint.get(language, 0), failed)
+    return updated
+
+
+async def _retry_failed(model, language: str, ids: list, chunk_size: int, words_per_prompt: int,
+                        limiter: asyncio.Semaphore) -> tuple:
+    """One more attempt at rows left undefined; returns `(updated, ids still undefined)`."""
+    updated, still_failed = 0, set()
+    for i in range(0, len(ids), chunk_size):
+        rows = await asyncio.to_thread(get_words_by_ids, ids[i:i + chunk_size])
+        # Rows filled in the meantime (or deleted) are done
+        rows = [row for row in rows if any(getattr(row, field) is None for field in FIELDS)]
+        if rows:
+            chunk_updated, missing = await _backfill_rows(model, language, rows, words_per_prompt, limiter)
+            updated += chunk_updated
+            still_failed.update(missing)
+    logging.info("Backfill %s: retried %s undefined row(s), updated=%s, still undefined=%s",
+                 language, len(ids), updated, len(still_failed))
+    return updated, still_failed
+
+
+async def backfill(model, languages: list = None, chunk_size: int = None, words_per_prompt: int = None,
+                   concurrency: int = None, checkpoint_path: str = None, restart: bool = False) -> dict:
+    chunk_size = chunk_size or Parameter.BACKFILL_CHUNK_SIZE
+    words_per_prompt = words_per_prompt or Parameter.BACKFILL_WORDS_PER_PROMPT
+    checkpoint_path = checkpoint_path or Parameter.BACKFILL_CHECKPOINT
+    concurrency = concurrency or Parameter.BACKFILL_CONCURRENCY
+    limiter = asyncio.Semaphore(concurrency)
+    checkpoint = {} if restart else load_checkpoint(checkpoint_path)
+    languages = languages or await asyncio.to_thread(get_languages)
+    updated = {}
+    for language in languages:
+        updated[language] = await backfill_language(model, language, checkpoint, checkpoint_path,
+                                                    chunk_size, words_per_prompt, limiter, concurrency)
+    logging.info("Backfill finished: updated=%s", updated)
+    return updated
+
+
+async def main(args):
+    if args.provider == 'openai':
+        model = OpenaiAPI(api_key=Config.OPENAI_API_KEY, model=Model.model_1)
+    else:
+        model = GeminiAPI(api_key=Config.GEMINI_API_KEY, model=Model.model_2)
+    try:
+        await backfill(model, languages=args.language, chunk_size=args.chunk_size,
+                       words_per_prompt=args.words_per_prompt, concurrency=args.concurrency,
+                       checkpoint_path=args.checkpoint, restart=args.restart)
+    finally:
+        await aclose_async_http_client()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fill NULL meaning/word_type/example of foreign words.")
+    parser.add_argument('--language', action='append', help="language to backfill (repeatable; default: all)")
+    parser.add_argument('--provider', choices=['gemini', 'openai'], default='gemini')
+    parser.add_argument('--chunk-size', type=int, help="rows per page and per batched update")
+    parser.add_argument('--words-per-prompt', type=int)
+    parser.add_argument('--concurrency', type=int, help="max prompts in flight; the rate governor adapts below it")
+    parser.add_argument('--checkpoint', help="checkpoint file with the last processed id per language")
+    parser.add_argument('--restart', action='store_true', help="ignore the checkpoint and start from the first id")
+    setup_logging()
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,254 @@
+"""Latency, throughput and peak memory of the word-store CRUD functions on synthetic tables.
+
+    python src/bench_crud.py [--sizes 10k,1m] [--postgres-url URL] [--json results.json]
+                             [--compare earlier.json]
+
+Every size gets a fresh `foreign_words` table filled with generated words: a temporary SQLite
+file, and, with `--postgres-url` (or BENCH_POSTGRES_URL), a scratch Postgres database whose
+`foreign_words` table is emptied first. The crud functions run unchanged against it via
+`Session.configure(bind=...)`. Refuses to run while DATABASE_URL is set, so it never touches
+the production store. The 10m size needs several GB of memory and disk and is only run when
+asked for, e.g. `--sizes 10k,1m,10m`.
+"""
+import argparse
+import csv
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+if os.environ.get('DATABASE_URL'):
+    sys.exit("bench_crud.py refuses to run while DATABASE_URL is set; unset it and pass a scratch "
+             "database with --postgres-url / BENCH_POSTGRES_URL instead.")
+# models binds its engine on import: keep that one in memory until Session is rebound below
+os.environ['DATABASE_URL'] = 'sqlite://'
+
+import sqlalchemy
+from sqlalchemy import create_engine, text
+
+import word_index
+from crud import add_word, get_random_words, get_words, import_words_from_csv
+from models import Base, ForeignWord, Session
+
+SIZES = {'10k': 10_000, '1m': 1_000_000, '10m': 10_000_000}
+# Share of the rows per language; the benchmark queries the largest one
+LANGUAGES = {'english': 0.5, 'spanish': 0.3, 'german': 0.1, 'french': 0.05, 'italian': 0.05}
+QUERY_LANGUAGE = 'English'
+WORD_TYPES = ['noun', 'verb', 'adjective', 'adverb', 'phrase']
+SYLLABLES = ['ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'te', 'vo', 'bri', 'dan', 'gel', 'hor', 'pas', 'quen', 'sto']
+INSERT_CHUNK = 20_000
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def synthetic_words(count: int, seed: int = 0, start: int = 0):
+    """Yields `count` ForeignWord mappings; about a third lack an example or word type."""
+    rng = random.Random(seed + start)
+    languages, weights = list(LANGUAGES), list(LANGUAGES.values())
+    for i in range(start, start + count):
+        word = "".join(rng.choices(SYLLABLES, k=rng.randint(2, 4))) + str(i)
+        yield {
+            'word': word,
+            'language': rng.choices(languages, weights)[0].capitalize(),
+            'meaning': f"meaning of {word} ({rng.choice(SYLLABLES)})",
+            'context': None if rng.random() < 0.5 else f"{word} appears in a sentence here.",
+            'word_type': None if rng.random() < 0.3 else rng.choice(WORD_TYPES),
+            'example': None if rng.random() < 0.3 else f"This is an example with {word}.",
+        }
+
+
+def fill_table(engine, rows: int, seed: int) -> float:
+    """Empties `foreign_words` and inserts `rows` generated words; returns the seconds it took."""
+    started = time.perf_counter()
+    Base.metadata.create_all(engine, tables=[ForeignWord.__table__])
+    with engine.begin() as conn:
+        if engine.dialect.name == 'postgresql':
+            conn.execute(text("TRUNCATE foreign_words RESTART IDENTITY"))
+        else:
+            conn.execute(ForeignWord.__table__.delete())
+    generator = synthetic_words(rows, seed)
+    for start in range(0, rows, INSERT_CHUNK):
+        chunk = [next(generator) for _ in range(min(INSERT_CHUNK, rows - start))]
+        with engine.begin() as conn:
+            conn.execute(ForeignWord.__table__.insert(), chunk)
+    if engine.dialect.name == 'postgresql':
+        with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            conn.execute(text("ANALYZE foreign_words"))
+    return time.perf_counter() - started
+
+
+def write_csv(path: str, rows: int, seed: int, start: int):
+    fields = ['language', 'word', 'meaning', 'context', 'word_type', 'example']
+    with open(path, mode='w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        for word in synthetic_words(rows, seed, start):
+            writer.writerow({k: v or '' for k, v in word.items()})
+
+
+def measure(operation: str, call, repeat: int, unit: str, items=None) -> dict:
+    """Times `repeat` calls after one warm-up, then one more call under tracemalloc for the peak.
+
+    `items(result)` is the number of `unit`s a call handled (rows returned, rows imported);
+    by default one call counts as one. Timed calls run without tracemalloc, which slows
+    allocation-heavy code several times over; the peak covers Python allocations only.
+    """
+    call()
+    timings, handled = [], 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = call()
+        timings.append(time.perf_counter() - started)
+        handled += items(result) if items else 1
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    call()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    timings_ms = sorted(t * 1000 for t in timings)
+    return {
+        'operation': operation,
+        'repeat': repeat,
+        'latency_ms': {
+            'min': round(timings_ms[0], 3),
+            'p50': round(statistics.median(timings_ms), 3),
+            'p95': round(timings_ms[min(len(timings_ms) - 1, int(0.95 * len(timings_ms)))], 3),
+            'max': round(timings_ms[-1], 3),
+            'mean': round(statistics.fmean(timings_ms), 3),
+        },
+        'throughput': round(handled / sum(timings), 1) if sum(timings) else None,
+        'throughput_unit': f"{unit}/s",
+        'peak_kib': round(peak / 1024, 1),
+    }
+
+
+def bench_store(backend: str, url: str, rows: int, args, workdir: str) -> list:
+    engine = create_engine(url)
+    Session.configure(bind=engine)
+    # add_word and import_words_from_csv keep the word index in sync: give every store its own
+    index_dir = os.path.join(workdir, f"index-{backend}-{rows}")
+    os.makedirs(index_dir, exist_ok=True)
+    word_index.configure_word_indexes(index_dir)
+    try:
+        print(f"\n{backend}, {rows:,} rows: generating...", flush=True)
+        setup = {'fill_s': round(fill_table(engine, rows, args.seed), 2)}
+        # The first write of a language embeds all of its existing rows; do that up front
+        # so add_word and import time one incremental sync, not a full index build
+        started = time.perf_counter()
+        word_index.sync_word_indexes(list(LANGUAGES))
+        setup['index_build_s'] = round(time.perf_counter() - started, 2)
+
+        csv_path = os.path.join(workdir, 'import.csv')
+        imported = [rows]
+
+        def import_csv():
+            # A new file every call, so each import inserts fresh words
+            write_csv(csv_path, args.csv_rows, args.seed, imported[0])
+            imported[0] += args.csv_rows
+            import_words_from_csv(csv_path)
+            return args.csv_rows
+
+        added = iter(range(10 ** 9))
+        results = [
+            measure('get_random_words', lambda: get_random_words(QUERY_LANGUAGE, 5), args.repeat, 'calls'),
+            measure('get_words', lambda: get_words(language=QUERY_LANGUAGE), args.read_repeat, 'rows', items=len),
+            measure('add_word', lambda: add_word(f"benchword{next(added)}", QUERY_LANGUAGE, meaning="benchmark"),
+                    args.repeat, 'calls'),
+            measure('import_words_from_csv', import_csv, args.read_repeat, 'rows', items=lambda n: n),
+        ]
+        for result in results:
+            result.update({'backend': backend, 'rows': rows, 'setup': setup})
+        return results
+    finally:
+        word_index.configure_word_indexes()
+        engine.dispose()
+
+
+def print_results(results: list):
+    print(f"\n{'backend':<10}{'rows':>12}  {'operation':<23}{'p50 ms':>10}{'p95 ms':>10}"
+          f"{'throughput':>16}{'peak KiB':>11}")
+    for r in results:
+        throughput = f"{r['throughput']:,} {r['throughput_unit']}" if r['throughput'] is not None else '-'
+        print(f"{r['backend']:<10}{r['rows']:>12,}  {r['operation']:<23}{r['latency_ms']['p50']:>10}"
+              f"{r['latency_ms']['p95']:>10}{throughput:>16}{r['peak_kib']:>11,}")
+
+
+def print_comparison(results: list, path: str):
+    with open(path, encoding='utf-8') as f:
+        earlier = json.load(f)
+    before = {(r['backend'], r['rows'], r['operation']): r for r in earlier['results']}
+    print(f"\nvs. {earlier['revision']} ({path}): p50 latency and peak memory, now / before")
+    for r in results:
+        old = before.get((r['backend'], r['rows'], r['operation']))
+        if old is None:
+            continue
+        latency = r['latency_ms']['p50'] / old['latency_ms']['p50'] if old['latency_ms']['p50'] else float('nan')
+        memory = r['peak_kib'] / old['peak_kib'] if old['peak_kib'] else float('nan')
+        print(f"{r['backend']:<10}{r['rows']:>12,}  {r['operation']:<23}{latency:>8.2f}x{memory:>8.2f}x")
+
+
+def main(args):
+    sizes = [SIZES[size.strip().lower()] for size in args.sizes.split(',')]
+    workdir = tempfile.mkdtemp(prefix='bench_crud_')
+    stores = [('sqlite', lambda rows: f"sqlite:///{os.path.join(workdir, f'words-{rows}.db')}")]
+    if args.postgres_url:
+        postgres_url = args.postgres_url.replace("postgres://", "postgresql://", 1)
+        stores.append(('postgres', lambda rows: postgres_url))
+    else:
+        print("No --postgres-url / BENCH_POSTGRES_URL: Postgres skipped")
+    results = []
+    try:
+        for rows in sizes:
+            for backend, url in stores:
+                results.extend(bench_store(backend, url(rows), rows, args, workdir))
+                if backend == 'sqlite':
+                    os.remove(os.path.join(workdir, f'words-{rows}.db'))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print_results(results)
+    report = {
+        'revision': git_revision(),
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'sqlalchemy': sqlalchemy.__version__,
+        'platform': platform.platform(),
+        'settings': {'sizes': sizes, 'repeat': args.repeat, 'read_repeat': args.read_repeat,
+                     'csv_rows': args.csv_rows, 'seed': args.seed},
+        'results': results,
+    }
+    if args.json:
+        with open(args.json, mode='w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        print_comparison(results, args.compare)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='10k,1m',
+                        help="comma-separated table sizes out of 10k, 1m, 10m (10m is opt-in: several GB)")
+    parser.add_argument('--postgres-url', default=os.getenv('BENCH_POSTGRES_URL'),
+                        help="scratch Postgres database; its foreign_words table is emptied and refilled")
+    parser.add_argument('--repeat', type=int, default=20, help="timed calls of get_random_words and add_word")
+    parser.add_argument('--read-repeat', type=int, default=3,
+                        help="timed calls of get_words and import_words_from_csv")
+    parser.add_argument('--csv-rows', type=int, default=1000, help="rows per imported CSV file")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help="also write the results, tagged with the git revision, to this file")
+    parser.add_argument('--compare', help="results file of an earlier run to print the changes against")
+    main(parser.parse_args())
@@ -0,0 +1,78 @@
+"""Bytes and milliseconds per picture: the former lossless PNG upload vs. image_encoding.
+
+    python src/bench_images.py [IMAGE ...] [--repeat 5] [--json results.json]
+
+Without image paths it uses synthetic pictures in the DALL-E output sizes.
+"""
+import argparse
+import json
+import statistics
+import time
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from image_encoding import encode_image
+
+SIZES = [(1024, 1024), (1792, 1024)]
+
+
+def synthetic_image(width: int, height: int, seed: int = 0) -> Image.Image:
+    """Illustration-like test picture: smooth colour gradients, a few shapes and fine noise."""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    channels = []
+    for _ in range(3):
+        fx, fy, phase = rng.uniform(1, 6), rng.uniform(1, 6), rng.uniform(0, np.pi)
+        channels.append(127 + 100 * np.sin(fx * x / width * np.pi + phase) * np.cos(fy * y / height * np.pi))
+    pixels = np.stack(channels, axis=-1)
+    for _ in range(12):
+        cx, cy, r = rng.uniform(0, width), rng.uniform(0, height), rng.uniform(30, 200)
+        mask = (x - cx) ** 2 + (y - cy) ** 2 < r ** 2
+        pixels[mask] = rng.uniform(0, 255, size=3)
+    pixels += rng.normal(0, 6, size=pixels.shape)
+    return Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8), mode='RGB')
+
+
+def png_bytes(image: Image.Image) -> bytes:
+    # What tg_api sent before: lossless PNG at full size
+    buffer = BytesIO()
+    image.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def measure(name: str, encode, image: Image.Image, repeat: int) -> dict:
+    timings, data = [], b''
+    for _ in range(repeat):
+        started = time.perf_counter()
+        data = encode(image)
+        timings.append((time.perf_counter() - started) * 1000)
+    return {'variant': name, 'size': f"{image.width}x{image.height}", 'bytes': len(data),
+            'ms_median': round(statistics.median(timings), 1), 'ms_min': round(min(timings), 1)}
+
+
+def main(args):
+    images = [Image.open(path).convert('RGB') for path in args.images] or \
+             [synthetic_image(w, h, seed=i) for i, (w, h) in enumerate(SIZES)]
+    variants = [
+        ('png (before)', png_bytes),
+        ('jpeg q87 1280px', lambda im: encode_image(im, fmt='JPEG', quality=87, max_bytes=0)),
+        ('jpeg 200KB budget', lambda im: encode_image(im, fmt='JPEG', quality=90, max_bytes=200_000)),
+        ('webp q80 1280px', lambda im: encode_image(im, fmt='WEBP', quality=80, max_bytes=0)),
+    ]
+    results = [measure(name, encode, image, args.repeat) for image in images for name, encode in variants]
+    print(f"{'variant':<20}{'size':>11}{'bytes':>12}{'ms median':>11}{'ms min':>9}")
+    for r in results:
+        print(f"{r['variant']:<20}{r['size']:>11}{r['bytes']:>12,}{r['ms_median']:>11}{r['ms_min']:>9}")
+    if args.json:
+        with open(args.json, mode='w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('images', nargs='*', help="pictures to encode (default: synthetic ones)")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--json', help="also write the results to this file")
+    main(parser.parse_args())
@@ -0,0 +1,244 @@
+import base64
+import collections
+import contextvars
+import datetime
+import functools
+import gzip
+import hashlib
+import inspect
+import json
+import logging
+import os
+import random
+from io import BytesIO
+
+from PIL import Image
+
+from config import Parameter
+
+RECORD = 'record'
+REPLAY = 'replay'
+
+# Methods captured per service; in replay mode none of them touches the network
+SERVICES = {
+    'openai': ('generate_response', 'agenerate_response', 'generate_image', 'agenerate_image'),
+    'gemini': ('generate_response', 'agenerate_response'),
+    'telegram': ('send_message', 'send_quizzes', 'send_bad_quizzes', 'send_image', 'send_image_quizzes',
+                 'drain_outbox'),
+    # Functions rather than client methods, see `wrap_function`
+    'words': ('pick_daily_words',),
+    # Near-duplicate checks depend on the archive of the recording machine; replay never writes to it
+    'dedup': ('find_duplicate', 'is_duplicate', 'add'),
+}
+# Connection management that replay skips and record does not need to capture
+NO_OP_ON_REPLAY = {'telegram': ('initialize', 'shutdown')}
+# Arguments that do not change what a call answers; chat IDs come from the environment, which
+# a replay need not have
+IGNORED_ARGUMENTS = {'self', 'timeout', 'chats', 'chat_id'}
+
+# Set while a recorded call runs: calls it makes itself (send_image_quizzes -> drain_outbox)
+# are part of its answer and are not recorded on their own
+_recording = contextvars.ContextVar('cassette_recording', default=False)
+
+
+class CassetteMiss(LookupError):
+    """Replay found no recorded answer for a call."""
+
+
+def _image_sha(image: Image.Image) -> str:
+    return hashlib.sha256(image.tobytes()).hexdigest()
+
+
+def normalize(obj):
+    """JSON-able form of call arguments: whitespace collapsed, images replaced by their hash."""
+    if isinstance(obj, str):
+        return " ".join(obj.split())
+    if isinstance(obj, Image.Image):
+        return {'image_sha256': _image_sha(obj)}
+    if isinstance(obj, dict):
+        return {str(k): normalize(v) for k, v in sorted(obj.items(), key=lambda kv: str(kv[0]))}
+    if isinstance(obj, (list, tuple)):
+        return [normalize(v) for v in obj]
+    if obj is None or isinstance(obj, (int, float, bool)):
+        return obj
+    return repr(obj)
+
+
+def request_key(service: str, method: str, request: dict) -> str:
+    payload = json.dumps([service, method, request], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _dump_response(response):
+    if isinstance(response, Image.Image):
+        buffer = BytesIO()
+        response.save(buffer, format='PNG')
+        return {'__image__': base64.b64encode(buffer.getvalue()).decode('ascii')}
+    return response
+
+
+def _load_response(response):
+    if isinstance(response, dict) and '__image__' in response:
+        image = Image.open(BytesIO(base64.b64decode(response['__image__'])))
+        image.load()
+        return image
+    return response
+
+
+class Cassette:
+    """Gzipped JSONL recording of the calls made through wrapped OpenaiAPI, GeminiAPI,
+    TelegramBot and DuplicateIndex instances.
+
+    The first line is a header with the random seed and the date of the recorded run; every
+    other line is one call with its normalised request, request key and response. Replay
+    answers a call from the first unused entry with the same key; a call without one raises
+    CassetteMiss, since its prompt changed. With `lenient` (default
+    `Parameter.CASSETTE_LENIENT`) it is answered from the next unused entry of the same method
+    in recorded order instead.
+
+    Code that runs on record but not on replay (Telegram send pacing, provider backoff, word
+    picks) must not draw from the global random generator: seeded here, it draws the prompts.
+    """
+
+    def __init__(self, path: str, mode: str, seed: int = None, lenient: bool = None):
+        self.path = path
+        self.mode = mode
+        self.lenient = lenient if lenient is not None else Parameter.CASSETTE_LENIENT
+        self.stats = collections.Counter()
+        if mode == RECORD:
+            self.seed = seed if seed is not None else random.randrange(2 ** 32)
+            self.date = datetime.date.today()
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            with gzip.open(path, mode='wt', encoding='utf-8') as f:
+                f.write(json.dumps({'type': 'header', 'version': 1, 'seed': self.seed,
+                                    'date': self.date.isoformat(),
+                                    'created': datetime.datetime.now().isoformat()}) + "\n")
+        elif mode == REPLAY:
+            with gzip.open(path, mode='rt', encoding='utf-8') as f:
+                lines = [json.loads(line) for line in f if line.strip()]
+            header, self.entries = lines[0], lines[1:]
+            self.seed = header['seed']
+            self.date = datetime.date.fromisoformat(header['date'])
+            self._used = [False] * len(self.entries)
+            self._by_key = collections.defaultdict(collections.deque)
+            self._by_method = collections.defaultdict(collections.deque)
+            for i, entry in enumerate(self.entries):
+                self._by_key[entry['key']].append(i)
+                self._by_method[(entry['service'], entry['method'])].append(i)
+        else:
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        # Same seed, same topics, categories and answer positions in the prompts
+        random.seed(self.seed)
+        logging.info("Cassette %s: %s (seed=%s, date=%s)", mode, path, self.seed, self.date)
+
+    def _record(self, service: str, method: str, request: dict, response):
+        entry = {'service': service, 'method': method, 'key': request_key(service, method, request),
+                 'request': request, 'response': _dump_response(response)}
+        # One gzip member per call, so an interrupted run keeps everything recorded so far
+        with gzip.open(self.path, mode='at', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self.stats['recorded'] += 1
+
+    @staticmethod
+    def _pop_unused(queue: collections.deque, used: list):
+        while queue:
+            i = queue.popleft()
+            if not used[i]:
+                return i
+        return None
+
+    def _replay(self, service: str, method: str, request: dict):
+        i = self._pop_unused(self._by_key[request_key(service, method, request)], self._used)
+        if i is None:
+            if not self.lenient:
+                self.stats['misses'] += 1
+                raise CassetteMiss(f"No recorded {service}.{method} call with the same request in {self.path}; "
+                                   f"the prompt changed since recording (replay with CASSETTE_LENIENT=1 or "
+                                   f"--replay-lenient to answer it in recorded order)")
+            i = self._pop_unused(self._by_method[(service, method)], self._used)
+            if i is None:
+                raise CassetteMiss(f"No recorded {service}.{method} call left in {self.path}")
+            self.stats['sequence_matches'] += 1
+            logging.warning("Cassette: no exact match for %s.%s, replaying the next one in recorded order",
+                            service, method)
+        else:
+            self.stats['key_matches'] += 1
+        self._used[i] = True
+        return _load_response(self.entries[i]['response'])
+
+    def _request(self, signature: inspect.Signature, args: tuple, kwargs: dict) -> dict:
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        return normalize({k: v for k, v in bound.arguments.items() if k not in IGNORED_ARGUMENTS})
+
+    def _wrap_method(self, service: str, name: str, method):
+        signature = inspect.signature(method)
+
+        if inspect.iscoroutinefunction(method):
+            @functools.wraps(method)
+            async def async_wrapper(*args, **kwargs):
+                if _recording.get():
+                    return await method(*args, **kwargs)
+                request = self._request(signature, args, kwargs)
+                if self.mode == REPLAY:
+                    return self._replay(service, name, request)
+                token = _recording.set(True)
+                try:
+                    response = await method(*args, **kwargs)
+                finally:
+                    _recording.reset(token)
+                self._record(service, name, request, response)
+                return response
+            return async_wrapper
+
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            if _recording.get():
+                return method(*args, **kwargs)
+            request = self._request(signature, args, kwargs)
+            if self.mode == REPLAY:
+                return self._replay(service, name, request)
+            token = _recording.set(True)
+            try:
+                response = method(*args, **kwargs)
+            finally:
+                _recording.reset(token)
+            self._record(service, name, request, response)
+            return response
+        return wrapper
+
+    def wrap(self, client, service: str):
+        """Routes the `SERVICES[service]` methods of `client` through the cassette, in place."""
+        for name in SERVICES[service]:
+            if hasattr(client, name):
+                setattr(client, name, self._wrap_method(service, name, getattr(client, name)))
+        if self.mode == REPLAY:
+            for name in NO_OP_ON_REPLAY.get(service, ()):
+                if hasattr(client, name):
+                    setattr(client, name, _no_op)
+        return client
+
+    def wrap_function(self, service: str, func):
+        """`func` routed through the cassette, for module-level functions listed in `SERVICES`."""
+        return self._wrap_method(service, func.__name__, func)
+
+    def close(self):
+        logging.info("Cassette %s closed: %s", self.path, dict(self.stats))
+
+
+async def _no_op(*args, **kwargs):
+    return None
+
+
+def open_cassette(record: str = None, replay: str = None, lenient: bool = None):
+    """The cassette selected by the arguments or by `Parameter.CASSETTE_MODE`, or None."""
+    if record:
+        return Cassette(record, RECORD)
+    if replay:
+        return Cassette(replay, REPLAY, lenient=lenient)
+    if Parameter.CASSETTE_MODE in (RECORD, REPLAY):
+        path = Parameter.CASSETTE_PATH or os.path.join(Parameter.CASSETTE_DIR,
+                                                       f"{datetime.date.today().isoformat()}.jsonl.gz")
+        return Cassette(path, Parameter.CASSETTE_MODE, lenient=lenient)
+    return None
@@ -19,6 +19,15 @@ class Config:
     CHANNEL_ID = {'english': os.getenv('ENG_CHANNEL_ID'), 'spanish': os.getenv('ESP_CHANNEL_ID')}
 
 
+class TelegramLimit:
+    # Bot API limits for quiz polls (sendPoll)
+    POLL_QUESTION_MAX_LEN = 300
+    POLL_OPTION_MAX_LEN = 100
+    POLL_EXPLANATION_MAX_LEN = 200
+    POLL_MIN_OPTIONS = 2
+    POLL_MAX_OPTIONS = 10
+
+
 class Parameter:
     N_options = 5
     SCHEDULE = {'Monday': 'grammar',
@@ -27,4 +36,117 @@ class Parameter:
                 'Thursday': 'word',
                 'Friday': 'grammar',
                 'Saturday': 'word',
-                'Sunday': 'grammar'}
\ No newline at end of file
+                'Sunday': 'grammar'}
+    # Number of word-definition questions (out of 4) for each SCHEDULE day type
+    QUIZ_MIX = {'grammar': 1, 'word': 3}
+    # 'batch': one call writes all questions of a language; 'per_question': one concurrent call each
+    QUIZ_GENERATION_MODE = os.getenv('QUIZ_GENERATION_MODE', 'batch')
+    # Daily run time (HH:MM, server time) per language/channel for the scheduler daemon
+    RUN_TIMES = {'english': os.getenv('ENG_RUN_TIME', '08:00'), 'spanish': os.getenv('ESP_RUN_TIME', '08:00')}
+    RUN_ON_START = os.getenv('RUN_ON_START', '0') == '1'
+    HEALTH_HOST = os.getenv('HEALTH_HOST', '0.0.0.0')
+    HEALTH_PORT = int(os.getenv('PORT', os.getenv('HEALTH_PORT', 8080)))
+    # Embedding index used to pick daily words related to the news
+    WORD_INDEX_DIR = os.getenv('WORD_INDEX_DIR', 'word_index')
+    # 'hashing' (offline feature hashing) or a 'module:function' mapping a list of texts to vectors
+    WORD_EMBEDDER = os.getenv('WORD_EMBEDDER', 'hashing')
+    EMBEDDING_DIM = 128
+    DAILY_WORD_CANDIDATES = 5
+    # Vocabulary backfill (src/backfill.py)
+    BACKFILL_CHUNK_SIZE = 500
+    BACKFILL_WORDS_PER_PROMPT = 25
+    BACKFILL_CONCURRENCY = int(os.getenv('BACKFILL_CONCURRENCY', 32))  # ceiling; the rate governor adapts below it
+    BACKFILL_CHECKPOINT = os.getenv('BACKFILL_CHECKPOINT', 'backfill_checkpoint.json')
+    # 'tiered': cheapest verifier first, the next one only for questions still in doubt;
+    # 'strict': every verifier checks every question and all must agree
+    VERIFICATION_POLICY = os.getenv('VERIFICATION_POLICY', 'tiered')
+    VERIFIER_ORDER = ['Gemini', 'OpenAi']
+    # Rounds of regeneration for questions rejected by the local validator
+    REGENERATION_ATTEMPTS = 1
+    # Archive of published news/questions used to reject near-duplicates
+    ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', 'archive')
+    DEDUP_THRESHOLD = float(os.getenv('DEDUP_THRESHOLD', 0.7))
+    DEDUP_ATTEMPTS = 2
+    # Logging: stdout gets capped records; the rotating debug file (opt-in, e.g. logs/debug.log)
+    # gets full payloads, at the cost of rendering every DEBUG record
+    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+    LOG_MAX_CHARS = int(os.getenv('LOG_MAX_CHARS', 2000))
+    LOG_DEBUG_FILE = os.getenv('LOG_DEBUG_FILE') or None
+    LOG_DEBUG_FILE_BYTES = 10 * 1024 * 1024
+    LOG_DEBUG_FILE_COUNT = 5
+
+    # Shared HTTP pool and per-call timeouts (seconds) for provider SDKs
+    HTTP_MAX_CONNECTIONS = int(os.getenv('HTTP_MAX_CONNECTIONS', 50))
+    HTTP_MAX_KEEPALIVE = int(os.getenv('HTTP_MAX_KEEPALIVE', 20))
+    HTTP_KEEPALIVE_EXPIRY = 60
+    HTTP_CONNECT_TIMEOUT = 10
+    LLM_TIMEOUT = float(os.getenv('LLM_TIMEOUT', 120))
+    IMAGE_TIMEOUT = float(os.getenv('IMAGE_TIMEOUT', 180))
+    # Picture encoding for Telegram (src/image_encoding.py); Telegram keeps photos at most 1280px
+    # on the long side and recompresses them, so larger or lossless uploads are wasted bytes
+    IMAGE_FORMAT = os.getenv('IMAGE_FORMAT', 'JPEG')
+    IMAGE_MAX_SIDE = 1280
+    IMAGE_QUALITY = int(os.getenv('IMAGE_QUALITY', 87))
+    IMAGE_MAX_BYTES = int(os.getenv('IMAGE_MAX_BYTES', 0)) or None
+    IMAGE_ENCODE_WORKERS = 2
+    # Adaptive output-token budgets per call type (src/token_budget.py)
+    TOKEN_BUDGET_FILE = os.getenv('TOKEN_BUDGET_FILE', 'token_budget.json')
+    TOKEN_BUDGET_WINDOW = 200
+    TOKEN_BUDGET_MIN_SAMPLES = 10
+    TOKEN_BUDGET_PERCENTILE = 95
+    TOKEN_BUDGET_HEADROOM = 1.3
+    TOKEN_BUDGET_MIN = 512
+    TOKEN_BUDGET_MAX = 16000
+    TRUNCATION_RETRIES = 1
+    REASONING_EFFORT = {'default': 'low', 'news': 'low', 'quiz': 'low', 'quiz_question': 'low', 'quiz_regenerate': 'low',
+                        'verify': 'low', 'definitions': 'low'}
+    # Lowest effort truncations may push a call type to, per model: 'minimal' is only accepted by the
+    # original gpt-5 family (gpt-5.1 and later take 'none'/'low'), so other models stop at 'low'
+    MIN_REASONING_EFFORT = {'default': 'low', 'gpt-5': 'minimal', 'gpt-5-mini': 'minimal', 'gpt-5-nano': 'minimal'}
+    # Untruncated calls that win back one lowered effort step
+    REASONING_RECOVERY_CALLS = 20
+    TOKEN_BUDGET_SAVE_SECONDS = 30
+    # Profiling (src/profiling.py): PROFILE=1 or `app.py --profile`
+    PROFILE = os.getenv('PROFILE', '0') == '1'
+    PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+    PROFILE_TOP = 40
+    PROFILE_TRACE_FRAMES = 5
+    # Telegram delivery outbox: retries per message and exponential backoff (seconds)
+    OUTBOX_MAX_ATTEMPTS = 5
+    OUTBOX_BACKOFF = 10
+    OUTBOX_BACKOFF_MAX = 600
+    # How long one drain keeps waiting for backoffs before leaving the rest to the next drain
+    OUTBOX_DRAIN_TIMEOUT = float(os.getenv('OUTBOX_DRAIN_TIMEOUT', 1800))
+    # Record/replay of provider and Telegram calls (src/cassette.py): 'off', 'record' or 'replay'
+    CASSETTE_MODE = os.getenv('CASSETTE_MODE', 'off')
+    CASSETTE_DIR = os.getenv('CASSETTE_DIR', 'cassettes')
+    CASSETTE_PATH = os.getenv('CASSETTE_PATH')
+    # Replay a call without an exact match from the next one of its method in recorded order,
+    # instead of failing; hides prompt changes, so only for replaying old cassettes
+    CASSETTE_LENIENT = os.getenv('CASSETTE_LENIENT', '0') == '1'
+    # Quiz poll results (src/poll_stats.py); POLL_STATS=1 also runs the collector in the scheduler
+    POLL_STATS = os.getenv('POLL_STATS', '0') == '1'
+    POLL_STATS_LONG_POLL = 30
+    POLL_STATS_FLUSH_SECONDS = 30
+    POLL_STATS_FLUSH_SIZE = 500
+    POLL_STATS_RETRY_SECONDS = 5
+    # Per-provider concurrency and rate governor (src/rate_governor.py): the in-flight limit
+    # starts at `initial`, grows additively on success and is multiplied by RATE_DECREASE on 429/503
+    RATE_LIMITS = {
+        'openai': {'initial': 4, 'min_limit': 1, 'max_limit': int(os.getenv('OPENAI_MAX_CONCURRENCY', 32)),
+                   'tokens_per_minute': int(os.getenv('OPENAI_TOKENS_PER_MINUTE', 0)) or None},
+        'openai_images': {'initial': 2, 'min_limit': 1, 'max_limit': 5, 'tokens_per_minute': None},
+        'gemini': {'initial': 4, 'min_limit': 1, 'max_limit': int(os.getenv('GEMINI_MAX_CONCURRENCY', 32)),
+                   'tokens_per_minute': int(os.getenv('GEMINI_TOKENS_PER_MINUTE', 0)) or None},
+    }
+    RATE_INCREASE = 1.0
+    RATE_DECREASE = 0.5
+    RATE_RETRIES = 4
+    RATE_BACKOFF = 2
+    RATE_BACKOFF_MAX = 60
+    # Per-date news store: the first run of a date generates the news, every other run (any
+    # language, channel or process) waits for and reuses it. A claim older than the lease is
+    # taken over, so a crashed worker does not block the date
+    NEWS_STORE = os.getenv('NEWS_STORE', '1') == '1'
+    NEWS_LEASE_SECONDS = int(os.getenv('NEWS_LEASE_SECONDS', 900))
+    NEWS_POLL_SECONDS = 5
@@ -1,12 +1,20 @@
 from sqlalchemy import create_engine, Column, Integer, String
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from models import Session, ForeignWord
+from models import Session, ForeignWord, OutboxMessage, PollStat, DailyNews
+from word_index import reembed_words, sync_word_indexes
+from profiling import timed
 import csv
-from sqlalchemy import func
+import logging
+import datetime
+import json
+from sqlalchemy import func, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects import postgresql, sqlite
 import random
 
 
+@timed
 def add_word(word, language, meaning=None, context=None, word_type=None, example=None):
     session = Session()
     new_word = ForeignWord(
@@ -15,8 +23,14 @@ def add_word(word, language, meaning=None, context=None, word_type=None, example
     session.add(new_word)
     session.commit()
     session.close()
+    # The word is stored either way; an index failure only delays it to the next sync
+    try:
+        sync_word_indexes([language])
+    except Exception:
+        logging.exception("Word index sync failed after adding %r", word)
 
 
+@timed
 def get_words(language=None):
     session = Session()
     query = session.query(ForeignWord)
@@ -27,6 +41,18 @@ def get_words(language=None):
     return words
 
 
+@timed
+def get_words_by_ids(ids):
+    """Fetches words by primary key, preserving the order of `ids`."""
+    session = Session()
+    try:
+        words = {w.id: w for w in session.query(ForeignWord).filter(ForeignWord.id.in_(ids)).all()}
+        return [words[i] for i in ids if i in words]
+    finally:
+        session.close()
+
+
+@timed
 def get_random_words(language, count=5):
     """Retrieves a specified number of random words for a given language."""
     session = Session()
@@ -44,6 +70,7 @@ def get_random_words(language, count=5):
         session.close()
 
 
+@timed
 def import_words_from_csv(csv_filepath):
     """Reads words from a CSV file and bulk inserts them into the database."""
     session = Session()
@@ -85,5 +112,309 @@ def import_words_from_csv(csv_filepath):
     except Exception as e:
         session.rollback() # Rollback in case of any error during processing
         print(f"An error occurred during import: {e}")
+        return
+    finally:
+        session.close()
+
+    if words_to_insert:
+        # Embed the new rows so that daily word selection sees them right away; the rows are
+        # committed either way, an index failure only delays them to the next sync
+        try:
+            sync_word_indexes([w['language'] for w in words_to_insert])
+        except Exception:
+            logging.exception("Word index sync failed after importing %s", csv_filepath)
+
+
+@timed
+def get_languages():
+    """Returns the distinct languages present in the word store."""
+    session = Session()
+    try:
+        return [row[0] for row in session.query(ForeignWord.language).distinct().all()]
+    finally:
+        session.close()
+
+
+@timed
+def get_words_missing_fields(language, after_id=0, limit=500):
+    """Keyset-paginated page of words with a NULL meaning, example or word_type.
+
+    Returns plain `(id, word, meaning, word_type, example)` rows ordered by id; pass the last id
+    back as `after_id` to fetch the next page.
+    """
+    session = Session()
+    try:
+        return session.query(ForeignWord.id, ForeignWord.word, ForeignWord.meaning,
+                             ForeignWord.word_type, ForeignWord.example)\
+                      .filter(func.lower(ForeignWord.language) == language.lower())\
+                      .filter(ForeignWord.id > after_id)\
+                      .filter(or_(ForeignWord.meaning.is_(None),
+                                  ForeignWord.example.is_(None),
+                                  ForeignWord.word_type.is_(None)))\
+                      .order_by(ForeignWord.id)\
+                      .limit(limit)\
+                      .all()
+    finally:
+        session.close()
+
+
+@timed
+def update_words(mappings):
+    """Applies a batch of `{'id': ..., <column>: ...}` updates in a single transaction."""
+    if not mappings:
+        return
+    session = Session()
+    try:
+        session.bulk_update_mappings(ForeignWord, mappings)
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+    # The index embeds word and meaning: rows whose meaning changed need new vectors
+    try:
+        reembed_words([m['id'] for m in mappings if 'meaning' in m])
+    except Exception:
+        logging.exception("Word index update failed for %s updated word(s)", len(mappings))
+
+
+@timed
+def enqueue_outbox(items):
+    """Adds planned sends, skipping any whose `send_key` is already in the outbox.
+
+    Returns the outbox ids of all `items` in their order, existing ones included.
+    """
+    if not items:
+        return []
+    session = Session()
+    try:
+        keys = [item['send_key'] for item in items]
+        existing = dict(session.query(OutboxMessage.send_key, OutboxMessage.id)
+                               .filter(OutboxMessage.send_key.in_(keys)).all())
+        now = datetime.datetime.now()
+        new = [OutboxMessage(created_at=now, status='pending', attempts=0, **item)
+               for item in items if item['send_key'] not in existing]
+        session.add_all(new)
+        session.commit()
+        existing.update({message.send_key: message.id for message in new})
+        return [existing[k] for k in keys]
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+@timed
+def get_planned_chats(plan_date):
+    """Chat ids that already have outbox rows planned for `plan_date`, whatever their status."""
+    session = Session()
+    try:
+        rows = session.query(OutboxMessage.chat_id).filter(OutboxMessage.plan_date == plan_date).distinct().all()
+        return {chat_id for (chat_id,) in rows}
+    finally:
+        session.close()
+
+
+@timed
+def get_pending_outbox():
+    """Undelivered outbox rows in send order (id); photo bytes are loaded too."""
+    session = Session()
+    try:
+        return session.query(OutboxMessage)\
+                      .filter(OutboxMessage.status == 'pending')\
+                      .order_by(OutboxMessage.id)\
+                      .all()
+    finally:
+        session.close()
+
+
+@timed
+def mark_outbox_sent(message_id, tg_message_id):
+    session = Session()
+    try:
+        session.query(OutboxMessage).filter(OutboxMessage.id == message_id)\
+               .update({'status': 'sent', 'tg_message_id': tg_message_id, 'last_error': None,
+                        'sent_at': datetime.datetime.now()})
+        session.commit()
+    finally:
+        session.close()
+
+
+@timed
+def mark_outbox_error(message_id, error, next_attempt_at=None):
+    """Counts a failed attempt; without `next_attempt_at` the row is given up as failed."""
+    session = Session()
+    try:
+        session.query(OutboxMessage).filter(OutboxMessage.id == message_id)\
+               .update({'attempts': OutboxMessage.attempts + 1, 'last_error': str(error)[:1000],
+                        'next_attempt_at': next_attempt_at,
+                        'status': 'pending' if next_attempt_at else 'failed'})
+        session.commit()
+    finally:
+        session.close()
+
+
+@timed
+def register_poll(poll_id, chat_id, language, grammar_topic=None, question_id=None, correct_option_id=None):
+    """Records a sent quiz poll so that its results can be grouped by language and topic."""
+    session = Session()
+    try:
+        session.merge(PollStat(poll_id=str(poll_id), chat_id=str(chat_id), language=language or 'unknown',
+                               grammar_topic=grammar_topic, question_id=question_id,
+                               correct_option_id=correct_option_id, total_voters=0,
+                               sent_at=datetime.datetime.now()))
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+@timed
+def upsert_poll_stats(rows):
+    """Writes a batch of `{'poll_id', 'option_votes', 'total_voters', 'correct_votes'}` in one statement.
+
+    Known polls get their counts updated; unknown ones are inserted with language 'unknown'.
+    A NULL `correct_votes` keeps the stored value.
+    """
+    if not rows:
+        return
+    now = datetime.datetime.now()
+    rows = [{**row, 'updated_at': now} for row in rows]
+    session = Session()
+    try:
+        dialect = session.get_bind().dialect.name
+        if dialect in ('postgresql', 'sqlite'):
+            insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+            stmt = insert(PollStat).values(language='unknown')
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[PollStat.poll_id],
+                set_={'option_votes': stmt.excluded.option_votes,
+                      'total_voters': stmt.excluded.total_voters,
+                      'correct_votes': func.coalesce(stmt.excluded.correct_votes, PollStat.correct_votes),
+                      'updated_at': stmt.excluded.updated_at})
+            session.execute(stmt, rows)
+        else:
+            # No portable upsert: fall back to one merge per row, still in a single transaction
+            for row in rows:
+                stat = session.get(PollStat, row['poll_id']) or PollStat(poll_id=row['poll_id'], language='unknown')
+                for key, value in row.items():
+                    if value is not None or key != 'correct_votes':
+                        setattr(stat, key, value)
+                session.merge(stat)
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+@timed
+def get_topic_stats(language=None):
+    """Answer accuracy per language and grammar topic, worst first.
+
+    Returns `(language, grammar_topic, polls, voters, correct_votes)` rows.
+    """
+    session = Session()
+    try:
+        query = session.query(PollStat.language, PollStat.grammar_topic, func.count(PollStat.poll_id),
+                              func.sum(PollStat.total_voters), func.sum(PollStat.correct_votes))\
+                       .group_by(PollStat.language, PollStat.grammar_topic)
+        if language:
+            query = query.filter(PollStat.language == language)
+        rows = query.all()
+        return sorted(rows, key=lambda r: (r[4] or 0) / r[3] if r[3] else 1.0)
+    finally:
+        session.close()
+
+
+@timed
+def get_daily_news(date):
+    """The DailyNews row of `date`, or None."""
+    session = Session()
+    try:
+        return session.get(DailyNews, date)
+    finally:
+        session.close()
+
+
+@timed
+def claim_daily_news(date, owner, lease_seconds):
+    """Claims the generation of `date`'s news for `owner`; returns whether the claim succeeded.
+
+    The first claim inserts a pending row (the primary key makes that atomic); later claims
+    only succeed by taking over a pending row whose claim is older than `lease_seconds`,
+    i.e. whose worker died, with a conditional UPDATE that at most one worker can win.
+    """
+    now = datetime.datetime.now()
+    session = Session()
+    try:
+        session.add(DailyNews(date=date, status='pending', owner=owner, claimed_at=now))
+        session.commit()
+        return True
+    except IntegrityError:
+        session.rollback()
+    finally:
+        session.close()
+    session = Session()
+    try:
+        taken = session.query(DailyNews)\
+                       .filter(DailyNews.date == date,
+                               DailyNews.status == 'pending',
+                               DailyNews.claimed_at < now - datetime.timedelta(seconds=lease_seconds))\
+                       .update({'owner': owner, 'claimed_at': now}, synchronize_session=False)
+        session.commit()
+        return taken == 1
+    finally:
+        session.close()
+
+
+@timed
+def renew_daily_news(date, owner):
+    """Extends `owner`'s claim on `date` by restarting its lease; False if the claim was lost."""
+    session = Session()
+    try:
+        renewed = session.query(DailyNews)\
+                         .filter(DailyNews.date == date, DailyNews.status == 'pending', DailyNews.owner == owner)\
+                         .update({'claimed_at': datetime.datetime.now()}, synchronize_session=False)
+        session.commit()
+        return renewed == 1
+    finally:
+        session.close()
+
+
+@timed
+def store_daily_news(date, owner, news):
+    """Publishes the news generated under `owner`'s claim; False if the claim was lost.
+
+    Raises ValueError for an empty list: every later run of the date would reuse it.
+    """
+    if not news:
+        raise ValueError(f"Refusing to store an empty news list for {date}")
+    session = Session()
+    try:
+        stored = session.query(DailyNews)\
+                        .filter(DailyNews.date == date, DailyNews.status == 'pending', DailyNews.owner == owner)\
+                        .update({'status': 'ready', 'news': json.dumps(news, ensure_ascii=False),
+                                 'updated_at': datetime.datetime.now()}, synchronize_session=False)
+        session.commit()
+        return stored == 1
+    finally:
+        session.close()
+
+
+@timed
+def release_daily_news(date, owner):
+    """Drops `owner`'s pending claim after a failed generation, so another worker can claim at once."""
+    session = Session()
+    try:
+        session.query(DailyNews)\
+               .filter(DailyNews.date == date, DailyNews.status == 'pending', DailyNews.owner == owner)\
+               .delete(synchronize_session=False)
+        session.commit()
     finally:
         session.close()
@@ -0,0 +1,160 @@
+import datetime
+import fcntl
+import json
+import logging
+import os
+import re
+import zlib
+from typing import List, Optional
+
+import numpy as np
+
+from config import Parameter
+
+NUM_PERM = 128
+BANDS = 32
+ROWS = NUM_PERM // BANDS
+SHINGLE_SIZE = 5
+# Signatures appended since the last merge are scanned linearly until there are this many
+MERGE_EVERY = 1024
+
+_PRIME = np.uint64((1 << 61) - 1)
+_MASK = np.uint64(0xFFFFFFFF)
+_rng = np.random.RandomState(20240601)  # fixed seed: persisted signatures must stay comparable
+_PERM_A = _rng.randint(1, 1 << 32, size=NUM_PERM, dtype=np.uint64)
+_PERM_B = _rng.randint(0, 1 << 32, size=NUM_PERM, dtype=np.uint64)
+
+
+def normalize(text: str) -> str:
+    return re.sub(r"\s+", " ", re.sub(r"[^\w\s]", " ", (text or "").lower())).strip()
+
+
+def minhash(text: str) -> np.ndarray:
+    """MinHash signature (NUM_PERM uint32) of the character shingles of `text`."""
+    norm = normalize(text)
+    if len(norm) <= SHINGLE_SIZE:
+        shingles = {norm}
+    else:
+        shingles = {norm[i:i + SHINGLE_SIZE] for i in range(len(norm) - SHINGLE_SIZE + 1)}
+    hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+    # Universal hashing (a*x + b) mod p for every permutation at once; uint64 wraparound is intended
+    permuted = ((_PERM_A[:, None] * hashes[None, :] + _PERM_B[:, None]) % _PRIME) & _MASK
+    return permuted.min(axis=1).astype(np.uint32)
+
+
+def band_keys(signatures: np.ndarray) -> np.ndarray:
+    """Collapses each band of ROWS signature values into one uint64 LSH bucket key."""
+    sig = signatures.reshape(-1, BANDS, ROWS).astype(np.uint64)
+    keys = np.zeros(sig.shape[:2], dtype=np.uint64)
+    for r in range(ROWS):
+        keys = (keys * np.uint64(0x100000001B3)) ^ sig[:, :, r]
+    return keys
+
+
+class DuplicateIndex:
+    """Persistent MinHash/LSH index over everything already published of one kind.
+
+    Signatures live in `<dir>/<name>_signatures.npy` (N x NUM_PERM uint32) and the archived
+    texts in `<dir>/<name>_items.jsonl`, row for row; writers take `<dir>/<name>.lock`. Lookups binary-search one sorted bucket-key column per
+    band, so a check costs O(BANDS * log N) regardless of how large the archive grows.
+    """
+
+    def __init__(self, name: str, directory: str = None, threshold: float = None):
+        self.name = name
+        self.directory = directory or Parameter.ARCHIVE_DIR
+        self.threshold = threshold if threshold is not None else Parameter.DEDUP_THRESHOLD
+        self.signatures_path = os.path.join(self.directory, f"{name}_signatures.npy")
+        self.items_path = os.path.join(self.directory, f"{name}_items.jsonl")
+        self.lock_path = os.path.join(self.directory, f"{name}.lock")
+        self.signatures = self._load()
+        self._merge()
+
+    def _load(self) -> np.ndarray:
+        if os.path.exists(self.signatures_path):
+            return np.load(self.signatures_path)
+        return np.empty((0, NUM_PERM), dtype=np.uint32)
+
+    def __len__(self) -> int:
+        return len(self.signatures)
+
+    def _merge(self):
+        # Sort bucket keys per band; rows [0, _n_sorted) are searchable by binary search
+        keys = band_keys(self.signatures)
+        self._order = np.argsort(keys, axis=0, kind="stable")
+        self._sorted_keys = np.take_along_axis(keys, self._order, axis=0)
+        self._n_sorted = len(self.signatures)
+
+    def _candidates(self, signature: np.ndarray) -> np.ndarray:
+        query = band_keys(signature)[0]
+        found = []
+        for b in range(BANDS):
+            column = self._sorted_keys[:, b]
+            lo = np.searchsorted(column, query[b], side="left")
+            hi = np.searchsorted(column, query[b], side="right")
+            if hi > lo:
+                found.append(self._order[lo:hi, b])
+        tail = self.signatures[self._n_sorted:]
+        if len(tail):
+            hits = (band_keys(tail) == query).any(axis=1)
+            found.append(np.nonzero(hits)[0] + self._n_sorted)
+        return np.unique(np.concatenate(found)) if found else np.empty(0, dtype=np.int64)
+
+    def find_duplicate(self, text: str, signature: np.ndarray = None) -> Optional[dict]:
+        """Returns `{'row', 'similarity'}` of the closest archived near-duplicate, or None."""
+        if not len(self.signatures):
+            return None
+        signature = minhash(text) if signature is None else signature
+        candidates = self._candidates(signature)
+        if not len(candidates):
+            return None
+        similarity = (self.signatures[candidates] == signature).mean(axis=1)
+        best = int(np.argmax(similarity))
+        if similarity[best] < self.threshold:
+            return None
+        return {'row': int(candidates[best]), 'similarity': float(similarity[best])}
+
+    def is_duplicate(self, text: str) -> bool:
+        return self.find_duplicate(text) is not None
+
+    def add(self, texts: List[str], meta: dict = None):
+        """Archives published texts and persists the updated index.
+
+        Other instances may have archived rows since this one loaded, so the signatures are
+        re-read under the archive lock and the new rows appended to what is on disk.
+        """
+        texts = [t for t in texts if t]
+        if not texts:
+            return
+        new = np.stack([minhash(t) for t in texts])
+
+        os.makedirs(self.directory, exist_ok=True)
+        published = datetime.date.today().isoformat()
+        with open(self.lock_path, mode="a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                stored = self._load()
+                signatures = np.concatenate([stored, new])
+                tmp_path = self.signatures_path + ".tmp.npy"
+                np.save(tmp_path, signatures)
+                os.replace(tmp_path, self.signatures_path)
+                with open(self.items_path, mode="a", encoding="utf-8") as f:
+                    for t in texts:
+                        f.write(json.dumps({"text": t, "published": published, **(meta or {})},
+                                           ensure_ascii=False) + "\n")
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+        merged = len(stored) != len(self.signatures)  # another instance archived rows meanwhile
+        self.signatures = signatures
+        if merged or len(self.signatures) - self._n_sorted >= MERGE_EVERY:
+            self._merge()
+        logging.info("Archived %s %s item(s); archive size=%s", len(texts), self.name, len(self.signatures))
+
+
+def question_text(question: dict) -> str:
+    """Text a quiz question is compared on: the question and its correct option."""
+    try:
+        correct = question['options'][int(question['correct_option_id'])]
+    except (KeyError, IndexError, TypeError, ValueError):
+        correct = ""
+    return f"{question.get('question', '')} {correct}"
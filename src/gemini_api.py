@@ -1,6 +1,11 @@
 import google.generativeai as genai
 import typing_extensions as typing
 import logging
+from typing import Optional
+
+from config import Parameter
+from rate_governor import get_governor, prompt_tokens
+from token_budget import Usage, get_token_budget
 
 
 class Verification(typing.TypedDict):
@@ -11,20 +16,89 @@ class Verification(typing.TypedDict):
 class GeminiAPI:
     def __init__(self, **kwargs):
         genai.configure(api_key=kwargs.get('api_key'))
-        self.model = genai.GenerativeModel(kwargs.get('model', 'gemini-1.5-pro'))
-        self.generation_config = genai.types.GenerationConfig(
+        self.model_name = kwargs.get('model', 'gemini-1.5-pro')
+        self.model = genai.GenerativeModel(self.model_name)
+        self.max_tokens = kwargs.get('max_tokens', 2000)
+        self.generation_config = self._generation_config(self.max_tokens, kwargs.get('temperature', 0.1))
+
+    @staticmethod
+    def _generation_config(max_tokens: int, temperature: float):
+        return genai.types.GenerationConfig(
             candidate_count=1,
-            temperature=kwargs.get('temperature', 0.1),
-            max_output_tokens=kwargs.get('max_tokens', 2000),
+            temperature=temperature,
+            max_output_tokens=max_tokens,
             # stop_sequences=["x"],
             response_mime_type='application/json',
             # response_schema=list[Verification]
         )
 
-    def generate_response(self, messages):
+    def _config_for(self, max_tokens: int):
+        if max_tokens == self.generation_config.max_output_tokens:
+            return self.generation_config
+        return self._generation_config(max_tokens, self.generation_config.temperature)
+
+    @staticmethod
+    def _usage(response) -> Usage:
+        usage = getattr(response, 'usage_metadata', None)
+        output = getattr(usage, 'candidates_token_count', 0) or 0
+        reasoning = getattr(usage, 'thoughts_token_count', 0) or 0
+        finish_reason = getattr(response.candidates[0], 'finish_reason', None) if response.candidates else None
+        return Usage(output, reasoning, getattr(finish_reason, 'name', finish_reason) in ('MAX_TOKENS', 2))
+
+    @staticmethod
+    def _text(response) -> Optional[str]:
+        # `response.text` raises when a truncated candidate has no parts
         try:
-            response = self.model.generate_content(messages, generation_config=self.generation_config,)
             return response.text
+        except ValueError:
+            return None
+
+    def generate_response(self, messages, call_type: Optional[str] = None):
+        budget = get_token_budget()
+        max_tokens = budget.limits(call_type, self.max_tokens, self.model_name)[0]
+        try:
+            for _ in range(Parameter.TRUNCATION_RETRIES + 1):
+                response = self.model.generate_content(messages, generation_config=self._config_for(max_tokens),)
+                usage = self._usage(response)
+                budget.record(call_type, usage, max_tokens, self.model_name)
+                if not usage.truncated:
+                    break
+                logging.warning("Gemini answer truncated: call_type=%s max_tokens=%s", call_type, max_tokens)
+                max_tokens = budget.escalate(call_type, max_tokens, self.model_name)[0]
+            return self._text(response)
+        except Exception as e:
+            logging.error("An error occurred: %s", e)
+            return None
+
+    async def agenerate_response(self, messages, timeout: Optional[float] = None, call_type: Optional[str] = None):
+        """Async counterpart of `generate_response`.
+
+        The Gemini SDK talks gRPC rather than httpx, so it keeps its own (HTTP/2, multiplexed)
+        channel instead of the shared httpx pool; the channel is reused across calls.
+        Only the output budget adapts per `call_type`: this SDK exposes no reasoning-effort knob.
+        Calls go through the 'gemini' rate governor, like OpenaiAPI's through 'openai'.
+        """
+        budget = get_token_budget()
+        max_tokens = budget.limits(call_type, self.max_tokens, self.model_name)[0]
+        governor = get_governor('gemini')
+        prompt = prompt_tokens(messages)
+        try:
+            for _ in range(Parameter.TRUNCATION_RETRIES + 1):
+                response = await governor.call(
+                    lambda: self.model.generate_content_async(
+                        messages,
+                        generation_config=self._config_for(max_tokens),
+                        request_options={'timeout': timeout if timeout is not None else Parameter.LLM_TIMEOUT},
+                    ),
+                    tokens=prompt + max_tokens,
+                    used_tokens=lambda result: prompt + sum(self._usage(result)[:2]))
+                usage = self._usage(response)
+                budget.record(call_type, usage, max_tokens, self.model_name)
+                if not usage.truncated:
+                    break
+                logging.warning("Gemini answer truncated: call_type=%s max_tokens=%s", call_type, max_tokens)
+                max_tokens = budget.escalate(call_type, max_tokens, self.model_name)[0]
+            return self._text(response)
         except Exception as e:
-            logging.error(f"An error occurred: {e}")
+            logging.error("An error occurred: %s", e)
             return None
@@ -0,0 +1,55 @@
+import importlib.util
+import logging
+from typing import Optional
+
+import httpx
+
+from config import Parameter
+
+
+def _http2_available() -> bool:
+    # httpx only speaks HTTP/2 when the optional `h2` package is installed
+    return importlib.util.find_spec("h2") is not None
+
+
+def build_timeout(timeout: Optional[float] = None) -> httpx.Timeout:
+    """Builds a per-call timeout; the connect phase is capped separately from the total."""
+    total = timeout if timeout is not None else Parameter.LLM_TIMEOUT
+    return httpx.Timeout(total, connect=min(total, Parameter.HTTP_CONNECT_TIMEOUT))
+
+
+_async_client: Optional[httpx.AsyncClient] = None
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """Returns the process-wide async HTTP client shared by all provider SDKs.
+
+    The client keeps connections alive between calls and negotiates HTTP/2 when
+    available, so concurrent LLM requests are multiplexed over a small pool instead
+    of paying a TLS handshake each. It is bound to the event loop that first uses it;
+    call `aclose_async_http_client()` before that loop exits.
+    """
+    global _async_client
+    if _async_client is None or _async_client.is_closed:
+        http2 = _http2_available()
+        _async_client = httpx.AsyncClient(
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=Parameter.HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=Parameter.HTTP_MAX_KEEPALIVE,
+                keepalive_expiry=Parameter.HTTP_KEEPALIVE_EXPIRY,
+            ),
+            timeout=build_timeout(),
+        )
+        logging.info(
+            "Shared HTTP pool created: http2=%s max_connections=%s keepalive=%s",
+            http2, Parameter.HTTP_MAX_CONNECTIONS, Parameter.HTTP_MAX_KEEPALIVE,
+        )
+    return _async_client
+
+
+async def aclose_async_http_client():
+    global _async_client
+    if _async_client is not None and not _async_client.is_closed:
+        await _async_client.aclose()
+    _async_client = None
@@ -0,0 +1,91 @@
+import asyncio
+import concurrent.futures
+import weakref
+from io import BytesIO
+
+from PIL import Image
+
+from config import Parameter
+from profiling import timed
+
+# Lowest quality the byte-budget search may go down to
+MIN_QUALITY = 40
+
+_executor = None
+# {(id(image), settings): bytes}; PIL images are unhashable, so entries are keyed by id and
+# dropped by a finalizer when the image is garbage collected (before its id can be reused)
+_cache = {}
+_finalized = set()
+
+
+def _get_executor() -> concurrent.futures.ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = concurrent.futures.ThreadPoolExecutor(max_workers=Parameter.IMAGE_ENCODE_WORKERS,
+                                                          thread_name_prefix='image-encode')
+    return _executor
+
+
+def _save(image: Image.Image, fmt: str, quality: int) -> bytes:
+    buffer = BytesIO()
+    if fmt == 'PNG':
+        image.save(buffer, format='PNG', optimize=True)
+    elif fmt == 'WEBP':
+        image.save(buffer, format='WEBP', quality=quality, method=4)
+    else:
+        image.save(buffer, format='JPEG', quality=quality, optimize=True, progressive=True)
+    return buffer.getvalue()
+
+
+@timed
+def encode_image(image: Image.Image, fmt: str = None, max_side: int = None, quality: int = None,
+                 max_bytes: int = None) -> bytes:
+    """Encodes a picture for Telegram: downscaled to `max_side` and lossy-compressed.
+
+    With `max_bytes` the quality is lowered (binary search, not below MIN_QUALITY) until the
+    result fits; otherwise `quality` is used as is. Defaults come from `Parameter.IMAGE_*`.
+    """
+    fmt = (fmt or Parameter.IMAGE_FORMAT).upper()
+    max_side = max_side or Parameter.IMAGE_MAX_SIDE
+    quality = quality or Parameter.IMAGE_QUALITY
+    max_bytes = max_bytes if max_bytes is not None else Parameter.IMAGE_MAX_BYTES
+
+    if max(image.size) > max_side:
+        image = image.copy()
+        image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+    if fmt != 'PNG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+
+    data = _save(image, fmt, quality)
+    if fmt == 'PNG' or not max_bytes or len(data) <= max_bytes:
+        return data
+    low, high, best = MIN_QUALITY, quality - 1, None
+    while low <= high:
+        middle = (low + high) // 2
+        candidate = _save(image, fmt, middle)
+        if len(candidate) <= max_bytes:
+            best, low = candidate, middle + 1
+        else:
+            high = middle - 1
+    # Over budget even at MIN_QUALITY: send the smallest we have rather than nothing
+    return best if best is not None else _save(image, fmt, MIN_QUALITY)
+
+
+def _forget(image_id: int):
+    _finalized.discard(image_id)
+    for key in [key for key in _cache if key[0] == image_id]:
+        del _cache[key]
+
+
+async def aencode_image(image: Image.Image, **settings) -> bytes:
+    """`encode_image` on the encoding thread pool, cached per image object and settings."""
+    key = (id(image), tuple(sorted(settings.items())))
+    if key in _cache:
+        return _cache[key]
+    loop = asyncio.get_running_loop()
+    data = await loop.run_in_executor(_get_executor(), lambda: encode_image(image, **settings))
+    _cache[key] = data
+    if id(image) not in _finalized:
+        _finalized.add(id(image))
+        weakref.finalize(image, _forget, id(image))
+    return data
@@ -0,0 +1,121 @@
+import atexit
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+
+from config import Parameter
+
+# Attributes every LogRecord has; anything else was passed through `extra=` and is emitted as a field
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName'}
+
+# Libraries whose DEBUG output is wire-level noise or full request bodies rather than pipeline
+# payloads; the root logger is at DEBUG whenever the debug file is on, so they are capped here
+_NOISY_LOGGERS = {'httpcore': logging.INFO, 'hpack': logging.INFO, 'h2': logging.INFO, 'urllib3': logging.INFO,
+                  'PIL': logging.INFO, 'asyncio': logging.INFO, 'httpx': logging.INFO, 'openai': logging.INFO,
+                  'telegram': logging.INFO, 'google': logging.INFO, 'grpc': logging.INFO,
+                  # INFO would log every SQL statement
+                  'sqlalchemy': logging.WARNING}
+
+_listener = None
+
+
+class LazyJson:
+    """Defers `json.dumps` of a payload until a record is actually emitted at its level."""
+
+    def __init__(self, obj):
+        self.obj = obj
+
+    def __str__(self):
+        try:
+            return json.dumps(self.obj, ensure_ascii=False, default=str)
+        except (TypeError, ValueError):
+            return str(self.obj)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; messages longer than `max_chars` are cut to keep stdout small."""
+
+    def __init__(self, max_chars: int = None):
+        super().__init__()
+        self.max_chars = max_chars
+
+    def format(self, record: logging.LogRecord) -> str:
+        message = record.getMessage()
+        if self.max_chars and len(message) > self.max_chars:
+            message = f"{message[:self.max_chars]}...<truncated {len(message) - self.max_chars} chars>"
+        payload = {
+            'ts': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': message,
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                payload[key] = value
+        if record.exc_info:
+            payload['exc'] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    # The stock QueueHandler fully formats the record on the calling thread. Only the message
+    # is rendered here: %-args (lists, dicts, LazyJson payloads) may be changed by the caller
+    # as soon as the logging call returns. The JSON formatting is left to the listener thread.
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+
+def setup_logging(level: str = None, debug_file: str = None, max_chars: int = None):
+    """Routes all logging through a queue drained by a background listener thread.
+
+    Records at `level` and above go to stdout as capped JSON lines; when `debug_file` is set,
+    every record (DEBUG included, with full payloads) also goes to that rotating file.
+    """
+    global _listener
+    level = logging.getLevelName(level or Parameter.LOG_LEVEL)
+    debug_file = Parameter.LOG_DEBUG_FILE if debug_file is None else debug_file
+    max_chars = max_chars or Parameter.LOG_MAX_CHARS
+
+    stdout_handler = logging.StreamHandler(sys.stdout)
+    stdout_handler.setLevel(level)
+    stdout_handler.setFormatter(JsonFormatter(max_chars=max_chars))
+    handlers = [stdout_handler]
+    if debug_file:
+        if os.path.dirname(debug_file):
+            os.makedirs(os.path.dirname(debug_file), exist_ok=True)
+        file_handler = logging.handlers.RotatingFileHandler(
+            debug_file, maxBytes=Parameter.LOG_DEBUG_FILE_BYTES, backupCount=Parameter.LOG_DEBUG_FILE_COUNT,
+            encoding='utf-8')
+        file_handler.setLevel(logging.DEBUG)
+        file_handler.setFormatter(JsonFormatter())
+        handlers.append(file_handler)
+
+    if _listener is not None:
+        _listener.stop()
+    log_queue = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_DeferredQueueHandler(log_queue))
+    root.setLevel(logging.DEBUG if debug_file else level)
+    for name, library_level in _NOISY_LOGGERS.items():
+        logging.getLogger(name).setLevel(library_level)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Flushes the queue; safe to call more than once."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
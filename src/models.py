@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text
+from sqlalchemy import create_engine, Column, Integer, String, Text, BigInteger, Date, DateTime, LargeBinary, Index
 from sqlalchemy.orm import declarative_base, sessionmaker
 import os
 import re
@@ -17,7 +17,7 @@ if database_url:
 
     # Mask the password for printing
     masked_url = re.sub(r':(?:[^@/]+)@', r':[PASSWORD]@', database_url)
-    logger.info(f"Connecting using URL: {masked_url}")
+    logger.info("Connecting using URL: %s", masked_url)
 
     # If DATABASE_URL is set, assume it's for PostgreSQL and ensure correct prefix
     if database_url.startswith("postgres://"):
@@ -47,4 +47,53 @@ class ForeignWord(Base):
     language = Column(String(50), nullable=False)
     example = Column(Text)
 
+
+class OutboxMessage(Base):
+    """A planned Telegram send; delivery drains these rows in id order per chat."""
+    __tablename__ = 'outbox'
+    id = Column(Integer, primary_key=True)
+    chat_id = Column(String(100), nullable=False)
+    kind = Column(String(20), nullable=False)  # photo, poll or message
+    payload = Column(Text, nullable=False)  # JSON keyword arguments of the Bot API call
+    photo = Column(LargeBinary)
+    send_key = Column(String(64), nullable=False, unique=True)  # sha256 of plan date, chat and slot
+    plan_date = Column(Date)  # the run date the send was planned for
+    slot = Column(Integer)  # position in the chat's plan of that date: 0 picture, then the polls
+    meta = Column(Text)  # JSON context that is not sent, e.g. language and topic of a poll
+    status = Column(String(20), nullable=False, default='pending', index=True)  # pending, sent or failed
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime)
+    last_error = Column(Text)
+    tg_message_id = Column(BigInteger)
+    created_at = Column(DateTime, nullable=False)
+    sent_at = Column(DateTime)
+
+
+class PollStat(Base):
+    """Latest vote counts of a published quiz poll."""
+    __tablename__ = 'poll_stats'
+    poll_id = Column(String(64), primary_key=True)
+    chat_id = Column(String(100))
+    language = Column(String(50), nullable=False, default='unknown')
+    grammar_topic = Column(String(255))
+    question_id = Column(Integer)
+    correct_option_id = Column(Integer)
+    option_votes = Column(Text)  # JSON list of voter counts per option
+    total_voters = Column(Integer, nullable=False, default=0)
+    correct_votes = Column(Integer)
+    sent_at = Column(DateTime)
+    updated_at = Column(DateTime)
+    __table_args__ = (Index('ix_poll_stats_language_topic', 'language', 'grammar_topic'),)
+
+
+class DailyNews(Base):
+    """The news of one date, generated once and reused by every run, language and process."""
+    __tablename__ = 'daily_news'
+    date = Column(Date, primary_key=True)
+    status = Column(String(20), nullable=False, default='pending')  # pending (being generated) or ready
+    owner = Column(String(64))  # claim token of the worker generating it
+    claimed_at = Column(DateTime, nullable=False)
+    news = Column(Text)  # JSON list of news items once ready
+    updated_at = Column(DateTime)
+
 Base.metadata.create_all(engine)
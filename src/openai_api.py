@@ -1,17 +1,36 @@
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI, NOT_GIVEN
 from io import BytesIO
 from PIL import Image
 import requests
 import logging
 from typing import List, Dict, Union, Optional
 
+from config import Parameter
+from http_client import get_async_http_client, build_timeout
+from rate_governor import get_governor, prompt_tokens
+from token_budget import Usage, get_token_budget
+
+
 class OpenaiAPI:
 
     def __init__(self, **kwargs):
-        self.client = OpenAI(api_key=kwargs.get('api_key'))
+        self.api_key = kwargs.get('api_key')
+        self.client = OpenAI(api_key=self.api_key)
         self.model = kwargs.get('model', 'gpt-4o')
         self.temperature = kwargs.get('temperature', 0.3)
         self.max_tokens = kwargs.get('max_tokens', 3000)
+        self._async_client = None
+        self._async_http_client = None
+
+    @property
+    def async_client(self) -> AsyncOpenAI:
+        # Created lazily so that the shared pool is bound to the running event loop
+        http_client = get_async_http_client()
+        if self._async_client is None or self._async_http_client is not http_client:
+            # No SDK retries: 429s have to reach the rate governor, which retries them itself
+            self._async_client = AsyncOpenAI(api_key=self.api_key, http_client=http_client, max_retries=0)
+            self._async_http_client = http_client
+        return self._async_client
 
     def _flatten_messages(self, messages: Union[str, List[Dict[str, str]]]) -> str:
         """Best-effort conversion of a chat messages list into a single input string."""
@@ -44,149 +63,238 @@ class OpenaiAPI:
         except Exception:
             # Fallback: best-effort flattening
             return self._flatten_messages(messages)
+
     def _has_responses_api(self) -> bool:
         return hasattr(self.client, "responses")
 
-    def generate_response(self, messages: Union[str, List[Dict[str, str]]]) -> Optional[str]:
-        try:
-            # Route GPT-5 models to the Responses API
-            if str(self.model).startswith("gpt-5"):
-                if self._has_responses_api():
-                    # Use a single flattened string as input for best compatibility
-                    input_payload = self._flatten_messages(messages)
-                    resp = self.client.responses.create(
-                        model=self.model,
-                        input=input_payload,
-                        temperature=1,
-                        reasoning={"effort": "low"},
-                        max_output_tokens=self.max_tokens,
-                    )
+    def _is_gpt5(self) -> bool:
+        return str(self.model).startswith("gpt-5")
 
-                    # Prefer the convenience property when available
-                    text = getattr(resp, "output_text", None)
-
-                    # Fallback: assemble text from the structured output fields
-                    if not text:
-                        try:
-                            outputs = getattr(resp, "output", None) or getattr(resp, "outputs", None)
-                            if outputs:
-                                parts: List[str] = []
-                                for out in outputs:
-                                    content = getattr(out, "content", None)
-                                    if content:
-                                        for c in content:
-                                            t = getattr(c, "text", None)
-                                            if t:
-                                                parts.append(t)
-                                if parts:
-                                    text = "\n".join(parts)
-                        except Exception:
-                            pass
-
-                    # Deep-search any 'text' fields in the serialized object as a last resort
-                    if not text:
-                        try:
-                            raw = resp.model_dump() if hasattr(resp, "model_dump") else getattr(resp, "__dict__", None) or resp
-                            parts: List[str] = []
-                            def _collect(obj):
-                                if isinstance(obj, dict):
-                                    for k, v in obj.items():
-                                        if k == "text" and isinstance(v, str):
-                                            parts.append(v)
-                                        else:
-                                            _collect(v)
-                                elif isinstance(obj, list):
-                                    for it in obj:
-                                        _collect(it)
-                            _collect(raw)
-                            if parts:
-                                text = "\n".join(parts)
-                        except Exception:
-                            pass
-
-                    # Log raw payload to help diagnose schema changes
-                    if not text:
-                        try:
-                            raw_json = resp.model_dump_json() if hasattr(resp, "model_dump_json") else str(resp)
-                            logging.info(f"Responses API raw: {raw_json}")
-                        except Exception:
-                            pass
-
-                    if not text:
-                        # Fallback to Chat Completions for GPT-5 with correct params
-                        response = self.client.chat.completions.create(
-                            model=self.model,
-                            messages=messages if isinstance(messages, list) else [{"role": "user", "content": str(messages)}],
-                            temperature=1,
-                            extra_body={
-                                "max_completion_tokens": self.max_tokens,
-                                "reasoning": {"effort": "low"},
-                            },
-                        )
-                        content = (response.choices[0].message.content or "").strip()
-                        if not content:
-                            try:
-                                logging.info(
-                                    "OpenAI fallback Chat returned empty content. finish_reason=%s",
-                                    getattr(response.choices[0], "finish_reason", None),
-                                )
-                                logging.info("OpenAI fallback Chat raw: %s", response.model_dump_json())
-                            except Exception:
-                                pass
-                            return None
-                        logging.info(f"Generated answer (fallback Chat): {content}")
-                        return content
-
-                    logging.info(f"Generated answer: {text}")
-                    return text.strip()
-                else:
-                    # SDK lacks Responses API; use Chat Completions with GPT-5 params via extra_body
-                    # Explicitly set temperature=1 (only default supported by GPT-5 on Chat)
-                    response = self.client.chat.completions.create(
-                        model=self.model,
-                        messages=messages if isinstance(messages, list) else [{"role": "user", "content": str(messages)}],
-                        temperature=1,
-                        extra_body={
-                            "max_completion_tokens": self.max_tokens,
-                            "reasoning": {"effort": "low"},
-                        },
-                    )
-                    content = (response.choices[0].message.content or "").strip()
-                    if not content:
-                        try:
-                            logging.info(
-                                "OpenAI Chat returned empty content. finish_reason=%s",
-                                getattr(response.choices[0], "finish_reason", None),
-                            )
-                            logging.info("OpenAI Chat raw: %s", response.model_dump_json())
-                        except Exception:
-                            pass
-                        return None
-                    logging.info(f"Generated answer: {content}")
-                    return content
-
-            # Default path for non-GPT-5 models: Chat Completions API
-            response = self.client.chat.completions.create(
+    def _responses_kwargs(self, messages: Union[str, List[Dict[str, str]]],
+                          max_tokens: int = None, effort: str = "low") -> dict:
+        # Use a single flattened string as input for best compatibility
+        return dict(
+            model=self.model,
+            input=self._flatten_messages(messages),
+            temperature=1,
+            reasoning={"effort": effort},
+            max_output_tokens=max_tokens or self.max_tokens,
+        )
+
+    def _chat_kwargs(self, messages: Union[str, List[Dict[str, str]]],
+                     max_tokens: int = None, effort: str = "low") -> dict:
+        chat_messages = messages if isinstance(messages, list) else [{"role": "user", "content": str(messages)}]
+        if self._is_gpt5():
+            # GPT-5 params go via extra_body; temperature=1 is the only value supported on Chat
+            return dict(
                 model=self.model,
-                messages=messages if isinstance(messages, list) else [{"role": "user", "content": str(messages)}],
-                temperature=self.temperature,
-                max_tokens=self.max_tokens,
+                messages=chat_messages,
+                temperature=1,
+                extra_body={
+                    "max_completion_tokens": max_tokens or self.max_tokens,
+                    "reasoning": {"effort": effort},
+                },
             )
-            content = (response.choices[0].message.content or "").strip()
-            if not content:
-                try:
-                    logging.info(
-                        "OpenAI Chat returned empty content. finish_reason=%s",
-                        getattr(response.choices[0], "finish_reason", None),
-                    )
-                    logging.info("OpenAI Chat raw: %s", response.model_dump_json())
-                except Exception:
-                    pass
-                return None
-            logging.info(f"Generated answer: {content}")
-            return content
+        return dict(
+            model=self.model,
+            messages=chat_messages,
+            temperature=self.temperature,
+            max_tokens=max_tokens or self.max_tokens,
+        )
+
+    @staticmethod
+    def _responses_usage(resp) -> Usage:
+        # output_tokens includes the reasoning tokens; both count against max_output_tokens
+        usage = getattr(resp, "usage", None)
+        output = getattr(usage, "output_tokens", 0) or 0
+        reasoning = getattr(getattr(usage, "output_tokens_details", None), "reasoning_tokens", 0) or 0
+        incomplete = getattr(getattr(resp, "incomplete_details", None), "reason", None)
+        return Usage(output - reasoning, reasoning, incomplete == "max_output_tokens")
+
+    @staticmethod
+    def _chat_usage(response) -> Usage:
+        usage = getattr(response, "usage", None)
+        output = getattr(usage, "completion_tokens", 0) or 0
+        reasoning = getattr(getattr(usage, "completion_tokens_details", None), "reasoning_tokens", 0) or 0
+        finish_reason = getattr(response.choices[0], "finish_reason", None) if response.choices else None
+        return Usage(output - reasoning, reasoning, finish_reason == "length")
+
+    @staticmethod
+    def _responses_text(resp) -> Optional[str]:
+        # Prefer the convenience property when available
+        text = getattr(resp, "output_text", None)
+
+        # Fallback: assemble text from the structured output fields
+        if not text:
+            try:
+                outputs = getattr(resp, "output", None) or getattr(resp, "outputs", None)
+                if outputs:
+                    parts: List[str] = []
+                    for out in outputs:
+                        content = getattr(out, "content", None)
+                        if content:
+                            for c in content:
+                                t = getattr(c, "text", None)
+                                if t:
+                                    parts.append(t)
+                    if parts:
+                        text = "\n".join(parts)
+            except Exception:
+                pass
+
+        # Deep-search any 'text' fields in the serialized object as a last resort
+        if not text:
+            try:
+                raw = resp.model_dump() if hasattr(resp, "model_dump") else getattr(resp, "__dict__", None) or resp
+                parts: List[str] = []
+                def _collect(obj):
+                    if isinstance(obj, dict):
+                        for k, v in obj.items():
+                            if k == "text" and isinstance(v, str):
+                                parts.append(v)
+                            else:
+                                _collect(v)
+                    elif isinstance(obj, list):
+                        for it in obj:
+                            _collect(it)
+                _collect(raw)
+                if parts:
+                    text = "\n".join(parts)
+            except Exception:
+                pass
+
+        # Log raw payload to help diagnose schema changes
+        if not text:
+            try:
+                raw_json = resp.model_dump_json() if hasattr(resp, "model_dump_json") else str(resp)
+                logging.info("Responses API returned no text (%s chars raw)", len(raw_json))
+                logging.debug("Responses API raw: %s", raw_json)
+            except Exception:
+                pass
+        return text
+
+    @staticmethod
+    def _chat_content(response, label: str = "Chat") -> Optional[str]:
+        content = (response.choices[0].message.content or "").strip()
+        if not content:
+            try:
+                logging.info(
+                    "OpenAI %s returned empty content. finish_reason=%s",
+                    label,
+                    getattr(response.choices[0], "finish_reason", None),
+                )
+                logging.debug("OpenAI %s raw: %s", label, response.model_dump_json())
+            except Exception:
+                pass
+            return None
+        logging.info("Generated answer (%s): %s chars", label, len(content))
+        logging.debug("Generated answer (%s): %s", label, content)
+        return content
+
+    def _log_truncation(self, call_type: Optional[str], max_tokens: int, usage: Usage):
+        logging.warning("OpenAI answer truncated: call_type=%s max_tokens=%s output=%s reasoning=%s",
+                        call_type, max_tokens, usage.output_tokens, usage.reasoning_tokens)
+
+    def _generate_once(self, messages, timeout, max_tokens: int, effort: str) -> tuple:
+        # Route GPT-5 models to the Responses API
+        if self._is_gpt5() and self._has_responses_api():
+            resp = self.client.responses.create(**self._responses_kwargs(messages, max_tokens, effort),
+                                                timeout=timeout)
+            usage = self._responses_usage(resp)
+            text = self._responses_text(resp)
+            if text:
+                logging.info("Generated answer: %s chars", len(text))
+                logging.debug("Generated answer: %s", text)
+                return text.strip(), usage
+            if usage.truncated:
+                return None, usage
+            # Fallback to Chat Completions for GPT-5 with correct params
+            response = self.client.chat.completions.create(**self._chat_kwargs(messages, max_tokens, effort),
+                                                           timeout=timeout)
+            return self._chat_content(response, "fallback Chat"), self._chat_usage(response)
+
+        # Non-GPT-5 models, or an SDK without the Responses API: Chat Completions
+        response = self.client.chat.completions.create(**self._chat_kwargs(messages, max_tokens, effort),
+                                                       timeout=timeout)
+        return self._chat_content(response), self._chat_usage(response)
+
+    async def _agenerate_once(self, messages, timeout, max_tokens: int, effort: str) -> tuple:
+        # Every HTTP request, the chat fallback included, takes its own slot and token
+        # reservation from the 'openai' rate governor
+        governor = get_governor('openai')
+        prompt = prompt_tokens(messages)
+
+        def used(usage: Usage) -> int:
+            return prompt + usage.output_tokens + usage.reasoning_tokens
+
+        if self._is_gpt5() and self._has_responses_api():
+            resp = await governor.call(
+                lambda: self.async_client.responses.create(**self._responses_kwargs(messages, max_tokens, effort),
+                                                           timeout=timeout),
+                tokens=prompt + max_tokens, used_tokens=lambda result: used(self._responses_usage(result)))
+            usage = self._responses_usage(resp)
+            text = self._responses_text(resp)
+            if text:
+                logging.info("Generated answer: %s chars", len(text))
+                logging.debug("Generated answer: %s", text)
+                return text.strip(), usage
+            if usage.truncated:
+                return None, usage
+            response = await governor.call(
+                lambda: self.async_client.chat.completions.create(**self._chat_kwargs(messages, max_tokens, effort),
+                                                                  timeout=timeout),
+                tokens=prompt + max_tokens, used_tokens=lambda result: used(self._chat_usage(result)))
+            return self._chat_content(response, "fallback Chat"), self._chat_usage(response)
+
+        response = await governor.call(
+            lambda: self.async_client.chat.completions.create(**self._chat_kwargs(messages, max_tokens, effort),
+                                                              timeout=timeout),
+            tokens=prompt + max_tokens, used_tokens=lambda result: used(self._chat_usage(result)))
+        return self._chat_content(response), self._chat_usage(response)
+
+    def generate_response(self, messages: Union[str, List[Dict[str, str]]],
+                          timeout: Optional[float] = None, call_type: Optional[str] = None) -> Optional[str]:
+        # Keep the SDK default unless the caller asks for an explicit timeout
+        timeout = timeout if timeout is not None else NOT_GIVEN
+        budget = get_token_budget()
+        max_tokens, effort = budget.limits(call_type, self.max_tokens, self.model)
+        try:
+            for _ in range(Parameter.TRUNCATION_RETRIES + 1):
+                text, usage = self._generate_once(messages, timeout, max_tokens, effort)
+                budget.record(call_type, usage, max_tokens, self.model)
+                if not usage.truncated:
+                    break
+                self._log_truncation(call_type, max_tokens, usage)
+                max_tokens, effort = budget.escalate(call_type, max_tokens, self.model)
+            return text
         except Exception as e:
-            logging.error(f"OpenAI generate_response error: {e}")
+            logging.error("OpenAI generate_response error: %s", e)
+            budget.record_failure(call_type, self.model)
+            return None
+
+    async def agenerate_response(self, messages: Union[str, List[Dict[str, str]]],
+                                 timeout: Optional[float] = None, call_type: Optional[str] = None) -> Optional[str]:
+        """Async counterpart of `generate_response` served from the shared HTTP pool.
+
+        `call_type` selects the learned output budget (see token_budget.py); a truncated answer
+        is retried with a doubled budget. Requests go through the 'openai' rate governor, which
+        limits concurrency and retries throttled requests.
+        """
+        request_timeout = build_timeout(timeout)
+        budget = get_token_budget()
+        max_tokens, effort = budget.limits(call_type, self.max_tokens, self.model)
+        try:
+            for _ in range(Parameter.TRUNCATION_RETRIES + 1):
+                text, usage = await self._agenerate_once(messages, request_timeout, max_tokens, effort)
+                budget.record(call_type, usage, max_tokens, self.model)
+                if not usage.truncated:
+                    break
+                self._log_truncation(call_type, max_tokens, usage)
+                max_tokens, effort = budget.escalate(call_type, max_tokens, self.model)
+            return text
+        except Exception as e:
+            logging.error("OpenAI agenerate_response error: %s", e)
+            budget.record_failure(call_type, self.model)
             return None
 
     def generate_image(self, prompt: str, model: str = "dall-e-3") -> Optional[Image.Image]:
@@ -200,5 +308,20 @@ class OpenaiAPI:
             image = Image.open(BytesIO(response.content))
             return image
         except Exception as e:
-            logging.error(f"OpenAI generate_image error: {e}")
+            logging.error("OpenAI generate_image error: %s", e)
+            return None
+
+    async def agenerate_image(self, prompt: str, model: str = "dall-e-3",
+                              timeout: Optional[float] = None) -> Optional[Image.Image]:
+        request_timeout = build_timeout(timeout if timeout is not None else Parameter.IMAGE_TIMEOUT)
+        try:
+            img_resp = await get_governor('openai_images').call(
+                lambda: self.async_client.images.generate(prompt=prompt, model=model, timeout=request_timeout))
+            # Download through the same pool the API call used
+            response = await get_async_http_client().get(img_resp.data[0].url, timeout=request_timeout)
+            response.raise_for_status()
+            image = Image.open(BytesIO(response.content))
+            return image
+        except Exception as e:
+            logging.error("OpenAI agenerate_image error: %s", e)
             return None
@@ -0,0 +1,147 @@
+import argparse
+import asyncio
+import json
+import logging
+import time
+
+import telegram
+
+from config import Config, Parameter
+from crud import get_topic_stats, upsert_poll_stats
+from log_config import setup_logging
+
+
+class TelegramUpdateSource:
+    """Long-polls the Bot API for `poll` and `poll_answer` updates of the polls the bot sent."""
+
+    def __init__(self, bot: telegram.Bot, timeout: int = None):
+        self.bot = bot
+        self.timeout = timeout if timeout is not None else Parameter.POLL_STATS_LONG_POLL
+        self.offset = None
+
+    async def get_updates(self) -> list:
+        updates = await self.bot.get_updates(offset=self.offset, timeout=self.timeout,
+                                             allowed_updates=['poll', 'poll_answer'], read_timeout=self.timeout + 10)
+        if updates:
+            self.offset = updates[-1].update_id + 1
+        return list(updates)
+
+
+class FakeUpdateSource:
+    """Serves prepared batches of Update objects, for running the collector without Telegram."""
+
+    def __init__(self, batches: list, delay: float = 0.0):
+        self.batches = list(batches)
+        self.delay = delay
+
+    @property
+    def exhausted(self) -> bool:
+        return not self.batches
+
+    async def get_updates(self) -> list:
+        await asyncio.sleep(self.delay)
+        return self.batches.pop(0) if self.batches else []
+
+
+class PollStatsCollector:
+    """Folds poll updates into per-poll vote counts and writes them in batched upserts.
+
+    Every `poll` update carries a poll's complete counts, so a burst of updates for one poll
+    collapses into one pending row; the pending rows go to the DB in one statement once
+    `flush_size` polls are pending or `flush_interval` seconds have passed. `poll_answer`
+    updates name a single voter's choice and hold no counts: they are counted and skipped.
+    A failed write puts its rows back, to be written with the next flush.
+    """
+
+    def __init__(self, source, flush_interval: float = None, flush_size: int = None):
+        self.source = source
+        self.flush_interval = flush_interval if flush_interval is not None else Parameter.POLL_STATS_FLUSH_SECONDS
+        self.flush_size = flush_size or Parameter.POLL_STATS_FLUSH_SIZE
+        self.pending = {}
+        self.stats = {'updates': 0, 'poll_answers': 0, 'flushes': 0, 'failed_flushes': 0, 'rows_written': 0}
+        self._last_flush = time.monotonic()
+
+    def ingest(self, updates: list):
+        for update in updates:
+            if update.poll_answer is not None:
+                self.stats['poll_answers'] += 1
+                continue
+            poll = update.poll
+            if poll is None:
+                continue
+            self.stats['updates'] += 1
+            votes = [option.voter_count for option in poll.options]
+            correct = poll.correct_option_id
+            self.pending[str(poll.id)] = {
+                'poll_id': str(poll.id),
+                'option_votes': json.dumps(votes),
+                'total_voters': poll.total_voter_count,
+                'correct_votes': votes[correct] if correct is not None and 0 <= correct < len(votes) else None,
+            }
+
+    async def flush(self):
+        self._last_flush = time.monotonic()
+        if not self.pending:
+            return
+        rows, self.pending = list(self.pending.values()), {}
+        try:
+            await asyncio.to_thread(upsert_poll_stats, rows)
+        except Exception as e:
+            # Counts that arrived meanwhile are newer than the failed ones
+            for row in rows:
+                self.pending.setdefault(row['poll_id'], row)
+            self.stats['failed_flushes'] += 1
+            logging.error("Poll stats flush of %s poll(s) failed, kept for the next one: %s", len(rows), e)
+            return
+        self.stats['flushes'] += 1
+        self.stats['rows_written'] += len(rows)
+        logging.info("Poll stats flushed: %s poll(s)", len(rows))
+
+    def _flush_due(self) -> bool:
+        return len(self.pending) >= self.flush_size or \
+            (self.pending and time.monotonic() - self._last_flush >= self.flush_interval)
+
+    async def run(self, stop: asyncio.Event = None):
+        """Collects until `stop` is set (or a fake source runs dry), then flushes what is left."""
+        stop = stop or asyncio.Event()
+        try:
+            while not stop.is_set() and not getattr(self.source, 'exhausted', False):
+                # A long poll may take a while; stopping must not wait for it
+                fetch = asyncio.ensure_future(self.source.get_updates())
+                stopped = asyncio.ensure_future(stop.wait())
+                await asyncio.wait({fetch, stopped}, return_when=asyncio.FIRST_COMPLETED)
+                stopped.cancel()
+                if not fetch.done():
+                    fetch.cancel()
+                    break
+                try:
+                    updates = fetch.result()
+                except telegram.error.TelegramError as e:
+                    logging.warning("Poll update fetch failed: %s", e)
+                    await asyncio.sleep(Parameter.POLL_STATS_RETRY_SECONDS)
+                    continue
+                self.ingest(updates)
+                if self._flush_due():
+                    await self.flush()
+        finally:
+            await self.flush()
+            logging.info("Poll stats collector stopped: %s", self.stats)
+
+
+async def main(args):
+    if args.report:
+        for language, topic, polls, voters, correct in get_topic_stats(args.language):
+            accuracy = f"{(correct or 0) / voters:.0%}" if voters else "-"
+            print(f"{language:<10} {accuracy:>5} {voters or 0:>7} voters {polls:>4} polls  {topic}")
+        return
+    bot = telegram.Bot(token=Config.TG_TOKEN)
+    async with bot:
+        await PollStatsCollector(TelegramUpdateSource(bot)).run()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Collect quiz poll results, or report accuracy per topic.")
+    parser.add_argument('--report', action='store_true', help="print accuracy per language and grammar topic")
+    parser.add_argument('--language', help="restrict the report to one language")
+    setup_logging()
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,150 @@
+import contextlib
+import cProfile
+import datetime
+import functools
+import inspect
+import io
+import json
+import logging
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+
+from config import Parameter
+
+_enabled = Parameter.PROFILE
+_run = None
+_timings = {}
+# Timed helpers also run in asyncio.to_thread workers
+_timings_lock = threading.Lock()
+# Whether start_run turned tracemalloc on, so finish_run turns it off again
+_started_tracing = False
+
+
+def enable():
+    """Turns on stage and helper profiling, e.g. for `app.py --profile`."""
+    global _enabled
+    _enabled = True
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def timed(func):
+    """Accumulates call counts and wall time of a sync or async helper into the current run.
+
+    Outside a profiled run the wrapper only checks for one and calls `func` straight through.
+    """
+    name = func.__qualname__
+
+    def _record(elapsed: float):
+        with _timings_lock:
+            calls, total, slowest = _timings.get(name, (0, 0.0, 0.0))
+            _timings[name] = (calls + 1, total + elapsed, max(slowest, elapsed))
+
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            if _run is None:
+                return await func(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                _record(time.perf_counter() - started)
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if _run is None:
+            return func(*args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _record(time.perf_counter() - started)
+    return wrapper
+
+
+def start_run(run_id: str = None):
+    """Opens `<PROFILE_DIR>/<run_id>` for the stage artifacts of one pipeline run."""
+    global _run, _started_tracing
+    if not _enabled:
+        return
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(Parameter.PROFILE_TRACE_FRAMES)
+        _started_tracing = True
+    run_id = run_id or datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+    directory = os.path.join(Parameter.PROFILE_DIR, run_id)
+    os.makedirs(directory, exist_ok=True)
+    with _timings_lock:
+        _timings.clear()
+    # CPU time spent before the first stage is mostly interpreter start-up and SDK imports
+    _run = {'dir': directory, 'summary': {'run_id': run_id, 'startup_cpu_s': round(time.process_time(), 3),
+                                          'stages': [], 'helpers': {}}}
+    logging.info("Profiling run %s into %s", run_id, directory)
+
+
+@contextlib.contextmanager
+def stage(name: str):
+    """Profiles one pipeline stage with cProfile and tracemalloc while the run is profiled.
+
+    Only the event-loop thread is profiled; work handed to `asyncio.to_thread` shows up as
+    wall time of the stage, not in its call graph.
+    """
+    if _run is None:
+        yield
+        return
+    profiler = cProfile.Profile()
+    tracemalloc.reset_peak()
+    before = tracemalloc.take_snapshot()
+    current_before = tracemalloc.get_traced_memory()[0]
+    wall_started, cpu_started = time.perf_counter(), time.process_time()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        wall, cpu = time.perf_counter() - wall_started, time.process_time() - cpu_started
+        current, peak = tracemalloc.get_traced_memory()
+        _write_stage(name, profiler, before, tracemalloc.take_snapshot())
+        _run['summary']['stages'].append({'stage': name, 'wall_s': round(wall, 3), 'cpu_s': round(cpu, 3),
+                                          'peak_mb': round(peak / 2 ** 20, 2),
+                                          'retained_mb': round((current - current_before) / 2 ** 20, 2)})
+        logging.info("Profiled stage %s: wall=%.2fs cpu=%.2fs peak=%.1fMB", name, wall, cpu, peak / 2 ** 20)
+
+
+def _write_stage(name: str, profiler: cProfile.Profile, before, after):
+    prefix = os.path.join(_run['dir'], f"{len(_run['summary']['stages']) + 1:02d}_{name}")
+    profiler.dump_stats(prefix + '.prof')
+    text = io.StringIO()
+    pstats.Stats(profiler, stream=text).sort_stats('cumulative').print_stats(Parameter.PROFILE_TOP)
+    with open(prefix + '.txt', mode='w', encoding='utf-8') as f:
+        f.write(text.getvalue())
+    with open(prefix + '.mem.txt', mode='w', encoding='utf-8') as f:
+        for diff in after.compare_to(before, 'lineno')[:Parameter.PROFILE_TOP]:
+            f.write(f"{diff}\n")
+
+
+def finish_run():
+    """Writes `summary.json` (stage totals and helper timings) and closes the run.
+
+    Stops tracemalloc if `start_run` started it: tracing slows every allocation after the run.
+    """
+    global _run, _started_tracing
+    if _run is None:
+        return
+    if _started_tracing:
+        tracemalloc.stop()
+        _started_tracing = False
+    with _timings_lock:
+        timings = sorted(_timings.items())
+    _run['summary']['helpers'] = {name: {'calls': calls, 'total_s': round(total, 4), 'max_s': round(slowest, 4)}
+                                  for name, (calls, total, slowest) in timings}
+    with open(os.path.join(_run['dir'], 'summary.json'), mode='w', encoding='utf-8') as f:
+        json.dump(_run['summary'], f, indent=2)
+    logging.info("Profile written to %s", _run['dir'])
+    _run = None
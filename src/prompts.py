@@ -2,6 +2,8 @@ import random
 import datetime
 import json
 
+from config import TelegramLimit
+
 n_questions = 4
 CATEGORIES = ['Sport', 'Disaster', 'Innovation', 'Science', 'Environment', 'Technology',
               'Healthcare', 'Politics']
@@ -46,9 +48,58 @@ Keys, property names and string values must be enclosed in double quotes,
 in order to json.loads() function can process the response properly.
 """
 
+QUESTION_EXAMPLE = [
+    {
+        "question_id": 1,
+        "grammar_topic": "Prepositions",
+        "question": "Alice travelled ___ 9:20 train, which arrived at 9:55.",
+        "options": ["in the", "by a", "by the", "on the"],
+        "correct_option_id": 3,
+        "explanation": "The preposition on is typically used to indicate traveling by a specific mode of transport like a train, bus, or plane, especially when referring to a specific scheduled service."
+    },
+    {
+        "question_id": 2,
+        "grammar_topic": "Questions and auxiliary verbs",
+        "question": "Do you know where ___ ?",
+        "options": ["Bob have gone", "Bob has gone", "have Bob gone", "has gone Bob"],
+        "correct_option_id": 1,
+        "explanation": "Bob has gone: This is correct because has is the correct auxiliary verb for third-person singular subjects like Bob"
+    },
+    {
+        "question_id": 3,
+        "grammar_topic": "Organising information",
+        "question": " ___ people trying to get into the party.",
+        "options": ["There were too much", "There was too many", "It was too many", "There were too many"],
+        "correct_option_id": 3,
+        "explanation": "There were too many: This is correct because were matches the plural noun people, and many is the appropriate quantifier for countable nouns"
+    },
+    {
+        "question_id": 4,
+        "grammar_topic": "Phrasal verbs",
+        "question": "Turn down is ...",
+        "options": ["to reduce the volume or intensity of something",
+                    "to stop trying to do something or to quit",
+                    "to reject or refuse something, such as an offer or invitation",
+                    "to meet someone unexpectedly or by chance"],
+        "correct_option_id": 2,
+        "explanation": "Example: I had to turn down the job offer because it wasn't the right fit for me."
+    },
+]
+
+VERIFICATION_FORMAT = [{"question_id": "1 or 2 or 3 or 4 (id of a given question)",
+                        "correct_options": ["a list of correct options"]}]
+
+VERIFICATION_EXAMPLE = [{"question_id": 1, "correct_options": ["on the"]},
+                        {"question_id": 2, "correct_options": ["Bob has gone"]},
+                        {"question_id": 3, "correct_options": ["There were too many people"]},
+                        {"question_id": 4, "correct_options":
+                            ["to reduce the volume or intensity of something",
+                             "to reject or refuse something, such as an offer or invitation"]}]
+
+
 class News:
-    def __init__(self):
-        self.date = datetime.datetime.today().date()
+    def __init__(self, date: datetime.date = None):
+        self.date = date or datetime.datetime.today().date()
         self.news_format = [{"id": 1, "category": "sport", "region": "world", "text": "something ..."}, ]
         self.news_examples = [
             {
@@ -122,13 +173,15 @@ class News:
 
 
 class Tasks:
-    def __init__(self, news: list, language: str, word: str = None):
+    def __init__(self, news: list, language: str, word=None, n_words: int = 1):
+        """`word` is the daily word or a list of them; the first `n_words` questions are about
+        word definitions and the rest are grammar questions built around the news."""
         super().__init__()
         self.language = language
-        if word is None:
-            self.word_phrase = 'definition of a word (phrasal verbs or other intermediate level words).'
-        else:
-            self.word_phrase = f'a {word} definition. The definition should be succinct: from 2 to 10 words.'   
+        words = list(word) if isinstance(word, (list, tuple)) else [word]
+        self.n_words = max(1, min(n_words, n_questions))
+        words = (words + [None] * self.n_words)[:self.n_words]
+        self.word_phrase = self._word_phrase(words[0])
         self.question_format = [
             {
                 "question_id": "<ID of the question (1, 2, 3, 4, ...)>",
@@ -139,62 +192,45 @@ class Tasks:
                 "explanation": " a short explanation of the correct answer "
             },
         ]
-        self.question_example = [
-            {
-                "question_id": 1,
-                "grammar_topic": "Prepositions",
-                "question": "Alice travelled ___ 9:20 train, which arrived at 9:55.",
-                "options": ["in the", "by a", "by the", "on the"],
-                "correct_option_id": 3,
-                "explanation": "The preposition on is typically used to indicate traveling by a specific mode of transport like a train, bus, or plane, especially when referring to a specific scheduled service."
-            },
-            {
-                "question_id": 2,
-                "grammar_topic": "Questions and auxiliary verbs",
-                "question": "Do you know where ___ ?",
-                "options": ["Bob have gone", "Bob has gone", "have Bob gone", "has gone Bob"],
-                "correct_option_id": 1,
-                "explanation": "Bob has gone: This is correct because has is the correct auxiliary verb for third-person singular subjects like Bob"
-            },
-            {
-                "question_id": 3,
-                "grammar_topic": "Organising information",
-                "question": " ___ people trying to get into the party.",
-                "options": ["There were too much", "There was too many", "It was too many", "There were too many"],
-                "correct_option_id": 3,
-                "explanation": "There were too many: This is correct because were matches the plural noun people, and many is the appropriate quantifier for countable nouns"
-            },
-            {
-                "question_id": 4,
-                "grammar_topic": "Phrasal verbs",
-                "question": "Turn down is ...",
-                "options": ["to reduce the volume or intensity of something",
-                            "to stop trying to do something or to quit",
-                            "to reject or refuse something, such as an offer or invitation",
-                            "to meet someone unexpectedly or by chance"],
-                "correct_option_id": 2,
-                "explanation": "Example: I had to turn down the job offer because it wasn't the right fit for me."
-            },
-        ]
-        self.verification_format = [{"question_id": "1 or 2 or 3 or 4 (id of a given question)",
-                                     "correct_options": ["a list of correct options"]}]
-        self.verification_example = [{"question_id": 1, "correct_options": ["on the"]},
-                                     {"question_id": 2, "correct_options": ["Bob has gone"]},
-                                     {"question_id": 3, "correct_options": ["There were too many people"]},
-                                     {"question_id": 4, "correct_options":
-                                         ["to reduce the volume or intensity of something",
-                                          "to reject or refuse something, such as an offer or invitation"]}]
+        self.question_example = QUESTION_EXAMPLE
+        self.verification_format = VERIFICATION_FORMAT
+        self.verification_example = VERIFICATION_EXAMPLE
         self.grammar_topics = random.sample(TOPICS[self.language], k=n_questions)
         self.correct_answers = random.sample([0, 1, 2, 3, 0, 1, 2, 3], k=4)
         self.question_grammar_news_mapping = []
         for i in range(n_questions):
             d = {"question_id": i+1, "grammar_topic": self.grammar_topics[i], "news": news[i]['text'],
                  "correct_answer_id": self.correct_answers[i]}
+            if i < self.n_words:
+                d.update({"kind": "word", "word": words[i]})
+            else:
+                d.update({"kind": "grammar"})
             self.question_grammar_news_mapping.append(d)
 
+    @staticmethod
+    def _word_phrase(word: str = None) -> str:
+        if word is None:
+            return 'definition of a word (phrasal verbs or other intermediate level words).'
+        return f'a {word} definition. The definition should be succinct: from 2 to 10 words.'
+
     def get_correct_answers(self) -> list:
         return self.question_grammar_news_mapping
 
+    def _question_instruction(self, d: dict) -> str:
+        if d['kind'] == 'word':
+            return f"""Question {d['question_id']} should be about {self._word_phrase(d['word'])} 
+        Please check whether the word or phrase exists and is spelled correctly, and make corrections if needed.
+        Then please suggest one correct definition and {n_questions - 1} incorrect definitions then please put 
+        the correct option to {d['correct_answer_id']} element of the list with options.
+        The question together with its topic must not exceed {TelegramLimit.POLL_QUESTION_MAX_LEN} 
+        characters.
+        Example: {json.dumps(self.question_example[-1])}"""
+        return f"""Question {d['question_id']} should be a {d['grammar_topic']} grammar question 
+        and related to {d['news']} news. And please put the correct option to
+        {d['correct_answer_id']} element of the list with options. Add an 
+        explanation of the correct option. The question together with its topic must not exceed 
+        {TelegramLimit.POLL_QUESTION_MAX_LEN} characters."""
+
     def get_prompt(self) -> list:
         system_prompt = f"""
         You are a language learning quiz generator in {self.language}. 
@@ -202,6 +238,8 @@ class Tasks:
         focused on {self.language} grammar and vocabulary. 
         """    
 
+        instructions = "\n        \n        ".join(
+            self._question_instruction(d) for d in self.question_grammar_news_mapping)
         prompt = f"""
         Please generate a list of {n_questions} questions with multiple-choice options and indicate 
         the correct option for each question. 
@@ -215,28 +253,7 @@ class Tasks:
         {json.dumps(self.question_format)}
         Here is an example to illustrate the format: {json.dumps(self.question_example)}
 
-        The first question should be about {self.word_phrase}. Please check whether the word or phrase exists 
-        and is spelled correctly, and make corrections if needed.
-        Then please suggest one correct definition and {n_questions - 1} incorrect definitions then please put 
-        the correct option to {self.question_grammar_news_mapping[0]['correct_answer_id']} element of the 
-        list with options.
-        The question length must not exceed 250 characters.
-        Example: {json.dumps(self.question_example[-1])}
-        
-        The second question should be a {self.question_grammar_news_mapping[1]['grammar_topic']} grammar question 
-        and related to {self.question_grammar_news_mapping[1]['news']} news. And please put the correct option to
-        {self.question_grammar_news_mapping[1]['correct_answer_id']} element of the list with options. Add an 
-        explanation of the correct option. The question length must not exceed 250 characters.
-        
-        The third question should be a {self.question_grammar_news_mapping[2]['grammar_topic']} grammar question 
-        and related to {self.question_grammar_news_mapping[2]['news']} news. And please put the correct option to
-        {self.question_grammar_news_mapping[2]['correct_answer_id']} element of the list with options. Add an 
-        explanation of the correct option. The question length must not exceed 250 characters.
-
-        The fourth question should be a {self.question_grammar_news_mapping[3]['grammar_topic']} grammar question 
-        and related to {self.question_grammar_news_mapping[3]['news']} news. And please put the correct option to
-        {self.question_grammar_news_mapping[3]['correct_answer_id']} element of the list with options. Add an 
-        explanation of the correct option. The question length must not exceed 250 characters.
+        {instructions}
         
         Constraints: {JSON_CONSTRAINTS}
         Please generate similar questions in this format, ensuring the options are varied and the 
@@ -250,40 +267,155 @@ class Tasks:
         ]
         return messages
 
+    def get_question_prompts(self) -> list:
+        """One prompt per `question_grammar_news_mapping` entry, for concurrent generation.
+
+        Everything before the trailing question instruction is identical across the prompts of a
+        language, so providers with prefix caching reuse it after the first call.
+        """
+        system_prompt = f"""
+        You are a language learning quiz generator in {self.language}. 
+        Your task is to create multiple-choice questions 
+        focused on {self.language} grammar and vocabulary. 
+        """
+
+        static_prompt = f"""
+        Please generate one question with multiple-choice options and indicate the correct option. 
+        The question should be structured as a dictionary with the following 
+        keys: `question_id`, `grammar_topic`, `question`, `options`, `correct_option_id` and `explanation`. 
+        The `options` key should contain 
+        a list of possible answers, and `correct_option_id` should be the index (integer) of the 
+        correct answer in the `options` list (0-indexed). The correct answer should be only one.
+        
+        The output should be a list with exactly one item in the following format:
+        {json.dumps(self.question_format)}
+        Here is an example to illustrate the format: {json.dumps(self.question_example)}
+        
+        Constraints: {JSON_CONSTRAINTS}
+        The question and answers should be in {self.language}.
+        """
+
+        return [
+            [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": f"{static_prompt}\n        {self._question_instruction(d)}\n"}
+            ]
+            for d in self.question_grammar_news_mapping
+        ]
+
     def verify(self, questions: list) -> list:
         system_prompt = f"""
         You are a professional linguist and an {self.language} teacher at university. 
         """
 
         prompt = f"""
-            You will receive {n_questions} language tasks related to grammar and vocabulary, 
+            You will receive {len(questions)} language tasks related to grammar and vocabulary, 
             with 4 possible answers for each task. The possible answers are in the list.
             Your task is to define which options are correct.
             There might be 0, 1, 2, 3 or even 4 correct/possible answers. 
             You will receive structured enumerated tasks and you need to return a result in JSON format.
             The input and output have the following structure:
             EXAMPLE OF INPUT:
-            Task 1: {self.question_example[0]['question']} 
-            What answer/answers is/are correct? {json.dumps(self.question_example[0]['options'])}
-            Task 2: {self.question_example[1]['question']}
-            What answer/answers is/are correct? {json.dumps(self.question_example[1]['options'])}
-            Task 3: {self.question_example[2]['question']}
-            What answer/answers is/are correct? {json.dumps(self.question_example[2]['options'])}
-            Task 4: {self.question_example[3]['question']}
-            What answer/answers is/are correct? {json.dumps(self.question_example[3]['options'])}
+            {format_verification_tasks(self.question_example)}
             OUTPUT FORMAT:
             {json.dumps(self.verification_format)}
             EXAMPLE OF OUTPUT:
             {json.dumps(self.verification_example)}.
             So following the instructions above please provide answers to the following tasks:
-            Task 1: {questions[0]['question']} 
-            What answer/answers is/are correct? {json.dumps(questions[0]['options'])}
-            Task 2: {questions[1]['question']}
-            What answer/answers is/are correct? {json.dumps(questions[1]['options'])}
-            Task 3: {questions[2]['question']}
-            What answer/answers is/are correct? {json.dumps(questions[2]['options'])}
-            Task 4: {questions[3]['question']}
-            What answer/answers is/are correct? {json.dumps(questions[3]['options'])}
+            {format_verification_tasks(questions)}
+            
+            CONSTRAINTS: {JSON_CONSTRAINTS}
+        """
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": prompt}
+        ]
+        return messages
+
+    def regenerate(self, invalid: list) -> list:
+        """Asks to rewrite questions rejected by the local validator, quoting the reasons."""
+        system_prompt = f"""
+        You are a language learning quiz generator in {self.language}. 
+        Your task is to fix multiple-choice questions focused on {self.language} grammar and vocabulary. 
+        """
+
+        rejected = "\n".join(
+            f"Question: {json.dumps(item['question'], ensure_ascii=False)}\nProblems: {'; '.join(item['errors'])}"
+            for item in invalid
+        )
+        prompt = f"""
+        The following questions cannot be published as Telegram quiz polls:
+        {rejected}
+        
+        Please rewrite each of them so that all the problems are fixed. Keep the `question_id` and the 
+        `grammar_topic` of every question. Telegram limits: the question text together with its topic must 
+        not exceed {TelegramLimit.POLL_QUESTION_MAX_LEN} characters, every option must be unique and not exceed 
+        {TelegramLimit.POLL_OPTION_MAX_LEN} characters, there must be {TelegramLimit.POLL_MIN_OPTIONS} to 
+        {TelegramLimit.POLL_MAX_OPTIONS} options (keep the number of options of the original question), the 
+        explanation must not exceed {TelegramLimit.POLL_EXPLANATION_MAX_LEN} characters and `correct_option_id` 
+        must be the index (integer, 0-indexed) of the only correct option.
+        
+        The output should be a list with the following format:
+        {json.dumps(self.question_format)}
+        
+        Constraints: {JSON_CONSTRAINTS}
+        The questions and answers should be in {self.language}.
+        """
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": prompt}
+        ]
+        return messages
+
+
+def format_verification_tasks(questions: list) -> str:
+    """Enumerates tasks by their `question_id` so that answers can be matched back by id."""
+    return "\n            ".join(
+        f"Task {q['question_id']}: {q['question']}\n"
+        f"            What answer/answers is/are correct? {json.dumps(q['options'])}"
+        for q in questions
+    )
+
+
+class BatchVerification:
+    """Verification prompt covering the questions of every language in a single request."""
+
+    def __init__(self, questions: dict):
+        self.questions = {language: lst for language, lst in questions.items() if lst}
+        self.languages = list(self.questions)
+        self.verification_format = {"<language>": VERIFICATION_FORMAT}
+        self.verification_example = {"english": VERIFICATION_EXAMPLE}
+
+    def get_prompt(self) -> list:
+        system_prompt = f"""
+        You are a professional linguist and a university teacher of {', '.join(self.languages)}. 
+        """
+
+        tasks = "\n".join(
+            f"""
+            Tasks in {language}:
+            {format_verification_tasks(questions)}"""
+            for language, questions in self.questions.items()
+        )
+        prompt = f"""
+            You will receive language tasks related to grammar and vocabulary in several languages, 
+            with 4 possible answers for each task. The possible answers are in the list.
+            Your task is to define which options are correct.
+            There might be 0, 1, 2, 3 or even 4 correct/possible answers. 
+            You will receive structured enumerated tasks grouped by language and you need to return 
+            a result in JSON format: an object keyed by language, each value being the list of answers 
+            for the tasks of that language.
+            The input and output have the following structure:
+            EXAMPLE OF INPUT:
+            Tasks in english:
+            {format_verification_tasks(QUESTION_EXAMPLE)}
+            OUTPUT FORMAT:
+            {json.dumps(self.verification_format)}
+            EXAMPLE OF OUTPUT:
+            {json.dumps(self.verification_example)}.
+            So following the instructions above please provide answers to the following tasks.
+            The output must contain exactly these keys: {json.dumps(self.languages)}.
+            {tasks}
             
             CONSTRAINTS: {JSON_CONSTRAINTS}
         """
@@ -298,14 +430,22 @@ class QuizDefinitions:
     def __init__(self, language: str, word_list: list):
         self.language = language
         self.word_list = word_list
-        self.definition_format = {"word1": "definition1", "word2": "definition2"} # Example format
+        self.definition_format = {"word1": {"meaning": "definition1", "word_type": "noun",
+                                            "example": "An example sentence with word1."},
+                                  "word2": {"meaning": "definition2", "word_type": "phrasal verb",
+                                            "example": "An example sentence with word2."}} # Example format
 
     def get_prompt(self) -> str:
         """Generates the prompt string to request definitions for the word list."""
         prompt = f"""Provide short, distinct definitions for the following {self.language} words. 
-        Return the response ONLY as a valid JSON object where keys are the words and values are the definitions. 
+        For every word also give its type (noun, verb, adjective, adverb, phrasal verb, idiom, ...) 
+        and one short example sentence in {self.language} that uses it. 
+        Return the response ONLY as a valid JSON object where keys are the words exactly as given and values are 
+        objects with the keys `meaning`, `word_type` and `example`. 
         Example format: {json.dumps(self.definition_format)}
-        Words: {', '.join(self.word_list)}
+        Words: {json.dumps(self.word_list, ensure_ascii=False)}
+        
+        CONSTRAINTS: {JSON_CONSTRAINTS}
         """
         return prompt
 
@@ -0,0 +1,229 @@
+import asyncio
+import collections
+import email.utils
+import logging
+import random
+import time
+from typing import Awaitable, Callable, Optional
+
+from config import Parameter
+
+# Rough prompt size estimate for the tokens-per-minute budget
+CHARS_PER_TOKEN = 4
+# Throttling answers: the limit shrinks and the call is retried
+THROTTLE_STATUSES = {429, 503}
+# Transient failures the SDKs used to retry on their own: retried, the limit stays. Timeouts
+# are not retried, each one has already taken Parameter.LLM_TIMEOUT
+TRANSIENT_STATUSES = {408, 409, 500, 502, 504}
+TRANSIENT_ERRORS = ('APIConnectionError', 'InternalServerError')
+# Backoff jitter; not the global generator, see cassette.Cassette
+_jitter = random.Random()
+
+
+def prompt_tokens(messages) -> int:
+    """Approximate token count of a prompt: a string or a list of chat messages."""
+    if isinstance(messages, str):
+        chars = len(messages)
+    elif isinstance(messages, (list, tuple)):
+        chars = sum(len(str(m.get('content', ''))) if isinstance(m, dict) else len(str(m)) for m in messages)
+    else:
+        chars = len(str(messages))
+    return chars // CHARS_PER_TOKEN + 1
+
+
+def _status(error: Exception) -> Optional[int]:
+    # openai: status_code; google.api_core: code (an HTTPStatus)
+    status = getattr(error, 'status_code', None) or getattr(error, 'code', None)
+    try:
+        return int(status) if status is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """Seconds the provider asked us to wait (Retry-After / retry-after-ms), if it said."""
+    headers = getattr(getattr(error, 'response', None), 'headers', None)
+    if not headers:
+        return None
+    try:
+        if headers.get('retry-after-ms'):
+            return float(headers['retry-after-ms']) / 1000
+        value = headers.get('retry-after')
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            when = email.utils.parsedate_to_datetime(value)
+            return max(0.0, when.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def is_throttled(error: Exception) -> bool:
+    return _status(error) in THROTTLE_STATUSES or type(error).__name__ in ('RateLimitError', 'ResourceExhausted')
+
+
+def is_transient(error: Exception) -> bool:
+    return _status(error) in TRANSIENT_STATUSES or type(error).__name__ in TRANSIENT_ERRORS
+
+
+class TokenBucket:
+    """Tokens-per-minute budget: refills continuously, holds at most one minute's worth."""
+
+    def __init__(self, tokens_per_minute: int):
+        self.capacity = float(tokens_per_minute)
+        self.rate = tokens_per_minute / 60.0
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def delay(self, tokens: float) -> float:
+        """Seconds until `tokens` are available (0 when they are)."""
+        self._refill()
+        return max(0.0, (min(tokens, self.capacity) - self.tokens) / self.rate)
+
+    def take(self, tokens: float):
+        self._refill()
+        self.tokens -= min(tokens, self.capacity)
+
+    def give_back(self, tokens: float):
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + tokens)
+
+
+class RateGovernor:
+    """AIMD concurrency limit plus an optional tokens-per-minute budget for one provider.
+
+    Every successful call raises the in-flight limit by `increase / limit` (about `increase`
+    per round of calls); a throttled one (429/503) multiplies it by `decrease`, once per
+    round, since the calls already in flight were admitted under the old limit. A
+    Retry-After pauses every call to the provider until it has passed.
+    """
+
+    def __init__(self, name: str, initial: int = 4, min_limit: int = 1, max_limit: int = 32,
+                 tokens_per_minute: Optional[int] = None, increase: float = None, decrease: float = None):
+        self.name = name
+        self.min_limit, self.max_limit = min_limit, max_limit
+        self.limit = float(initial)
+        self.increase = increase if increase is not None else Parameter.RATE_INCREASE
+        self.decrease = decrease if decrease is not None else Parameter.RATE_DECREASE
+        self.bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.in_flight = 0
+        self.epoch = 0
+        self.blocked_until = 0.0
+        self.stats = collections.Counter()
+        self._waiters = collections.deque()
+
+    def _wake(self):
+        free = int(self.limit) - self.in_flight
+        while free > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+    async def _wait_for_slot(self):
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            elif waiter.done() and not waiter.cancelled():
+                # Woken but not taking the slot: pass it on
+                self._wake()
+            raise
+
+    async def acquire(self, tokens: float = 0) -> int:
+        """Waits for a free slot, the end of any Retry-After pause and `tokens` of budget.
+
+        Returns the epoch of the limit the call was admitted under, for `release`.
+        """
+        while True:
+            pause = self.blocked_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+                continue
+            if self.in_flight >= int(self.limit):
+                await self._wait_for_slot()
+                continue
+            delay = self.bucket.delay(tokens) if self.bucket and tokens else 0
+            if delay > 0:
+                self.stats['token_waits'] += 1
+                await asyncio.sleep(delay)
+                continue
+            if self.bucket and tokens:
+                self.bucket.take(tokens)
+            self.in_flight += 1
+            self.stats['peak_in_flight'] = max(self.stats['peak_in_flight'], self.in_flight)
+            return self.epoch
+
+    def release(self, epoch: int, throttled: bool = False, succeeded: bool = False,
+                pause: Optional[float] = None, unused_tokens: float = 0):
+        self.in_flight -= 1
+        if self.bucket and unused_tokens > 0:
+            self.bucket.give_back(unused_tokens)
+        if throttled:
+            self.stats['throttled'] += 1
+            if pause:
+                self.blocked_until = max(self.blocked_until, time.monotonic() + pause)
+            if epoch == self.epoch:
+                old = self.limit
+                self.limit = max(float(self.min_limit), self.limit * self.decrease)
+                self.epoch += 1
+                logging.warning("Rate governor %s: throttled, limit %.1f -> %.1f (retry after %s)",
+                                self.name, old, self.limit, pause)
+        elif succeeded:
+            self.stats['succeeded'] += 1
+            self.limit = min(float(self.max_limit), self.limit + self.increase / self.limit)
+        self._wake()
+
+    async def call(self, request: Callable[[], Awaitable], tokens: float = 0,
+                   used_tokens: Callable[[object], Optional[float]] = None):
+        """Runs `request()` under the governor, retrying throttled and transient failures.
+
+        `tokens` is the call's estimated budget (prompt plus output allowance); `used_tokens`
+        maps the result to what the call really used, so the difference goes back into the
+        budget. A failed attempt gives its whole reservation back: the provider produced nothing,
+        and the retry reserves again. Other errors, and the last failure once
+        Parameter.RATE_RETRIES are spent, are raised to the caller.
+        """
+        for attempt in range(Parameter.RATE_RETRIES + 1):
+            epoch = await self.acquire(tokens)
+            try:
+                result = await request()
+            except Exception as e:
+                throttled, transient = is_throttled(e), is_transient(e)
+                pause = retry_after(e) if throttled else None
+                self.release(epoch, throttled=throttled, pause=pause, unused_tokens=tokens)
+                if not (throttled or transient) or attempt == Parameter.RATE_RETRIES:
+                    raise
+                self.stats['retries'] += 1
+                delay = pause if pause is not None else \
+                    min(Parameter.RATE_BACKOFF_MAX, Parameter.RATE_BACKOFF * 2 ** attempt) * _jitter.uniform(0.5, 1)
+                logging.info("Rate governor %s: %s, retry %s in %.1fs", self.name, type(e).__name__,
+                             attempt + 1, delay)
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                self.release(epoch, unused_tokens=tokens)
+                raise
+            used = used_tokens(result) if used_tokens and tokens else None
+            self.release(epoch, succeeded=True, unused_tokens=tokens - used if used is not None else 0)
+            return result
+
+
+_governors = {}
+
+
+def get_governor(provider: str) -> RateGovernor:
+    """Process-wide RateGovernor per provider, configured from `Parameter.RATE_LIMITS`."""
+    if provider not in _governors:
+        _governors[provider] = RateGovernor(provider, **Parameter.RATE_LIMITS.get(provider, {}))
+    return _governors[provider]
@@ -0,0 +1,160 @@
+import asyncio
+import datetime
+import json
+import logging
+import signal
+import time
+
+from app import LANGUAGES, run_pipeline
+from config import Config, Model, Parameter
+from dedup import DuplicateIndex
+from gemini_api import GeminiAPI
+from http_client import aclose_async_http_client
+from log_config import setup_logging
+from openai_api import OpenaiAPI
+from poll_stats import PollStatsCollector, TelegramUpdateSource
+from tg_api import TelegramBot
+
+
+class Scheduler:
+    """Resident process that runs the pipeline at `Parameter.RUN_TIMES`.
+
+    Provider, Telegram and DB clients (and the dedup archives) are created once and reused by
+    every run, so a run starts without interpreter start-up, SDK imports or fresh TLS handshakes.
+    Languages due at the same minute share one run; runs of the same date, here or in another
+    process, share one news generation through the per-date news store (see app.get_news).
+    """
+
+    def __init__(self, run_times: dict = None):
+        self.run_times = {language: at for language, at in (run_times or Parameter.RUN_TIMES).items()
+                          if language in LANGUAGES}
+        self.openai = OpenaiAPI(api_key=Config.OPENAI_API_KEY, model=Model.model_1)
+        self.gemini = GeminiAPI(api_key=Config.GEMINI_API_KEY, model=Model.model_2)
+        self.bot = TelegramBot(token=Config.TG_TOKEN)
+        self.news_index = DuplicateIndex('news')
+        self.question_index = DuplicateIndex('questions')
+        self.started_at = time.time()
+        self.metrics = {'runs_started': 0, 'runs_succeeded': 0, 'runs_failed': 0, 'verifiers_skipped': 0,
+                        'last_run': None, 'next_run': None}
+        self._run_lock = asyncio.Lock()
+        self._stop = asyncio.Event()
+        self._tasks = set()
+
+    def next_slot(self, now: datetime.datetime) -> tuple:
+        """Returns `(when, languages)` of the next scheduled run after `now`."""
+        slots = {}
+        for language, at in self.run_times.items():
+            hour, minute = (int(x) for x in at.split(':'))
+            when = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+            if when <= now:
+                when += datetime.timedelta(days=1)
+            slots.setdefault(when, []).append(language)
+        when = min(slots)
+        return when, slots[when]
+
+    async def run(self, languages: list):
+        # Runs never overlap: a slot that comes due during a run waits for it to finish
+        async with self._run_lock:
+            quiz_mix = Parameter.SCHEDULE[datetime.date.today().strftime('%A')]
+            started = time.time()
+            self.metrics['runs_started'] += 1
+            logging.info("Scheduled run started: languages=%s quiz_mix=%s", languages, quiz_mix)
+            status = 'ok'
+            verification = None
+            try:
+                result = await run_pipeline(self.openai, self.gemini, self.bot, languages=languages, quiz_mix=quiz_mix,
+                                            news_index=self.news_index, question_index=self.question_index)
+                verification = result.get('stats')
+                self.metrics['runs_succeeded'] += 1
+                self.metrics['verifiers_skipped'] += verification['verifiers_skipped'] if verification else 0
+            except Exception:
+                status = 'failed'
+                self.metrics['runs_failed'] += 1
+                logging.exception("Scheduled run failed: languages=%s", languages)
+            duration = time.time() - started
+            self.metrics['last_run'] = {'languages': languages, 'quiz_mix': quiz_mix, 'status': status,
+                                        'started': datetime.datetime.fromtimestamp(started).isoformat(),
+                                        'duration_s': round(duration, 2), 'verification': verification}
+            logging.info("Scheduled run finished: languages=%s status=%s duration=%.1fs", languages, status, duration)
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _start_run(self, languages: list):
+        self._spawn(self.run(languages))
+
+    async def _handle_http(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = (await reader.readline()).decode('latin-1').split()
+            while (await reader.readline()).strip():
+                pass  # headers are not needed
+            path = request_line[1] if len(request_line) > 1 else '/'
+            if path == '/health':
+                code, body = 200, {'status': 'ok', 'running': self._run_lock.locked(),
+                                   'uptime_s': round(time.time() - self.started_at)}
+            elif path == '/metrics':
+                code, body = 200, {**self.metrics, 'uptime_s': round(time.time() - self.started_at)}
+            else:
+                code, body = 404, {'error': 'not found'}
+            payload = json.dumps(body).encode()
+            writer.write(f"HTTP/1.1 {code} {'OK' if code == 200 else 'Not Found'}\r\n"
+                         f"Content-Type: application/json\r\nContent-Length: {len(payload)}\r\n"
+                         f"Connection: close\r\n\r\n".encode() + payload)
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def stop(self):
+        self._stop.set()
+
+    async def serve_forever(self):
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(sig, self.stop)
+            except NotImplementedError:  # e.g. Windows
+                pass
+        await self.bot.initialize()
+        server = await asyncio.start_server(self._handle_http, Parameter.HEALTH_HOST, Parameter.HEALTH_PORT)
+        logging.info("Scheduler started: run_times=%s health=%s:%s",
+                     self.run_times, Parameter.HEALTH_HOST, Parameter.HEALTH_PORT)
+        # Finish deliveries an earlier process was interrupted in
+        self._spawn(self.bot.drain_outbox())
+        if Parameter.POLL_STATS:
+            self._spawn(PollStatsCollector(TelegramUpdateSource(self.bot.bot)).run(self._stop))
+        if Parameter.RUN_ON_START:
+            self._start_run(list(self.run_times))
+        last_slot = None
+        try:
+            while not self._stop.is_set():
+                now = datetime.datetime.now()
+                # Timers may fire slightly early; never pick the slot that has just been started again
+                when, languages = self.next_slot(max(now, last_slot) if last_slot else now)
+                self.metrics['next_run'] = {'at': when.isoformat(), 'languages': languages}
+                try:
+                    delay = max(0.0, (when - datetime.datetime.now()).total_seconds())
+                    await asyncio.wait_for(self._stop.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    self._start_run(languages)
+                    last_slot = when
+        finally:
+            logging.info("Scheduler stopping")
+            server.close()
+            await server.wait_closed()
+            if self._tasks:
+                await asyncio.gather(*self._tasks, return_exceptions=True)
+            await self.bot.shutdown()
+            await aclose_async_http_client()
+
+
+async def main():
+    await Scheduler().serve_forever()
+
+
+if __name__ == "__main__":
+    setup_logging()
+    asyncio.run(main())
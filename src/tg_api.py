@@ -1,98 +1,247 @@
-import telegram
+import asyncio
+import datetime
+import hashlib
+import json
 import time
+import telegram
 import random
 import logging
 from io import BytesIO
 from PIL import Image
 
+from config import Parameter
+from image_encoding import aencode_image
+from profiling import timed
+
+# Send pacing; not the global generator, see cassette.Cassette
+_pacing = random.Random()
+
+
+def poll_question_text(question: dict) -> str:
+    return "Topic: " + question['grammar_topic'] + ".\n" + "\n" + question['question']
+
+
+def poll_payload(question: dict) -> dict:
+    """Keyword arguments of `Bot.send_poll` for a quiz question."""
+    return {'question': poll_question_text(question), 'options': question['options'], 'type': 'quiz',
+            'correct_option_id': question['correct_option_id'], 'explanation': question['explanation'],
+            'is_anonymous': True}
+
+
+def outbox_item(chat_id, kind: str, payload: dict, plan_date: datetime.date, slot: int, photo: bytes = None,
+                meta: dict = None) -> dict:
+    """An outbox row for `enqueue_outbox`, keyed by run date, chat and slot rather than content.
+
+    A rerun of the same date regenerates different quizzes and pictures; keyed by slot they
+    still map onto the sends already planned. `meta` is stored alongside but not sent.
+    """
+    key = hashlib.sha256(f"{plan_date.isoformat()}\n{chat_id}\n{slot}".encode('utf-8')).hexdigest()
+    return {'chat_id': str(chat_id), 'kind': kind, 'payload': json.dumps(payload, ensure_ascii=False, sort_keys=True),
+            'photo': photo, 'send_key': key, 'plan_date': plan_date, 'slot': slot,
+            'meta': json.dumps(meta, ensure_ascii=False) if meta else None}
+
+
+def _retry_delay(error: Exception, attempts: int) -> float:
+    if isinstance(error, telegram.error.RetryAfter):
+        retry_after = error.retry_after
+        return retry_after.total_seconds() if hasattr(retry_after, 'total_seconds') else float(retry_after)
+    return min(Parameter.OUTBOX_BACKOFF * 2 ** (attempts - 1), Parameter.OUTBOX_BACKOFF_MAX)
+
+
 class TelegramBot:
     def __init__(self, token):
         self.bot = telegram.Bot(token=token)
+        # One drain at a time, or two drains would both send the same pending rows
+        self._drain_lock = asyncio.Lock()
+
+    async def initialize(self):
+        # Opens the bot's HTTP connection pool up front so that the first send is warm
+        await self.bot.initialize()
 
+    async def shutdown(self):
+        await self.bot.shutdown()
+
+    @timed
     async def send_message(self, chat_id: str, message: str):
         try:
             await self.bot.send_message(chat_id=chat_id, text=message)
-            logging.info(f"Message {message} sent successfully")
+            logging.info("Message sent successfully (%s chars)", len(message))
+            logging.debug("Message sent: %s", message)
         except Exception as e:
-            logging.error(f"Error sending message: {e}. Tried to send: {message}")
+            logging.error("Error sending message: %s", e)
+            logging.debug("Tried to send: %s", message)
 
+    @timed
     async def send_quizzes(self, chats: dict, questions: dict):
         for language, questions_lst in questions.items():
             for question in questions_lst:
                 try:
                     await self.bot.send_poll(
                         chat_id=chats[language],
-                        question="Topic: " + question['grammar_topic'] + ".\n" + "\n" + question['question'],
+                        question=poll_question_text(question),
                         options=question['options'],
                         type='quiz',
                         correct_option_id=question['correct_option_id'],
                         explanation=question['explanation'],
                         is_anonymous=True
                     )
-                    logging.info(f"Quiz sent successfully: {question}")
+                    logging.info("Quiz sent successfully: question_id=%s", question.get('question_id'))
+                    logging.debug("Quiz sent: %s", question)
                 except Exception as e:
-                    logging.error(f"An error occurred: {e}. Tried to send {question}")
-                sleep_time = random.randint(5, 9)
-                time.sleep(sleep_time)
+                    logging.error("An error occurred: %s. Tried to send question_id=%s", e, question.get('question_id'))
+                    logging.debug("Tried to send: %s", question)
+                sleep_time = _pacing.randint(5, 9)
+                await asyncio.sleep(sleep_time)
 
+    @timed
     async def send_bad_quizzes(self, chats: dict, questions: dict):
         for language, questions_lst in questions.items():
             for question in questions_lst:
                 try:
                     await self.bot.send_poll(
                         chat_id=chats['log'],
-                        question="Topic: " + question['grammar_topic'] + ".\n" + "\n" + question['question'],
+                        question=poll_question_text(question),
                         options=question['options'],
                         type='quiz',
                         correct_option_id=question['correct_option_id'],
                         explanation=question['explanation'],
                         is_anonymous=True
                     )
-                    logging.info(f"Quiz sent successfully: {question}")
+                    logging.info("Quiz sent successfully: question_id=%s", question.get('question_id'))
+                    logging.debug("Quiz sent: %s", question)
                 except Exception as e:
-                    logging.error(f"An error occurred: {e}. Tried to send {question}")
-                sleep_time = random.randint(5, 9)
-                time.sleep(sleep_time)
+                    logging.error("An error occurred: %s. Tried to send question_id=%s", e, question.get('question_id'))
+                    logging.debug("Tried to send: %s", question)
+                sleep_time = _pacing.randint(5, 9)
+                await asyncio.sleep(sleep_time)
 
+    @timed
     async def send_image(self, chats: dict, image: Image.Image):
         try:
-            # Convert the PIL image to a byte array
-            byte_array = BytesIO()
-            image.save(byte_array, format='PNG')
-            byte_array.seek(0)
+            byte_array = BytesIO(await aencode_image(image))
 
             # Send the image to the specified chat
             await self.bot.send_photo(chat_id=chats['log'], photo=byte_array)
             logging.info("Image successfully posted to Telegram channel.")
         except Exception as e:
-            logging.error(f"Error occurred while posting to Telegram: {e}")
+            logging.error("Error occurred while posting to Telegram: %s", e)
 
-    async def send_image_quizzes(self, chats: dict, questions: dict, images: dict):
-        for language, questions_lst in questions.items():
-            try:
-                # Convert the PIL image to a byte array
-                byte_array = BytesIO()
-                images[language].save(byte_array, format='PNG')
-                byte_array.seek(0)
-
-                # Send the image to the specified chat
-                await self.bot.send_photo(chat_id=chats[language], photo=byte_array)
-                logging.info("Image successfully posted to Telegram channel.")
-            except Exception as e:
-                logging.error(f"Error occurred while posting to Telegram: {e}")
-            for question in questions_lst:
+    async def _deliver(self, message) -> telegram.Message:
+        payload = json.loads(message.payload)
+        if message.kind == 'photo':
+            return await self.bot.send_photo(chat_id=message.chat_id, photo=message.photo, **payload)
+        if message.kind == 'poll':
+            return await self.bot.send_poll(chat_id=message.chat_id, **payload)
+        return await self.bot.send_message(chat_id=message.chat_id, **payload)
+
+    @staticmethod
+    async def _register_poll(message, sent: telegram.Message):
+        # Poll updates only carry the poll id; keep what they will be grouped by
+        poll = getattr(sent, 'poll', None)
+        if poll is None:
+            return
+        from crud import register_poll
+        meta = json.loads(message.meta) if message.meta else {}
+        try:
+            await asyncio.to_thread(register_poll, poll.id, message.chat_id, meta.get('language'),
+                                    meta.get('grammar_topic'), meta.get('question_id'),
+                                    json.loads(message.payload).get('correct_option_id'))
+        except Exception as e:
+            logging.error("Could not register poll %s for statistics: %s", poll.id, e)
+
+    @timed
+    async def drain_outbox(self, timeout: float = None) -> dict:
+        """Sends pending outbox rows in id order, retrying failures with exponential backoff.
+
+        A message waiting for its retry holds back the later messages of its chat, so a picture
+        always precedes its polls. Rows that fail permanently (bad request, forbidden) or
+        `Parameter.OUTBOX_MAX_ATTEMPTS` times are marked failed. Delivery is at least once: a
+        send that timed out after reaching Telegram is sent again.
+        """
+        async with self._drain_lock:
+            return await self._drain_outbox(timeout)
+
+    async def _drain_outbox(self, timeout: float = None) -> dict:
+        # Imported here so that importing tg_api (e.g. via validation) does not open the DB
+        from crud import get_pending_outbox, mark_outbox_sent, mark_outbox_error
+        deadline = time.monotonic() + (timeout if timeout is not None else Parameter.OUTBOX_DRAIN_TIMEOUT)
+        counts = {'sent': 0, 'failed': 0}
+        while True:
+            pending = await asyncio.to_thread(get_pending_outbox)
+            if not pending:
+                break
+            now = datetime.datetime.now()
+            heads = {}
+            for message in pending:
+                heads.setdefault(message.chat_id, message)
+            waits = [(message.next_attempt_at - now).total_seconds() for message in heads.values()
+                     if message.next_attempt_at and message.next_attempt_at > now]
+            if len(waits) == len(heads):
+                # Every chat is waiting for a retry
+                if time.monotonic() + min(waits) > deadline:
+                    break
+                await asyncio.sleep(min(waits))
+                continue
+
+            held = set()
+            for message in pending:
+                if message.chat_id in held:
+                    continue
+                if message.next_attempt_at and message.next_attempt_at > now:
+                    held.add(message.chat_id)
+                    continue
                 try:
-                    await self.bot.send_poll(
-                        chat_id=chats[language],
-                        question="Topic: " + question['grammar_topic'] + ".\n" + "\n" + question['question'],
-                        options=question['options'],
-                        type='quiz',
-                        correct_option_id=question['correct_option_id'],
-                        explanation=question['explanation'],
-                        is_anonymous=True
-                    )
-                    logging.info(f"Quiz sent successfully: {question}")
+                    sent = await self._deliver(message)
                 except Exception as e:
-                    logging.error(f"An error occurred: {e}. Tried to send {question}")
-                sleep_time = random.randint(5, 9)
-                time.sleep(sleep_time)
+                    attempts = message.attempts + 1
+                    permanent = isinstance(e, (telegram.error.BadRequest, telegram.error.Forbidden))
+                    if permanent or attempts >= Parameter.OUTBOX_MAX_ATTEMPTS:
+                        logging.error("Giving up on outbox message %s (%s to %s) after %s attempt(s): %s",
+                                      message.id, message.kind, message.chat_id, attempts, e)
+                        await asyncio.to_thread(mark_outbox_error, message.id, e)
+                        counts['failed'] += 1
+                        continue
+                    delay = _retry_delay(e, attempts)
+                    logging.warning("Outbox message %s (%s to %s) failed, retry %s in %.0fs: %s",
+                                    message.id, message.kind, message.chat_id, attempts, delay, e)
+                    await asyncio.to_thread(mark_outbox_error, message.id, e,
+                                            datetime.datetime.now() + datetime.timedelta(seconds=delay))
+                    held.add(message.chat_id)
+                    continue
+                await asyncio.to_thread(mark_outbox_sent, message.id, sent.message_id)
+                if message.kind == 'poll':
+                    await self._register_poll(message, sent)
+                counts['sent'] += 1
+                logging.info("Outbox message %s sent: %s to %s", message.id, message.kind, message.chat_id)
+                if message.kind == 'poll':
+                    sleep_time = _pacing.randint(5, 9)
+                    await asyncio.sleep(sleep_time)
+
+        counts['pending'] = len(pending)
+        logging.info("Outbox drained: %s", counts)
+        return counts
+
+    @timed
+    async def send_image_quizzes(self, chats: dict, questions: dict, images: dict,
+                                 plan_date: datetime.date = None) -> dict:
+        """Plans the picture and the polls of every language in the outbox, then drains it.
+
+        Each send is keyed by `plan_date` (default today), chat and slot (0 for the picture,
+        then one per poll): slots already in the outbox are not planned again, so resending
+        after a partial failure costs only the missing messages.
+        """
+        from crud import enqueue_outbox
+        plan_date = plan_date or datetime.date.today()
+        items = []
+        for language, questions_lst in questions.items():
+            if images.get(language) is not None:
+                items.append(outbox_item(chats[language], 'photo', {}, plan_date, 0,
+                                         photo=await aencode_image(images[language])))
+            else:
+                logging.warning("No picture for %s, sending its quizzes without one", language)
+            for slot, question in enumerate(questions_lst, start=1):
+                items.append(outbox_item(chats[language], 'poll', poll_payload(question), plan_date, slot,
+                                         meta={'language': language, 'grammar_topic': question.get('grammar_topic'),
+                                               'question_id': question.get('question_id')}))
+        await asyncio.to_thread(enqueue_outbox, items)
+        return await self.drain_outbox()
@@ -0,0 +1,171 @@
+import atexit
+import collections
+import json
+import logging
+import math
+import os
+import threading
+import time
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+from config import Parameter
+
+# Call types tagged at the call sites
+NEWS = 'news'
+QUIZ = 'quiz'  # all questions of a language in one call
+QUIZ_QUESTION = 'quiz_question'  # one question per call
+QUIZ_REGENERATE = 'quiz_regenerate'
+VERIFY = 'verify'
+DEFINITIONS = 'definitions'
+
+REASONING_EFFORTS = ['minimal', 'low', 'medium', 'high']
+
+
+class Usage(NamedTuple):
+    output_tokens: int = 0  # visible output only
+    reasoning_tokens: int = 0
+    truncated: bool = False
+
+
+def budget_key(model: Optional[str], call_type: str) -> str:
+    # Usage differs a lot between models (e.g. a reasoning and a non-reasoning verifier)
+    return f"{model}:{call_type}" if model else call_type
+
+
+class TokenBudget:
+    """Learns per-model, per-call-type output budgets from observed token usage.
+
+    The max-token limit is a high percentile of recent (non-truncated) totals of output plus
+    reasoning tokens, times a headroom factor; until enough samples exist the client's static
+    default is used. Truncations in which reasoning ate the budget lower the reasoning effort
+    a step each, down to the model's `Parameter.MIN_REASONING_EFFORT`; every untruncated call
+    recovers 1/`Parameter.REASONING_RECOVERY_CALLS` of a step and a failed call a whole one. History is persisted to a small JSON file at most every
+    `Parameter.TOKEN_BUDGET_SAVE_SECONDS`, written off the calling thread, and at exit.
+    """
+
+    def __init__(self, path: str = None, window: int = None):
+        self.path = path or Parameter.TOKEN_BUDGET_FILE
+        self.window = window or Parameter.TOKEN_BUDGET_WINDOW
+        self.history = collections.defaultdict(lambda: collections.deque(maxlen=self.window))
+        # Effort steps to go down per budget key; fractional while recovering
+        self.reasoning_truncations = collections.defaultdict(float)
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._saved_at = time.monotonic()
+        if self.path and os.path.exists(self.path):
+            try:
+                with open(self.path, encoding='utf-8') as f:
+                    saved = json.load(f)
+                for key, samples in saved.get('history', {}).items():
+                    self.history[key].extend(tuple(s) for s in samples)
+                self.reasoning_truncations.update(saved.get('reasoning_truncations', {}))
+            except (OSError, ValueError) as e:
+                logging.warning("Token budget history could not be loaded from %s: %s", self.path, e)
+
+    def max_tokens(self, call_type: str, default: int, model: str = None) -> int:
+        samples = self.history.get(budget_key(model, call_type))
+        if not samples or len(samples) < Parameter.TOKEN_BUDGET_MIN_SAMPLES:
+            return default
+        totals = [output + reasoning for output, reasoning in samples]
+        budget = math.ceil(np.percentile(totals, Parameter.TOKEN_BUDGET_PERCENTILE) * Parameter.TOKEN_BUDGET_HEADROOM)
+        return int(min(max(budget, Parameter.TOKEN_BUDGET_MIN), Parameter.TOKEN_BUDGET_MAX))
+
+    @staticmethod
+    def _effort_range(call_type: Optional[str], model: str = None) -> tuple:
+        """Indexes into REASONING_EFFORTS of the configured effort and of the lowest one allowed."""
+        default = REASONING_EFFORTS.index(Parameter.REASONING_EFFORT.get(call_type, Parameter.REASONING_EFFORT['default']))
+        floor = Parameter.MIN_REASONING_EFFORT.get(model, Parameter.MIN_REASONING_EFFORT['default'])
+        return default, min(REASONING_EFFORTS.index(floor), default)
+
+    def reasoning_effort(self, call_type: Optional[str], model: str = None) -> str:
+        """Configured effort, lowered a step per recent truncation in which reasoning ate the budget."""
+        default, floor = self._effort_range(call_type, model)
+        steps = math.ceil(self.reasoning_truncations.get(budget_key(model, call_type), 0))
+        return REASONING_EFFORTS[max(default - steps, floor)]
+
+    def limits(self, call_type: Optional[str], default: int, model: str = None) -> tuple:
+        """`(max_tokens, reasoning effort)` for the next call of `call_type` to `model`."""
+        if call_type is None:
+            return default, self.reasoning_effort(None, model)
+        return self.max_tokens(call_type, default, model), self.reasoning_effort(call_type, model)
+
+    def record(self, call_type: Optional[str], usage: Usage, max_tokens: int, model: str = None):
+        if call_type is None:
+            return
+        key = budget_key(model, call_type)
+        with self._lock:
+            if usage.truncated:
+                # A truncated sample only bounds the need from below, so it is kept out of the percentile
+                if usage.reasoning_tokens >= max_tokens * 0.5:
+                    # Steps below the model's floor would only slow down the recovery
+                    default, floor = self._effort_range(call_type, model)
+                    self.reasoning_truncations[key] = min(
+                        math.floor(self.reasoning_truncations.get(key, 0)) + 1, default - floor)
+            else:
+                self.history[key].append((usage.output_tokens, usage.reasoning_tokens))
+                if self.reasoning_truncations.get(key):
+                    # Rounded so that REASONING_RECOVERY_CALLS steps land on a whole number again
+                    self.reasoning_truncations[key] = max(0.0, round(
+                        self.reasoning_truncations[key] - 1 / Parameter.REASONING_RECOVERY_CALLS, 6))
+            self._changed()
+
+    def record_failure(self, call_type: Optional[str], model: str = None):
+        """A call that raised wins back a whole lowered step: the API may have rejected the lowered effort."""
+        if call_type is None:
+            return
+        key = budget_key(model, call_type)
+        with self._lock:
+            if not self.reasoning_truncations.get(key):
+                return
+            self.reasoning_truncations[key] = float(math.ceil(self.reasoning_truncations[key]) - 1)
+            self._changed()
+
+    def _changed(self):
+        # Under self._lock
+        self._dirty = True
+        if time.monotonic() - self._saved_at >= Parameter.TOKEN_BUDGET_SAVE_SECONDS:
+            data = self._snapshot()
+            threading.Thread(target=self._write, args=(data,), name='token-budget-save', daemon=True).start()
+
+    def escalate(self, call_type: Optional[str], max_tokens: int, model: str = None) -> tuple:
+        """Limits for retrying a truncated call: twice the budget, and the effort as lowered by `record`."""
+        return min(max_tokens * 2, Parameter.TOKEN_BUDGET_MAX), self.reasoning_effort(call_type, model)
+
+    def _snapshot(self) -> str:
+        # Under self._lock: serialised here, written by whoever holds the string
+        self._dirty = False
+        self._saved_at = time.monotonic()
+        return json.dumps({'history': {k: list(v) for k, v in self.history.items()},
+                           'reasoning_truncations': {k: v for k, v in self.reasoning_truncations.items() if v}})
+
+    def _write(self, data: str):
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, mode='w', encoding='utf-8') as f:
+                f.write(data)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logging.warning("Token budget history could not be saved to %s: %s", self.path, e)
+
+    def flush(self):
+        """Writes unsaved history now, on the calling thread."""
+        with self._lock:
+            if not self._dirty:
+                return
+            data = self._snapshot()
+        self._write(data)
+
+
+_budget = None
+
+
+def get_token_budget() -> TokenBudget:
+    global _budget
+    if _budget is None:
+        _budget = TokenBudget()
+        atexit.register(_budget.flush)
+    return _budget
@@ -0,0 +1,87 @@
+import logging
+from typing import List
+
+from pydantic import BaseModel, ValidationError, field_validator, model_validator
+
+from config import TelegramLimit
+from tg_api import poll_question_text
+from dedup import question_text
+
+
+class QuizQuestion(BaseModel):
+    question_id: int
+    grammar_topic: str
+    question: str
+    options: List[str]
+    correct_option_id: int
+    explanation: str = ""
+
+    @field_validator('options')
+    @classmethod
+    def check_options(cls, options: List[str]) -> List[str]:
+        if not TelegramLimit.POLL_MIN_OPTIONS <= len(options) <= TelegramLimit.POLL_MAX_OPTIONS:
+            raise ValueError(f"a poll needs {TelegramLimit.POLL_MIN_OPTIONS}-{TelegramLimit.POLL_MAX_OPTIONS} options, "
+                             f"got {len(options)}")
+        for option in options:
+            if not option.strip():
+                raise ValueError("options must not be empty")
+            if len(option) > TelegramLimit.POLL_OPTION_MAX_LEN:
+                raise ValueError(f"option longer than {TelegramLimit.POLL_OPTION_MAX_LEN} chars: {option!r}")
+        if len(options) != len(set(options)):
+            raise ValueError("options must be unique")
+        return options
+
+    @field_validator('explanation')
+    @classmethod
+    def check_explanation(cls, explanation: str) -> str:
+        if len(explanation) > TelegramLimit.POLL_EXPLANATION_MAX_LEN:
+            raise ValueError(f"explanation longer than {TelegramLimit.POLL_EXPLANATION_MAX_LEN} chars "
+                             f"({len(explanation)})")
+        return explanation
+
+    @model_validator(mode='after')
+    def check_poll(self) -> 'QuizQuestion':
+        if not 0 <= self.correct_option_id < len(self.options):
+            raise ValueError(f"correct_option_id {self.correct_option_id} is out of range "
+                             f"for {len(self.options)} options")
+        # The question is posted together with its topic, so the limit applies to the whole text
+        question_len = len(poll_question_text(self.model_dump()))
+        if question_len > TelegramLimit.POLL_QUESTION_MAX_LEN:
+            raise ValueError(f"poll question longer than {TelegramLimit.POLL_QUESTION_MAX_LEN} chars "
+                             f"({question_len})")
+        return self
+
+
+def validate_questions(questions: dict, question_index=None) -> tuple:
+    """Splits generated questions into locally valid ones and invalid ones with their errors.
+
+    With a `dedup.DuplicateIndex`, near-duplicates of already published questions are invalid too.
+
+    Returns `(valid, invalid)`: `valid` maps a language to normalised question dicts,
+    `invalid` maps a language to `{'question': ..., 'errors': [...]}` items.
+    """
+    valid = {language: [] for language in questions}
+    invalid = {language: [] for language in questions}
+    for language, questions_lst in questions.items():
+        if not isinstance(questions_lst, list):
+            logging.error("Quizzes for %s are not a list: %s", language, type(questions_lst).__name__)
+            continue
+        for q in questions_lst:
+            if not isinstance(q, dict):
+                invalid[language].append({'question': q, 'errors': ["question is not a JSON object"]})
+                continue
+            try:
+                question = QuizQuestion.model_validate(q).model_dump()
+            except ValidationError as e:
+                errors = [f"{'.'.join(str(loc) for loc in err['loc']) or 'question'}: {err['msg']}"
+                          for err in e.errors()]
+                invalid[language].append({'question': q, 'errors': errors})
+                continue
+            duplicate = question_index.find_duplicate(question_text(question)) if question_index is not None else None
+            if duplicate:
+                invalid[language].append({'question': q, 'errors': [
+                    f"question: too similar to an already published question "
+                    f"(similarity {duplicate['similarity']:.2f}), ask something different"]})
+                continue
+            valid[language].append(question)
+    return valid, invalid
@@ -0,0 +1,213 @@
+import asyncio
+import json
+import logging
+
+from config import Parameter
+from gemini_api import GeminiAPI
+from log_config import LazyJson
+from openai_api import OpenaiAPI
+from prompts import Tasks, BatchVerification
+import token_budget
+
+# Verification policies (Parameter.VERIFICATION_POLICY)
+STRICT = 'strict'  # every verifier sees every question and all of them must agree
+TIERED = 'tiered'  # verifiers run cheapest first; a later one only sees the questions still in doubt
+
+ACCEPT = 'accept'
+REJECT = 'reject'
+ESCALATE = 'escalate'
+
+
+async def _ask_verifier(model, prompt: list):
+    if isinstance(model, GeminiAPI):
+        return await model.agenerate_response(messages=prompt[0]['content'] + " " + prompt[1]['content'],
+                                              call_type=token_budget.VERIFY)
+    return await model.agenerate_response(messages=prompt, call_type=token_budget.VERIFY)
+
+
+def _align_verification(opinions, questions: list):
+    """Matches verifier answers to `questions` by question_id; None if any question is not covered."""
+    if not isinstance(opinions, list):
+        return None
+    by_id = {str(o.get('question_id')): o for o in opinions if isinstance(o, dict)}
+    aligned = []
+    for q in questions:
+        opinion = by_id.get(str(q['question_id']))
+        if opinion is None or not isinstance(opinion.get('correct_options'), list):
+            return None
+        aligned.append(opinion)
+    return aligned
+
+
+def _parse_batch_verification(verif_str, questions: dict) -> dict:
+    """Returns the aligned opinions of every language the batch response answered correctly."""
+    try:
+        batch = json.loads(verif_str)
+    except (TypeError, json.decoder.JSONDecodeError) as e:
+        logging.error("Most likely the batch Verification is not in json format: %s", e)
+        return {}
+    if not isinstance(batch, dict):
+        logging.error("Batch Verification is not keyed by language: %s", type(batch).__name__)
+        return {}
+    parsed = {}
+    for language, questions_lst in questions.items():
+        aligned = _align_verification(batch.get(language), questions_lst)
+        if aligned is not None:
+            parsed[language] = aligned
+    return parsed
+
+
+async def get_opinions(model, name: str, questions: dict, initial_opinion: dict, news: list) -> tuple:
+    """Asks one verifier about all languages in one call, falling back to per-language calls.
+
+    Returns `(opinions, number of calls made)`.
+    """
+    languages = [language for language in questions if questions[language]]
+    opinions = {language: [] for language in questions}
+    if not languages:
+        return opinions, 0
+
+    batch_prompt = BatchVerification({language: questions[language] for language in languages}).get_prompt()
+    verif_str = await _ask_verifier(model, batch_prompt)
+    n_calls = 1
+    opinions.update(_parse_batch_verification(verif_str, questions))
+
+    for language in languages:
+        if opinions[language]:
+            continue
+        logging.warning("%s batch Verification invalid for %s, falling back to a per-language call", name, language)
+        verification_prompt = Tasks(news=news, language=language).verify(questions[language])
+        verif_str = await _ask_verifier(model, verification_prompt)
+        n_calls += 1
+        try:
+            aligned = _align_verification(json.loads(verif_str), questions[language])
+        except (TypeError, json.decoder.JSONDecodeError) as e:
+            logging.error("Most likely %s Verification is not in json format: %s", name, e)
+            aligned = None
+        if aligned is None:
+            logging.debug("The prompt: %s", verification_prompt[1]['content'])
+            logging.debug("The output: %s", LazyJson(verif_str))
+            aligned = initial_opinion[language]
+        opinions[language] = aligned
+
+    logging.info("%s Verification: %s call(s) for %s language(s)", name, n_calls, len(languages))
+    logging.debug("%s Verification: %s", name, LazyJson(opinions))
+    return opinions, n_calls
+
+
+def _correct_option(question: dict):
+    return question['options'][question['correct_option_id']]
+
+
+def judge(opinion: dict, question: dict, final: bool) -> str:
+    """Decision on one question from one verifier's `correct_options`.
+
+    A clear single answer settles the question either way; several answers including the
+    expected one, or no usable answer at all (`None`), are left to the next verifier. The last
+    verifier in the chain has nobody to escalate to, so doubt means rejection there.
+    """
+    options = opinion.get('correct_options')
+    if options is not None and _correct_option(question) not in options:
+        return REJECT
+    if options is not None and len(options) == 1:
+        return ACCEPT
+    return REJECT if final else ESCALATE
+
+
+async def _verify_strict(verifiers: list, questions: dict, news: list) -> tuple:
+    initial_opinion = {language: [{'question_id': q['question_id'], 'correct_options': [_correct_option(q)]}
+                                  for q in questions[language]]
+                       for language in questions}
+    results = await asyncio.gather(*(get_opinions(model, name, questions, initial_opinion, news)
+                                     for name, model in verifiers))
+    good_questions = {language: [] for language in questions}
+    bad_questions = {language: [] for language in questions}
+    for language in questions:
+        for i, q in enumerate(questions[language]):
+            opinions = [opinions[language][i] for opinions, _ in results]
+            if all(judge(opinion, q, final=True) == ACCEPT for opinion in opinions):
+                good_questions[language].append(q)
+            else:
+                bad_questions[language].append(q)
+    n_questions = sum(len(lst) for lst in questions.values())
+    stats = {'calls': sum(n_calls for _, n_calls in results),
+             'verifiers_called': sum(1 for _, n_calls in results if n_calls),
+             'questions_asked': n_questions * len(verifiers)}
+    return good_questions, bad_questions, {name: opinions for (name, _), (opinions, _) in zip(verifiers, results)}, stats
+
+
+async def _verify_tiered(verifiers: list, questions: dict, news: list) -> tuple:
+    good_questions = {language: [] for language in questions}
+    bad_questions = {language: [] for language in questions}
+    all_opinions = {}
+    stats = {'calls': 0, 'verifiers_called': 0, 'questions_asked': 0}
+    pending = questions
+    for tier, (name, model) in enumerate(verifiers):
+        if not any(pending.values()):
+            break
+        # A verifier that gives no usable answer leaves its questions in doubt
+        unknown = {language: [{'question_id': q['question_id'], 'correct_options': None} for q in pending[language]]
+                   for language in pending}
+        opinions, n_calls = await get_opinions(model, name, pending, unknown, news)
+        all_opinions[name] = opinions
+        stats['calls'] += n_calls
+        stats['verifiers_called'] += 1
+        stats['questions_asked'] += sum(len(lst) for lst in pending.values())
+
+        final = tier == len(verifiers) - 1
+        escalated = {language: [] for language in pending}
+        for language in pending:
+            for q, opinion in zip(pending[language], opinions[language]):
+                decision = judge(opinion, q, final)
+                if decision == ACCEPT:
+                    good_questions[language].append(q)
+                elif decision == REJECT:
+                    bad_questions[language].append(q)
+                else:
+                    escalated[language].append(q)
+        if any(escalated.values()):
+            logging.info("%s left %s question(s) in doubt, escalating",
+                         name, {language: len(lst) for language, lst in escalated.items() if lst})
+        pending = escalated
+
+    for language in questions:
+        # Keep the generation order regardless of the tier that settled a question
+        order = {q['question_id']: i for i, q in enumerate(questions[language])}
+        good_questions[language].sort(key=lambda q: order[q['question_id']])
+        bad_questions[language].sort(key=lambda q: order[q['question_id']])
+    return good_questions, bad_questions, all_opinions, stats
+
+
+async def verify(gemini_model: GeminiAPI, openai_model: OpenaiAPI, questions: dict, news: list,
+                 policy: str = None) -> dict:
+    """Checks every question with the verifiers in `Parameter.VERIFIER_ORDER` (cheapest first).
+
+    Returns `{'good', 'bad', 'stats'}`; `stats` reports the calls made, and the verifiers and
+    questions skipped compared with asking every verifier about every question.
+    """
+    policy = policy or Parameter.VERIFICATION_POLICY
+    models = {'Gemini': gemini_model, 'OpenAi': openai_model}
+    verifiers = [(name, models[name]) for name in Parameter.VERIFIER_ORDER]
+    if policy == STRICT:
+        good_questions, bad_questions, opinions, stats = await _verify_strict(verifiers, questions, news)
+    elif policy == TIERED:
+        good_questions, bad_questions, opinions, stats = await _verify_tiered(verifiers, questions, news)
+    else:
+        raise ValueError(f"Unknown verification policy: {policy}")
+
+    n_questions = sum(len(lst) for lst in questions.values())
+    n_languages = sum(1 for lst in questions.values() if lst)
+    stats['policy'] = policy
+    # Verifiers never asked; each of them would have made at least one batch call
+    stats['verifiers_skipped'] = (len(verifiers) if n_languages else 0) - stats['verifiers_called']
+    stats['questions_saved'] = n_questions * len(verifiers) - stats['questions_asked']
+
+    logging.info("Verification result: good=%s bad=%s",
+                 {language: len(lst) for language, lst in good_questions.items()},
+                 {language: len(lst) for language, lst in bad_questions.items()})
+    logging.info("Verification cost: %s", LazyJson(stats))
+    logging.debug("Questions: %s", LazyJson(questions))
+    for name, verifier_opinions in opinions.items():
+        logging.debug("%s opinion: %s", name, LazyJson(verifier_opinions))
+    logging.debug("Bad questions: %s", LazyJson(bad_questions))
+    return {'good': good_questions, 'bad': bad_questions, 'stats': stats}
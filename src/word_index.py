@@ -0,0 +1,241 @@
+import importlib
+import json
+import logging
+import os
+import re
+import zlib
+from typing import Callable, List, Optional
+
+import numpy as np
+
+from config import Parameter
+from models import Session, ForeignWord
+from sqlalchemy import func
+
+# Embedding function: list of texts -> (len(texts), dim) float array
+EmbeddingFn = Callable[[List[str]], np.ndarray]
+
+# Rows scored per matrix product when scanning the memory-mapped matrix
+SEARCH_BLOCK = 1 << 18
+SYNC_CHUNK = 10000
+
+
+def hashing_embedding(texts: List[str], dim: int = None) -> np.ndarray:
+    """Offline default embedder: signed feature hashing of words and their character trigrams."""
+    dim = dim or Parameter.EMBEDDING_DIM
+    vectors = np.zeros((len(texts), dim), dtype=np.float32)
+    for row, text in enumerate(texts):
+        for token in re.findall(r"\w+", (text or "").lower()):
+            padded = f"<{token}>"
+            features = [token] + [padded[i:i + 3] for i in range(len(padded) - 2)]
+            for feature in features:
+                h = zlib.crc32(feature.encode("utf-8"))
+                vectors[row, h % dim] += 1.0 if h & 0x80000000 else -1.0
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+# Embedders selectable by name in Parameter.WORD_EMBEDDER; anything else is a 'module:function' path
+EMBEDDERS = {'hashing': hashing_embedding}
+
+
+def load_embedder(spec: str) -> EmbeddingFn:
+    """The embedding function named by `spec`: a key of EMBEDDERS or a 'module:function' path."""
+    if spec in EMBEDDERS:
+        return EMBEDDERS[spec]
+    module_name, _, attr = spec.partition(':')
+    if not attr:
+        raise ValueError(f"Unknown embedder {spec!r}: use one of {sorted(EMBEDDERS)} or 'module:function'")
+    return getattr(importlib.import_module(module_name), attr)
+
+
+def word_text(word: str, meaning: Optional[str]) -> str:
+    return f"{word} {meaning or ''}".strip()
+
+
+class WordIndex:
+    """Append-only embedding matrix of one language's ForeignWord entries.
+
+    Vectors live in `<dir>/<language>.f32` (raw float32 rows) next to `<language>.ids` (int64
+    word ids) and `<language>.meta.json`; the meta file's `count` is written last, so rows past
+    it (from an interrupted append) are ignored and overwritten. Queries memory-map the files
+    and never touch the ORM.
+    """
+
+    def __init__(self, language: str, directory: str = None, embed_fn: EmbeddingFn = None,
+                 embedder_name: str = None):
+        self.language = language.lower()
+        self.directory = directory or Parameter.WORD_INDEX_DIR
+        self.embed_fn = embed_fn or hashing_embedding
+        self.embedder_name = embedder_name or getattr(self.embed_fn, '__name__', 'custom')
+        self.vectors_path = os.path.join(self.directory, f"{self.language}.f32")
+        self.ids_path = os.path.join(self.directory, f"{self.language}.ids")
+        self.meta_path = os.path.join(self.directory, f"{self.language}.meta.json")
+        self.meta = self._load_meta()
+        self._vectors = None
+        self._ids = None
+
+    def _load_meta(self) -> dict:
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta.get('embedder') == self.embedder_name:
+                return meta
+            logging.warning("Word index %s was built with %s, rebuilding with %s",
+                            self.language, meta.get('embedder'), self.embedder_name)
+        return {'embedder': self.embedder_name, 'dim': None, 'count': 0, 'last_id': 0}
+
+    def _save_meta(self):
+        tmp_path = self.meta_path + '.tmp'
+        with open(tmp_path, mode='w', encoding='utf-8') as f:
+            json.dump(self.meta, f)
+        os.replace(tmp_path, self.meta_path)
+
+    def __len__(self) -> int:
+        return self.meta['count']
+
+    def add(self, ids: List[int], texts: List[str]):
+        if not ids:
+            return
+        vectors = np.ascontiguousarray(self.embed_fn(texts), dtype=np.float32)
+        if self.meta['dim'] is None:
+            self.meta['dim'] = int(vectors.shape[1])
+        os.makedirs(self.directory, exist_ok=True)
+        count, dim = self.meta['count'], self.meta['dim']
+        for path, data, row_bytes in ((self.vectors_path, vectors, dim * 4),
+                                      (self.ids_path, np.asarray(ids, dtype=np.int64), 8)):
+            with open(path, mode='r+b' if os.path.exists(path) else 'wb') as f:
+                f.truncate(count * row_bytes)
+                f.seek(count * row_bytes)
+                f.write(data.tobytes())
+        self.meta['count'] = count + len(ids)
+        self.meta['last_id'] = max(self.meta['last_id'], int(max(ids)))
+        self._save_meta()
+        self._vectors = self._ids = None
+
+    def update(self, ids: List[int], texts: List[str]) -> int:
+        """Re-embeds rows already in the index, e.g. after their meaning was filled in.
+
+        Ids are appended in ascending order (see `sync`), so rows are found by binary search;
+        ids not in the index yet are left to the next sync. Returns how many rows were rewritten.
+        """
+        _, index_ids = self._open()
+        if index_ids is None or not ids:
+            return 0
+        ids = np.asarray(ids, dtype=np.int64)
+        positions = np.searchsorted(index_ids, ids)
+        found = positions < len(index_ids)
+        found[found] = index_ids[positions[found]] == ids[found]
+        if not found.any():
+            return 0
+        vectors = np.ascontiguousarray(self.embed_fn([t for t, hit in zip(texts, found) if hit]), dtype=np.float32)
+        self._vectors = self._ids = None
+        writable = np.memmap(self.vectors_path, dtype=np.float32, mode='r+', shape=(len(self), self.meta['dim']))
+        writable[positions[found]] = vectors
+        writable.flush()
+        del writable
+        return int(found.sum())
+
+    def sync(self) -> int:
+        """Embeds words added to the DB since the last sync; returns how many were indexed."""
+        added = 0
+        while True:
+            session = Session()
+            try:
+                rows = session.query(ForeignWord.id, ForeignWord.word, ForeignWord.meaning)\
+                              .filter(func.lower(ForeignWord.language) == self.language)\
+                              .filter(ForeignWord.id > self.meta['last_id'])\
+                              .order_by(ForeignWord.id)\
+                              .limit(SYNC_CHUNK)\
+                              .all()
+            finally:
+                session.close()
+            if not rows:
+                break
+            self.add([row.id for row in rows], [word_text(row.word, row.meaning) for row in rows])
+            added += len(rows)
+        if added:
+            logging.info("Word index %s: indexed %s new word(s), size=%s", self.language, added, len(self))
+        return added
+
+    def _open(self):
+        if self._vectors is None and len(self):
+            self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='r',
+                                      shape=(len(self), self.meta['dim']))
+            self._ids = np.memmap(self.ids_path, dtype=np.int64, mode='r', shape=(len(self),))
+        return self._vectors, self._ids
+
+    def search(self, text: str, k: int = 10) -> List[tuple]:
+        """Top-k `(word_id, cosine similarity)` pairs for `text`, best first."""
+        vectors, ids = self._open()
+        if vectors is None:
+            return []
+        query = np.asarray(self.embed_fn([text]), dtype=np.float32)[0]
+        best_scores = np.empty(0, dtype=np.float32)
+        best_rows = np.empty(0, dtype=np.int64)
+        for start in range(0, len(vectors), SEARCH_BLOCK):
+            scores = vectors[start:start + SEARCH_BLOCK] @ query
+            if len(scores) > k:
+                top = np.argpartition(scores, -k)[-k:]
+            else:
+                top = np.arange(len(scores))
+            best_scores = np.concatenate([best_scores, scores[top]])
+            best_rows = np.concatenate([best_rows, top + start])
+            if len(best_scores) > k:
+                keep = np.argpartition(best_scores, -k)[-k:]
+                best_scores, best_rows = best_scores[keep], best_rows[keep]
+        order = np.argsort(-best_scores)
+        return [(int(ids[best_rows[i]]), float(best_scores[i])) for i in order]
+
+
+_indexes = {}
+# Directory of the process-wide indexes; None means Parameter.WORD_INDEX_DIR
+_directory = None
+
+
+def get_word_index(language: str) -> WordIndex:
+    """Process-wide WordIndex per language, so a resident process keeps the mapping open.
+
+    Indexes embed with `Parameter.WORD_EMBEDDER`; an index built with another embedder is rebuilt.
+    """
+    language = language.lower()
+    if language not in _indexes:
+        _indexes[language] = WordIndex(language, directory=_directory,
+                                       embed_fn=load_embedder(Parameter.WORD_EMBEDDER),
+                                       embedder_name=Parameter.WORD_EMBEDDER)
+    return _indexes[language]
+
+
+def configure_word_indexes(directory: str = None):
+    """Drops the process-wide indexes; later ones live in `directory` (default
+    `Parameter.WORD_INDEX_DIR`), e.g. for a benchmark or test store of its own."""
+    global _directory
+    _indexes.clear()
+    _directory = directory
+
+
+def sync_word_indexes(languages: List[str]):
+    for language in {language.lower() for language in languages}:
+        get_word_index(language).sync()
+
+
+def reembed_words(ids: List[int]):
+    """Re-embeds the given words in their languages' indexes, after their meanings changed."""
+    if not ids:
+        return
+    session = Session()
+    try:
+        rows = session.query(ForeignWord.id, ForeignWord.word, ForeignWord.meaning, ForeignWord.language)\
+                      .filter(ForeignWord.id.in_(ids))\
+                      .order_by(ForeignWord.id)\
+                      .all()
+    finally:
+        session.close()
+    by_language = {}
+    for row in rows:
+        by_language.setdefault(row.language.lower(), []).append(row)
+    for language, language_rows in by_language.items():
+        rewritten = get_word_index(language).update([row.id for row in language_rows],
+                                                    [word_text(row.word, row.meaning) for row in language_rows])
+        if rewritten:
+            logging.info("Word index %s: re-embedded %s updated word(s)", language, rewritten)
@@ -0,0 +1,23 @@
+import os
+import sys
+
+import pytest
+from sqlalchemy import create_engine
+
+# The modules import each other by name, as when run from src/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src'))
+# models binds its engine on import: never let that be the production store
+os.environ['DATABASE_URL'] = 'sqlite://'
+
+import models  # noqa: E402
+
+
+@pytest.fixture
+def db(tmp_path):
+    """A fresh SQLite file with every table, bound to `models.Session` for the test."""
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    models.Base.metadata.create_all(engine)
+    models.Session.configure(bind=engine)
+    yield engine
+    models.Session.configure(bind=models.engine)
+    engine.dispose()
@@ -0,0 +1,88 @@
+import asyncio
+import os
+
+import pytest
+
+from cassette import RECORD, REPLAY, Cassette, CassetteMiss
+from dedup import DuplicateIndex
+
+PUBLISHED = "Central bank raises interest rates to fight inflation"
+
+
+class FakeModel:
+    def __init__(self):
+        self.calls = 0
+
+    async def agenerate_response(self, messages, timeout=None, call_type=None):
+        self.calls += 1
+        return f"answer {self.calls} to {messages}"
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, message):
+        self.sent.append((chat_id, message))
+
+    async def send_image_quizzes(self, chats, questions, images, plan_date=None):
+        self.sent.append((chats, questions))
+        return {'sent': len(questions)}
+
+
+async def session(cassette: Cassette, chats: dict):
+    model = cassette.wrap(FakeModel(), 'openai')
+    bot = cassette.wrap(FakeBot(), 'telegram')
+    answers = [await model.agenerate_response("news prompt", call_type='news'),
+               await model.agenerate_response("quiz   prompt", timeout=30, call_type='quiz')]
+    await bot.send_message(chat_id=chats['log'], message="run started")
+    answers.append(await bot.send_image_quizzes(chats={'english': chats['english']}, questions={'english': [1]},
+                                                images={}))
+    return answers, model, bot
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'run.jsonl.gz')
+
+
+def test_a_replay_answers_every_call_without_the_recorded_chats(path):
+    recorded, _, _ = asyncio.run(session(Cassette(path, RECORD, seed=7), {'log': '-100', 'english': '-200'}))
+
+    replay = Cassette(path, REPLAY)
+    replayed, model, bot = asyncio.run(session(replay, {'log': None, 'english': None}))
+
+    assert replayed == recorded
+    assert model.calls == 0 and bot.sent == []
+    assert replay.seed == 7
+    assert replay.stats['key_matches'] == 4
+
+
+def test_a_changed_prompt_misses_unless_lenient(path):
+    cassette = Cassette(path, RECORD)
+    recorded = asyncio.run(cassette.wrap(FakeModel(), 'openai').agenerate_response("old prompt"))
+
+    with pytest.raises(CassetteMiss):
+        asyncio.run(Cassette(path, REPLAY, lenient=False).wrap(FakeModel(), 'openai').agenerate_response("new"))
+    lenient = Cassette(path, REPLAY, lenient=True)
+    assert asyncio.run(lenient.wrap(FakeModel(), 'openai').agenerate_response("new")) == recorded
+    assert lenient.stats['sequence_matches'] == 1
+
+
+def test_dedup_decisions_are_replayed_and_the_archive_is_left_alone(path, tmp_path):
+    archive = tmp_path / 'archive'
+    DuplicateIndex('news', directory=str(archive)).add([PUBLISHED])
+    recording = Cassette(path, RECORD)
+    index = recording.wrap(DuplicateIndex('news', directory=str(archive)), 'dedup')
+    assert index.is_duplicate(PUBLISHED)
+    assert index.find_duplicate(PUBLISHED)['row'] == 0
+    index.add(["Volcano erupts on a remote island"])
+
+    empty = tmp_path / 'empty'
+    replay = Cassette(path, REPLAY)
+    index = replay.wrap(DuplicateIndex('news', directory=str(empty)), 'dedup')
+    assert index.is_duplicate(PUBLISHED)
+    assert index.find_duplicate(PUBLISHED)['row'] == 0
+    index.add(["Volcano erupts on a remote island"])
+    assert not os.path.exists(empty)
+    assert replay.stats['key_matches'] == 3
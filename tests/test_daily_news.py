@@ -0,0 +1,102 @@
+import asyncio
+import datetime
+
+import pytest
+
+import app
+from config import Parameter
+from crud import claim_daily_news, get_daily_news, release_daily_news, renew_daily_news, store_daily_news
+from models import DailyNews, Session
+
+DAY = datetime.date(2026, 5, 4)
+NEWS = [{'id': 1, 'text': "A bridge opened."}]
+
+
+def age_claim(date, seconds):
+    """Moves the claim of `date` `seconds` into the past, as if its worker had gone quiet."""
+    session = Session()
+    try:
+        row = session.get(DailyNews, date)
+        row.claimed_at -= datetime.timedelta(seconds=seconds)
+        session.commit()
+    finally:
+        session.close()
+
+
+def test_first_claim_wins_while_the_lease_runs(db):
+    assert claim_daily_news(DAY, 'a', lease_seconds=900)
+    assert not claim_daily_news(DAY, 'b', lease_seconds=900)
+    row = get_daily_news(DAY)
+    assert (row.status, row.owner) == ('pending', 'a')
+
+
+def test_expired_claim_is_taken_over_and_the_old_owner_cannot_store(db):
+    claim_daily_news(DAY, 'a', lease_seconds=900)
+    age_claim(DAY, 901)
+    assert claim_daily_news(DAY, 'b', lease_seconds=900)
+    assert not claim_daily_news(DAY, 'c', lease_seconds=900)
+    assert not store_daily_news(DAY, 'a', NEWS)
+    assert not renew_daily_news(DAY, 'a')
+    assert store_daily_news(DAY, 'b', NEWS)
+    assert get_daily_news(DAY).status == 'ready'
+
+
+def test_renewal_keeps_the_claim(db):
+    claim_daily_news(DAY, 'a', lease_seconds=900)
+    age_claim(DAY, 901)
+    assert renew_daily_news(DAY, 'a')
+    assert not claim_daily_news(DAY, 'b', lease_seconds=900)
+
+
+def test_release_frees_the_date_at_once(db):
+    claim_daily_news(DAY, 'a', lease_seconds=900)
+    release_daily_news(DAY, 'b')  # not the owner: no effect
+    assert not claim_daily_news(DAY, 'b', lease_seconds=900)
+    release_daily_news(DAY, 'a')
+    assert get_daily_news(DAY) is None
+    assert claim_daily_news(DAY, 'b', lease_seconds=900)
+
+
+def test_a_ready_date_cannot_be_claimed_or_released(db):
+    claim_daily_news(DAY, 'a', lease_seconds=900)
+    store_daily_news(DAY, 'a', NEWS)
+    age_claim(DAY, 901)
+    assert not claim_daily_news(DAY, 'b', lease_seconds=900)
+    release_daily_news(DAY, 'a')
+    assert get_daily_news(DAY).status == 'ready'
+
+
+def test_an_empty_list_is_never_stored(db):
+    claim_daily_news(DAY, 'a', lease_seconds=900)
+    with pytest.raises(ValueError):
+        store_daily_news(DAY, 'a', [])
+    assert get_daily_news(DAY).status == 'pending'
+
+
+def test_get_news_releases_the_claim_when_nothing_was_generated(db, monkeypatch):
+    async def no_news(*args, **kwargs):
+        return []
+
+    monkeypatch.setattr(app, 'generate_unique_news', no_news)
+    with pytest.raises(ValueError):
+        asyncio.run(app.get_news(None, None, None, date=DAY, shared=True))
+    assert get_daily_news(DAY) is None
+
+
+def test_get_news_renews_its_claim_during_a_long_generation(db, monkeypatch):
+    monkeypatch.setattr(Parameter, 'NEWS_LEASE_SECONDS', 0.3)
+    rivals = []
+
+    async def slow_news(*args, **kwargs):
+        # Outlasts the lease twice over; a rival trying meanwhile must not take the date
+        for _ in range(6):
+            await asyncio.sleep(0.1)
+            rivals.append(await asyncio.to_thread(claim_daily_news, DAY, 'rival', 0.3))
+        return NEWS
+
+    monkeypatch.setattr(app, 'generate_unique_news', slow_news)
+    # Without renewal the rival wins and get_news would wait for its news forever
+    news = asyncio.run(asyncio.wait_for(app.get_news(None, None, None, date=DAY, shared=True), timeout=5))
+    assert news == NEWS
+    assert not any(rivals)
+    assert get_daily_news(DAY).status == 'ready'
@@ -0,0 +1,41 @@
+import json
+
+import numpy as np
+
+from dedup import DuplicateIndex, minhash
+
+FIRST = "Central bank raises interest rates to fight inflation"
+SECOND = "Volcano erupts on a remote island in the South Pacific"
+THIRD = "New solar panel design doubles the efficiency of rooftop arrays"
+
+
+def archived_texts(index: DuplicateIndex) -> list:
+    with open(index.items_path, encoding="utf-8") as f:
+        return [json.loads(line)['text'] for line in f]
+
+
+def test_two_instances_on_one_archive_keep_every_row(tmp_path):
+    one = DuplicateIndex('news', directory=str(tmp_path))
+    two = DuplicateIndex('news', directory=str(tmp_path))
+
+    one.add([FIRST])
+    two.add([SECOND])
+    one.add([THIRD])
+
+    reloaded = DuplicateIndex('news', directory=str(tmp_path))
+    texts = archived_texts(reloaded)
+    assert texts == [FIRST, SECOND, THIRD]
+    assert len(reloaded) == len(texts)
+    for row, text in enumerate(texts):
+        assert np.array_equal(reloaded.signatures[row], minhash(text))
+
+
+def test_an_instance_sees_rows_another_one_archived(tmp_path):
+    one = DuplicateIndex('news', directory=str(tmp_path))
+    two = DuplicateIndex('news', directory=str(tmp_path))
+
+    one.add([FIRST])
+    two.add([SECOND])
+
+    assert two.is_duplicate(FIRST)
+    assert two.find_duplicate(SECOND)['row'] == 1
@@ -0,0 +1,27 @@
+import datetime
+
+from crud import enqueue_outbox, get_pending_outbox, get_planned_chats
+from tg_api import outbox_item
+
+DAY = datetime.date(2026, 5, 4)
+
+
+def plan(day, questions):
+    return [outbox_item('chat', 'photo', {}, day, 0, photo=b'picture')] + \
+        [outbox_item('chat', 'poll', {'question': q}, day, slot) for slot, q in enumerate(questions, start=1)]
+
+
+def test_a_rerun_with_new_content_plans_nothing_new(db):
+    first = enqueue_outbox(plan(DAY, ['a', 'b']))
+    # Regenerated quizzes and picture differ, the slots are the same
+    second = enqueue_outbox(plan(DAY, ['c', 'd']))
+    assert second == first
+    assert [m.payload for m in get_pending_outbox()][1:] == ['{"question": "a"}', '{"question": "b"}']
+
+
+def test_plans_are_per_date_and_chat(db):
+    enqueue_outbox(plan(DAY, ['a']))
+    assert get_planned_chats(DAY) == {'chat'}
+    assert get_planned_chats(DAY + datetime.timedelta(days=1)) == set()
+    enqueue_outbox(plan(DAY + datetime.timedelta(days=1), ['a']))
+    assert len(get_pending_outbox()) == 4
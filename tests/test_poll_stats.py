@@ -0,0 +1,134 @@
+import asyncio
+import json
+
+import telegram
+
+import crud
+import poll_stats
+from crud import register_poll, upsert_poll_stats
+from models import PollStat, Session
+from poll_stats import FakeUpdateSource, PollStatsCollector
+
+
+def poll_update(update_id, poll_id, votes, correct_option_id=0):
+    options = [telegram.PollOption(f"option {i}", count) for i, count in enumerate(votes)]
+    poll = telegram.Poll(str(poll_id), "question", options, sum(votes), False, True, 'quiz', False,
+                         correct_option_id=correct_option_id)
+    return telegram.Update(update_id, poll=poll)
+
+
+def answer_update(update_id, poll_id, option):
+    answer = telegram.PollAnswer(str(poll_id), [option], user=telegram.User(1, "voter", False))
+    return telegram.Update(update_id, poll_answer=answer)
+
+
+def stored(poll_id):
+    session = Session()
+    try:
+        return session.get(PollStat, str(poll_id))
+    finally:
+        session.close()
+
+
+def run(collector):
+    asyncio.run(collector.run())
+
+
+def test_updates_fold_into_one_row_per_poll(db):
+    source = FakeUpdateSource([
+        [poll_update(1, 'p1', [1, 0]), answer_update(2, 'p1', 0), poll_update(3, 'p1', [2, 1])],
+        [poll_update(4, 'p2', [0, 3], correct_option_id=1)],
+    ])
+    collector = PollStatsCollector(source, flush_interval=3600, flush_size=100)
+    run(collector)
+
+    assert collector.stats['updates'] == 3
+    assert collector.stats['poll_answers'] == 1
+    assert collector.stats['flushes'] == 1
+    assert collector.stats['rows_written'] == 2
+    assert json.loads(stored('p1').option_votes) == [2, 1]
+    assert stored('p1').correct_votes == 2
+    assert stored('p2').correct_votes == 3
+
+
+def test_flushes_once_flush_size_polls_are_pending(db):
+    source = FakeUpdateSource([[poll_update(1, 'p1', [1]), poll_update(2, 'p2', [1])],
+                               [poll_update(3, 'p3', [1])]])
+    collector = PollStatsCollector(source, flush_interval=3600, flush_size=2)
+    run(collector)
+
+    # One flush for the first two polls, one for the rest when the source runs dry
+    assert collector.stats['flushes'] == 2
+    assert collector.stats['rows_written'] == 3
+
+
+def test_flushes_after_flush_interval(db, monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(poll_stats.time, 'monotonic', lambda: clock[0])
+    collector = PollStatsCollector(FakeUpdateSource([]), flush_interval=30, flush_size=100)
+    collector.ingest([poll_update(1, 'p1', [1])])
+    assert not collector._flush_due()
+    clock[0] += 30
+    assert collector._flush_due()
+    asyncio.run(collector.flush())
+    assert stored('p1').total_voters == 1
+    assert not collector._flush_due()
+
+
+def test_failed_flush_keeps_its_rows(db, monkeypatch):
+    calls = []
+
+    def failing_once(rows):
+        calls.append(len(rows))
+        if len(calls) == 1:
+            raise RuntimeError("database is down")
+        upsert_poll_stats(rows)
+
+    monkeypatch.setattr(poll_stats, 'upsert_poll_stats', failing_once)
+    collector = PollStatsCollector(FakeUpdateSource([]), flush_interval=3600, flush_size=100)
+    collector.ingest([poll_update(1, 'p1', [1, 0]), poll_update(2, 'p2', [0, 1])])
+    asyncio.run(collector.flush())
+    assert collector.stats['failed_flushes'] == 1
+    assert set(collector.pending) == {'p1', 'p2'}
+
+    # Newer counts that arrive before the retry win over the kept ones
+    collector.ingest([poll_update(3, 'p1', [5, 0])])
+    asyncio.run(collector.flush())
+    assert calls == [2, 2]
+    assert collector.pending == {}
+    assert stored('p1').total_voters == 5
+    assert stored('p2').total_voters == 1
+
+
+def test_upsert_inserts_unknown_polls_as_unknown(db):
+    upsert_poll_stats([{'poll_id': 'p1', 'option_votes': '[1, 2]', 'total_voters': 3, 'correct_votes': 2}])
+    stat = stored('p1')
+    assert stat.language == 'unknown'
+    assert stat.total_voters == 3
+    assert stat.correct_votes == 2
+
+
+def test_upsert_updates_counts_of_registered_polls(db):
+    register_poll('p1', 'chat', 'english', grammar_topic='Past simple', question_id=1, correct_option_id=0)
+    upsert_poll_stats([{'poll_id': 'p1', 'option_votes': '[4, 1]', 'total_voters': 5, 'correct_votes': 4}])
+    stat = stored('p1')
+    assert (stat.language, stat.grammar_topic) == ('english', 'Past simple')
+    assert (stat.option_votes, stat.total_voters, stat.correct_votes) == ('[4, 1]', 5, 4)
+    assert stat.updated_at is not None
+
+
+def test_upsert_null_correct_votes_keeps_the_stored_value(db):
+    upsert_poll_stats([{'poll_id': 'p1', 'option_votes': '[4, 1]', 'total_voters': 5, 'correct_votes': 4}])
+    upsert_poll_stats([{'poll_id': 'p1', 'option_votes': '[6, 1]', 'total_voters': 7, 'correct_votes': None}])
+    stat = stored('p1')
+    assert stat.total_voters == 7
+    assert stat.correct_votes == 4
+
+
+def test_topic_stats_rank_the_weakest_topic_first(db):
+    register_poll('p1', 'chat', 'english', grammar_topic='Articles', correct_option_id=0)
+    register_poll('p2', 'chat', 'english', grammar_topic='Past simple', correct_option_id=0)
+    upsert_poll_stats([{'poll_id': 'p1', 'option_votes': '[9, 1]', 'total_voters': 10, 'correct_votes': 9},
+                       {'poll_id': 'p2', 'option_votes': '[2, 8]', 'total_voters': 10, 'correct_votes': 2}])
+    assert [row[1] for row in crud.get_topic_stats('english')] == ['Past simple', 'Articles']
+
@@ -0,0 +1,244 @@
+import asyncio
+import email.utils
+import time
+
+import pytest
+
+import rate_governor
+from config import Parameter
+from rate_governor import RateGovernor, TokenBucket, retry_after
+
+
+class Response:
+    def __init__(self, headers):
+        self.headers = headers
+
+
+class RateLimitError(Exception):
+    status_code = 429
+
+    def __init__(self, headers=None):
+        super().__init__("rate limited")
+        self.response = Response(headers or {})
+
+
+class BadRequestError(Exception):
+    status_code = 400
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """A monotonic clock the test moves by hand."""
+    now = [1000.0]
+    monkeypatch.setattr(rate_governor.time, 'monotonic', lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(Parameter, 'RATE_BACKOFF', 0.001)
+
+
+def test_retry_after_seconds_milliseconds_and_http_dates():
+    assert retry_after(RateLimitError({'retry-after': '7'})) == 7.0
+    assert retry_after(RateLimitError({'retry-after-ms': '250', 'retry-after': '7'})) == 0.25
+    when = email.utils.formatdate(time.time() + 30, usegmt=True)
+    assert 28 <= retry_after(RateLimitError({'retry-after': when})) <= 30
+    past = email.utils.formatdate(time.time() - 30, usegmt=True)
+    assert retry_after(RateLimitError({'retry-after': past})) == 0.0
+
+
+def test_retry_after_without_a_usable_header():
+    assert retry_after(RateLimitError()) is None
+    assert retry_after(RateLimitError({'retry-after': 'soon'})) is None
+    assert retry_after(ValueError("no response")) is None
+
+
+def test_bucket_refills_at_its_rate_up_to_one_minute(clock):
+    bucket = TokenBucket(tokens_per_minute=600)  # 10 tokens a second
+    assert bucket.delay(600) == 0
+    bucket.take(600)
+    assert bucket.delay(100) == pytest.approx(10)
+    clock[0] += 5
+    assert bucket.delay(100) == pytest.approx(5)
+    clock[0] += 3600
+    assert bucket.delay(600) == 0
+    assert bucket.tokens == 600
+
+
+def test_bucket_give_back_is_capped_at_capacity(clock):
+    bucket = TokenBucket(tokens_per_minute=600)
+    bucket.take(400)
+    bucket.give_back(300)
+    assert bucket.tokens == 500
+    bucket.give_back(300)
+    assert bucket.tokens == 600
+
+
+def test_a_reservation_larger_than_capacity_waits_for_a_full_bucket(clock):
+    bucket = TokenBucket(tokens_per_minute=600)
+    bucket.take(300)
+    assert bucket.delay(5000) == pytest.approx(30)
+
+
+def test_success_adds_increase_over_limit():
+    governor = RateGovernor('test', initial=4, max_limit=6, increase=1.0, decrease=0.5)
+
+    async def succeed(calls):
+        for _ in range(calls):
+            governor.release(await governor.acquire(), succeeded=True)
+
+    asyncio.run(succeed(1))
+    assert governor.limit == pytest.approx(4.25)
+    # About one more slot per round of `limit` calls, never above max_limit
+    asyncio.run(succeed(5))
+    assert 5 < governor.limit < 6
+    asyncio.run(succeed(20))
+    assert governor.limit == 6
+    assert governor.stats['succeeded'] == 26
+
+
+def test_throttling_cuts_the_limit_once_per_epoch():
+    governor = RateGovernor('test', initial=8, min_limit=2, increase=1.0, decrease=0.5)
+
+    async def run():
+        epochs = [await governor.acquire() for _ in range(4)]
+        # All four were admitted under the old limit: only the first throttle cuts it
+        for epoch in epochs:
+            governor.release(epoch, throttled=True)
+        assert governor.limit == 4 and governor.epoch == 1
+        # A call admitted under the new limit cuts it again, down to min_limit
+        for _ in range(2):
+            governor.release(await governor.acquire(), throttled=True)
+        assert governor.limit == 2 and governor.epoch == 3
+
+    asyncio.run(run())
+    assert governor.stats['throttled'] == 6
+    assert governor.in_flight == 0
+
+
+def test_retry_after_pauses_every_call(clock):
+    governor = RateGovernor('test', initial=4)
+
+    async def run():
+        governor.release(await governor.acquire(), throttled=True, pause=20)
+        assert governor.blocked_until == 1020
+
+    asyncio.run(run())
+
+
+def test_failed_attempts_give_their_reservation_back(fast_backoff):
+    governor = RateGovernor('test', initial=4, tokens_per_minute=600)
+    attempts = []
+
+    async def request():
+        attempts.append(governor.bucket.tokens)
+        if len(attempts) < 3:
+            raise RateLimitError()
+        return 'ok'
+
+    async def run():
+        return await governor.call(request, tokens=100, used_tokens=lambda result: 40)
+
+    assert asyncio.run(run()) == 'ok'
+    # Each attempt held only its own reservation; the answer kept what it used
+    assert all(tokens == pytest.approx(500, abs=1) for tokens in attempts)
+    assert governor.bucket.tokens == pytest.approx(560, abs=1)
+    assert governor.stats['retries'] == 2
+
+
+def test_other_errors_are_raised_at_once_and_refunded():
+    governor = RateGovernor('test', initial=4, tokens_per_minute=600)
+
+    async def request():
+        raise BadRequestError()
+
+    with pytest.raises(BadRequestError):
+        asyncio.run(governor.call(request, tokens=100))
+    assert governor.bucket.tokens == pytest.approx(600, abs=1)
+    assert governor.in_flight == 0 and governor.stats['retries'] == 0
+
+
+def test_cancelled_waiter_passes_its_slot_on():
+    governor = RateGovernor('test', initial=1)
+
+    async def slow():
+        await asyncio.sleep(0.05)
+        return 1
+
+    async def run():
+        tasks = [asyncio.ensure_future(governor.call(slow)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        tasks[1].cancel()
+        return await asyncio.gather(*tasks, return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert results[0] == 1 and results[2] == 1
+    assert isinstance(results[1], asyncio.CancelledError)
+    assert governor.in_flight == 0 and not governor._waiters
+
+
+def test_limit_converges_below_provider_capacity(fast_backoff):
+    """1000 calls against a provider that throttles past 12 concurrent requests."""
+    capacity = 12
+    provider = {'in_flight': 0, 'peak': 0, 'served': 0}
+
+    async def request():
+        if provider['in_flight'] >= capacity:
+            await asyncio.sleep(0.001)
+            raise RateLimitError()
+        provider['in_flight'] += 1
+        provider['peak'] = max(provider['peak'], provider['in_flight'])
+        try:
+            await asyncio.sleep(0.005)
+        finally:
+            provider['in_flight'] -= 1
+        provider['served'] += 1
+        return 'ok'
+
+    governor = RateGovernor('simulated', initial=2, max_limit=64, increase=1.0, decrease=0.5)
+
+    async def run():
+        return await asyncio.gather(*(governor.call(request) for _ in range(1000)), return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert results.count('ok') == 1000
+    assert provider['served'] == 1000
+    assert provider['peak'] <= capacity
+    assert governor.stats['throttled'] > 0
+    assert 6 <= governor.limit <= capacity + 2
+
+
+def test_responses_call_and_chat_fallback_are_governed_separately(monkeypatch):
+    from types import SimpleNamespace
+
+    from openai_api import OpenaiAPI
+
+    governor = RateGovernor('openai', initial=4, tokens_per_minute=60_000)
+    monkeypatch.setattr(rate_governor, '_governors', {'openai': governor})
+    requests = []
+
+    async def responses_create(**kwargs):
+        requests.append(('responses', governor.in_flight))
+        # No text and not truncated: the chat fallback runs
+        return SimpleNamespace(output_text='', output=[], incomplete_details=None,
+                               usage=SimpleNamespace(output_tokens=10, output_tokens_details=None))
+
+    async def chat_create(**kwargs):
+        requests.append(('chat', governor.in_flight))
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content='answer'),
+                                                        finish_reason='stop')],
+                               usage=SimpleNamespace(completion_tokens=20, completion_tokens_details=None))
+
+    client = SimpleNamespace(responses=SimpleNamespace(create=responses_create),
+                             chat=SimpleNamespace(completions=SimpleNamespace(create=chat_create)))
+    monkeypatch.setattr(OpenaiAPI, 'async_client', property(lambda self: client))
+    api = OpenaiAPI(api_key='test', model='gpt-5-mini')
+    text, usage = asyncio.run(api._agenerate_once('question', None, max_tokens=500, effort='low'))
+
+    assert text == 'answer'
+    # Each request held its own slot, released before the next one
+    assert requests == [('responses', 1), ('chat', 1)]
+    assert governor.stats['succeeded'] == 2 and governor.in_flight == 0
+    # Both reservations were settled down to what each request used
+    assert governor.bucket.tokens == pytest.approx(60_000 - (3 + 10) - (3 + 20), abs=1)
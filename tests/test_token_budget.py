@@ -0,0 +1,57 @@
+import pytest
+
+from config import Parameter
+from token_budget import TokenBudget, Usage, QUIZ
+
+MAX_TOKENS = 1000
+TRUNCATED = Usage(output_tokens=0, reasoning_tokens=MAX_TOKENS, truncated=True)
+ANSWERED = Usage(output_tokens=200, reasoning_tokens=300)
+
+
+@pytest.fixture
+def budget(tmp_path, monkeypatch):
+    monkeypatch.setattr(Parameter, 'REASONING_EFFORT', {'default': 'medium'})
+    monkeypatch.setattr(Parameter, 'REASONING_RECOVERY_CALLS', 4)
+    monkeypatch.setattr(Parameter, 'TOKEN_BUDGET_SAVE_SECONDS', 3600)
+    return TokenBudget(path=str(tmp_path / 'token_budget.json'))
+
+
+def test_truncations_step_down_to_the_model_floor(budget):
+    for _ in range(3):
+        budget.record(QUIZ, TRUNCATED, MAX_TOKENS, 'gpt-5.2')
+        budget.record(QUIZ, TRUNCATED, MAX_TOKENS, 'gpt-5')
+
+    assert budget.reasoning_effort(QUIZ, 'gpt-5.2') == 'low'
+    assert budget.reasoning_effort(QUIZ, 'gpt-5') == 'minimal'
+
+
+def test_untruncated_calls_recover_a_step(budget):
+    budget.record(QUIZ, TRUNCATED, MAX_TOKENS, 'gpt-5.2')
+    assert budget.reasoning_effort(QUIZ, 'gpt-5.2') == 'low'
+
+    for _ in range(Parameter.REASONING_RECOVERY_CALLS - 1):
+        budget.record(QUIZ, ANSWERED, MAX_TOKENS, 'gpt-5.2')
+    assert budget.reasoning_effort(QUIZ, 'gpt-5.2') == 'low'
+    budget.record(QUIZ, ANSWERED, MAX_TOKENS, 'gpt-5.2')
+    assert budget.reasoning_effort(QUIZ, 'gpt-5.2') == 'medium'
+
+
+def test_a_failed_call_recovers_a_whole_step_and_is_saved(budget, tmp_path):
+    budget.record(QUIZ, TRUNCATED, MAX_TOKENS, 'gpt-5')
+    budget.record(QUIZ, TRUNCATED, MAX_TOKENS, 'gpt-5')
+    assert budget.reasoning_effort(QUIZ, 'gpt-5') == 'minimal'
+
+    budget.record_failure(QUIZ, 'gpt-5')
+    assert budget.reasoning_effort(QUIZ, 'gpt-5') == 'low'
+    budget.flush()
+
+    reloaded = TokenBudget(path=str(tmp_path / 'token_budget.json'))
+    assert reloaded.reasoning_effort(QUIZ, 'gpt-5') == 'low'
+    reloaded.record_failure(QUIZ, 'gpt-5')
+    assert reloaded.reasoning_effort(QUIZ, 'gpt-5') == 'medium'
+
+
+def test_a_saved_step_below_the_floor_is_not_used(budget):
+    budget.reasoning_truncations['gpt-5.2:quiz'] = 5
+
+    assert budget.reasoning_effort(QUIZ, 'gpt-5.2') == 'low'
@@ -0,0 +1,97 @@
+import asyncio
+import json
+
+import app
+from config import Parameter, TelegramLimit
+from tg_api import poll_question_text
+from validation import validate_questions
+
+NEWS = [{'text': f'News {i}'} for i in range(4)]
+
+
+def quiz(question_id=1, **changes):
+    question = {'question_id': question_id, 'grammar_topic': 'Past Simple', 'question': 'She ___ home yesterday.',
+                'options': ['go', 'went', 'gone', 'going'], 'correct_option_id': 1,
+                'explanation': '"Yesterday" calls for the past simple.'}
+    question.update(changes)
+    return question
+
+
+class FakeModel:
+    """Answers regeneration prompts with the queued replies, in order."""
+
+    def __init__(self, *replies):
+        self.replies = list(replies)
+        self.prompts = []
+
+    async def agenerate_response(self, messages, call_type=None):
+        self.prompts.append(messages)
+        return json.dumps(self.replies.pop(0))
+
+
+def errors_of(question):
+    _, invalid = validate_questions({'english': [question]})
+    return invalid['english'][0]['errors'] if invalid['english'] else []
+
+
+def test_a_question_within_the_limits_is_valid():
+    valid, invalid = validate_questions({'english': [quiz()]})
+    assert [q['question_id'] for q in valid['english']] == [1]
+    assert invalid == {'english': []}
+
+
+def test_the_question_limit_counts_the_topic_line():
+    topic_len = len(poll_question_text(quiz(question='')))
+    fits = 'x' * (TelegramLimit.POLL_QUESTION_MAX_LEN - topic_len)
+    assert errors_of(quiz(question=fits)) == []
+    too_long = 'x' * TelegramLimit.POLL_QUESTION_MAX_LEN
+    assert any('poll question longer' in error for error in errors_of(quiz(question=too_long)))
+
+
+def test_option_limits():
+    assert errors_of(quiz(options=['a' * (TelegramLimit.POLL_OPTION_MAX_LEN + 1), 'b']))
+    assert errors_of(quiz(options=['went'], correct_option_id=0))
+    assert errors_of(quiz(options=[str(i) for i in range(TelegramLimit.POLL_MAX_OPTIONS + 1)]))
+    assert errors_of(quiz(options=['went', 'went', 'go']))
+    assert errors_of(quiz(options=['went', ' ', 'go']))
+
+
+def test_explanation_limit_and_correct_option():
+    assert errors_of(quiz(explanation='e' * (TelegramLimit.POLL_EXPLANATION_MAX_LEN + 1)))
+    assert errors_of(quiz(correct_option_id=4))
+
+
+def test_regeneration_replaces_a_fixed_question(monkeypatch):
+    monkeypatch.setattr(Parameter, 'REGENERATION_ATTEMPTS', 1)
+    model = FakeModel([quiz(2, explanation='Short.')])
+    questions = {'english': [quiz(1), quiz(2, explanation='e' * 500)]}
+
+    valid = asyncio.run(app.validate_quizzes(model, questions, news=NEWS))
+
+    assert [(q['question_id'], q['explanation']) for q in valid['english']] == [
+        (1, quiz()['explanation']), (2, 'Short.')]
+    assert len(model.prompts) == 1
+
+
+def test_a_rewrite_that_is_still_invalid_is_retried_with_its_new_errors(monkeypatch):
+    monkeypatch.setattr(Parameter, 'REGENERATION_ATTEMPTS', 2)
+    still_bad = quiz(2, options=['went', 'went'])
+    model = FakeModel([still_bad], [quiz(2)])
+    questions = {'english': [quiz(2, correct_option_id=9)]}
+
+    valid = asyncio.run(app.validate_quizzes(model, questions, news=NEWS))
+
+    assert [q['question_id'] for q in valid['english']] == [2]
+    second_prompt = json.dumps(model.prompts[1], ensure_ascii=False)
+    assert 'options must be unique' in second_prompt
+    assert 'out of range' not in second_prompt
+
+
+def test_questions_still_invalid_after_the_last_round_are_dropped(monkeypatch):
+    monkeypatch.setattr(Parameter, 'REGENERATION_ATTEMPTS', 1)
+    model = FakeModel([])
+    questions = {'english': [quiz(1), quiz(2, correct_option_id=9)]}
+
+    valid = asyncio.run(app.validate_quizzes(model, questions, news=NEWS))
+
+    assert [q['question_id'] for q in valid['english']] == [1]
@@ -0,0 +1,109 @@
+import asyncio
+import json
+
+import pytest
+
+from config import Parameter
+from verification import ACCEPT, ESCALATE, REJECT, judge, verify
+
+NEWS = [{'text': f'News {i}'} for i in range(4)]
+
+
+def quiz(question_id):
+    return {'question_id': question_id, 'grammar_topic': 'Past Simple', 'question': f'Question {question_id}',
+            'options': ['go', 'went', 'gone', 'going'], 'correct_option_id': 1, 'explanation': ''}
+
+
+class FakeVerifier:
+    """Answers a batch verification with the `correct_options` it was given per question_id.
+
+    Questions it has no answer for are left out, as a verifier that skips them would; with
+    `usable=False` it answers nothing that parses.
+    """
+
+    def __init__(self, answers: dict = None, usable: bool = True):
+        self.answers = answers or {}
+        self.usable = usable
+        self.calls = 0
+        self.asked = []
+
+    async def agenerate_response(self, messages, call_type=None):
+        self.calls += 1
+        prompt = json.dumps(messages)
+        self.asked.append(sorted(qid for qid in self.answers if f'Question {qid}' in prompt))
+        if not self.usable:
+            return "I cannot answer that"
+        return json.dumps({'english': [{'question_id': qid, 'correct_options': options}
+                                       for qid, options in self.answers.items()]})
+
+
+@pytest.fixture(autouse=True)
+def verifier_order(monkeypatch):
+    monkeypatch.setattr(Parameter, 'VERIFIER_ORDER', ['Gemini', 'OpenAi'])
+
+
+def run(cheap, expensive, questions, policy='tiered'):
+    return asyncio.run(verify(cheap, expensive, {'english': questions}, NEWS, policy=policy))
+
+
+def ids(questions: list) -> list:
+    return [q['question_id'] for q in questions]
+
+
+def test_judge():
+    q = quiz(1)
+    assert judge({'correct_options': ['went']}, q, final=False) == ACCEPT
+    assert judge({'correct_options': ['go']}, q, final=False) == REJECT
+    assert judge({'correct_options': ['went', 'gone']}, q, final=False) == ESCALATE
+    assert judge({'correct_options': ['went', 'gone']}, q, final=True) == REJECT
+    assert judge({'correct_options': None}, q, final=False) == ESCALATE
+    assert judge({'correct_options': None}, q, final=True) == REJECT
+
+
+def test_a_cheap_verifier_that_settles_everything_skips_the_next_one():
+    cheap = FakeVerifier({1: ['went'], 2: ['go']})
+    expensive = FakeVerifier({1: ['went'], 2: ['went']})
+
+    result = run(cheap, expensive, [quiz(1), quiz(2)])
+
+    assert ids(result['good']['english']) == [1]
+    assert ids(result['bad']['english']) == [2]
+    assert expensive.calls == 0
+    assert result['stats']['verifiers_skipped'] == 1
+    assert result['stats']['questions_saved'] == 2
+
+
+def test_only_questions_in_doubt_are_escalated():
+    cheap = FakeVerifier({1: ['went'], 2: ['went', 'gone'], 3: ['went', 'gone']})
+    expensive = FakeVerifier({2: ['went'], 3: ['gone']})
+
+    result = run(cheap, expensive, [quiz(1), quiz(2), quiz(3)])
+
+    assert expensive.asked == [[2, 3]]
+    assert ids(result['good']['english']) == [1, 2]
+    assert ids(result['bad']['english']) == [3]
+    assert result['stats']['verifiers_skipped'] == 0
+    assert result['stats']['questions_saved'] == 1
+
+
+def test_an_unusable_answer_escalates_and_the_last_verifier_rejects_doubt():
+    cheap = FakeVerifier({1: ['went'], 2: ['went']}, usable=False)
+    expensive = FakeVerifier({1: ['went'], 2: ['went', 'gone']})
+
+    result = run(cheap, expensive, [quiz(1), quiz(2)])
+
+    assert cheap.calls == 2  # the batch call and the per-language fallback
+    assert ids(result['good']['english']) == [1]
+    assert ids(result['bad']['english']) == [2]
+    assert result['stats']['calls'] == 3
+
+
+def test_strict_needs_every_verifier_to_agree():
+    cheap = FakeVerifier({1: ['went'], 2: ['went']})
+    expensive = FakeVerifier({1: ['went'], 2: ['go']})
+
+    result = run(cheap, expensive, [quiz(1), quiz(2)], policy='strict')
+
+    assert ids(result['good']['english']) == [1]
+    assert ids(result['bad']['english']) == [2]
+    assert result['stats']['verifiers_skipped'] == 0